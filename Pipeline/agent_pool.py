@@ -0,0 +1,99 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, List
+from camel.agents import ChatAgent
+from metrics import registry
+from fair_scheduler import fair_scheduler
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# 每个角色的ChatAgent数，默认与上游并发数一致：持有上游名额的调用总能立即取到实例
+DEFAULT_POOL_SIZE = int(os.getenv('OJ_AGENT_POOL_SIZE', '0')) or fair_scheduler.max_concurrency or 8
+
+AGENT_POOL_WAIT = registry.histogram(
+    "oj_agent_agent_pool_wait_seconds", "取出ChatAgent实例的等待时间", ["role"])
+AGENT_POOL_IN_USE = registry.gauge(
+    "oj_agent_agent_pool_in_use", "正在使用的ChatAgent实例数", ["role"])
+AGENT_POOL_CREATED = registry.counter(
+    "oj_agent_agent_pool_created_total", "创建的ChatAgent实例数", ["role"])
+
+
+class AgentPool:
+    def __init__(self, role: str, factory: Callable[[], ChatAgent], size: int = DEFAULT_POOL_SIZE,
+                 prewarm: int = 1):
+        """按角色划分的ChatAgent实例池
+
+        ChatAgent带有对话记忆，同一实例被并发调用时上下文会互相污染。每次调用从池中取出一个
+        实例独占使用，归还时重置记忆。实例在需要时由factory创建，最多size个，创建时预先建好
+        prewarm个（创建失败在启动时即可发现）；实例都在使用中时调用方等待归还。
+        """
+        self.role = role
+        self.factory = factory
+        self.size = max(size, 1)
+        self._idle: List[ChatAgent] = []
+        self._created = 0
+        self._condition = threading.Condition()
+        for _ in range(min(prewarm, self.size)):
+            self._idle.append(self._create())
+
+    def _create(self) -> ChatAgent:
+        agent = self.factory()
+        self._created += 1
+        AGENT_POOL_CREATED.inc(role=self.role)
+        return agent
+
+    def checkout(self) -> ChatAgent:
+        """取出一个空闲实例，没有空闲实例且未达上限时创建，否则等待归还"""
+        start = time.perf_counter()
+        with self._condition:
+            while not self._idle and self._created >= self.size:
+                self._condition.wait()
+            if self._idle:
+                agent = self._idle.pop()
+            else:
+                # 先占用名额再创建，创建失败时归还名额
+                self._created += 1
+                agent = None
+        if agent is None:
+            try:
+                agent = self.factory()
+                AGENT_POOL_CREATED.inc(role=self.role)
+                logger.info(f"创建ChatAgent实例 - 角色: {self.role}, 共{self._created}个")
+            except Exception:
+                with self._condition:
+                    self._created -= 1
+                    self._condition.notify()
+                raise
+        AGENT_POOL_WAIT.observe(time.perf_counter() - start, role=self.role)
+        AGENT_POOL_IN_USE.inc(role=self.role)
+        return agent
+
+    def checkin(self, agent: ChatAgent):
+        """归还实例并重置对话记忆，重置失败的实例直接丢弃"""
+        AGENT_POOL_IN_USE.dec(role=self.role)
+        try:
+            agent.reset()
+        except Exception as e:
+            logger.error(f"重置ChatAgent出错，丢弃该实例 - 角色: {self.role}, 错误: {str(e)}")
+            with self._condition:
+                self._created -= 1
+                self._condition.notify()
+            return
+        with self._condition:
+            self._idle.append(agent)
+            self._condition.notify()
+
+    @contextmanager
+    def agent(self):
+        """with pool.agent() as agent: 取出实例，退出时归还"""
+        agent = self.checkout()
+        try:
+            yield agent
+        finally:
+            self.checkin(agent)
@@ -0,0 +1,195 @@
+import os
+import re
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Any, Callable, Dict, List, Optional, Set
+from task_executor import task_executor
+from metrics import ACTIVE_REQUESTS, registry
+from storage import session_store, problem_hash
+import request_context
+import deadlines
+from log_config import setup_logging, format_payload
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# 预取回答的缓存名称及有效期
+PREFETCH_CACHE = "prefetch"
+PREFETCH_TTL = 600
+
+# 学生点击的问题仍在预取时最多等待的秒数，超过后取消预取、正常流式回答
+PREFETCH_MAX_WAIT_SECONDS = 1.0
+
+# 比较问题时忽略的空白和标点
+QUESTION_NOISE = re.compile(r'[\s，。？！、：；“”‘’,.?!:;"\'`]+')
+
+PREFETCH_SCHEDULED = registry.counter(
+    "oj_agent_prefetch_scheduled_total", "预取任务的调度结果", ["result"])
+PREFETCH_COMPLETED = registry.counter(
+    "oj_agent_prefetch_completed_total", "预取任务的完成情况", ["result"])
+PREFETCH_LOOKUPS = registry.counter(
+    "oj_agent_prefetch_lookups_total", "后续问题命中预取回答的情况", ["result"])
+
+
+def normalize_question(question: str) -> str:
+    """归一化问题文本，使界面上点击的预测问题能与预取结果匹配"""
+    return QUESTION_NOISE.sub("", question or "").lower()
+
+
+class AnswerPrefetcher:
+    def __init__(self, max_per_session: int = 3, max_global: int = 4, load_threshold: int = 8,
+                 ttl: float = PREFETCH_TTL, max_wait: float = PREFETCH_MAX_WAIT_SECONDS):
+        """预测问题的回答预取
+
+        回答返回后，在事件循环中以低优先级为预测的后续问题生成回答并写入共享缓存；
+        学生点击预测问题时直接返回预取结果。只预取与代码无关的问题（与代码有关的回答依赖
+        本地评测和代码改动，预取时无法与实时回答一致）。每个会话和全局的并发预取数都有上限，
+        正在处理的请求数超过load_threshold时不再预取；点击的问题仍在预取时最多等待max_wait秒。
+        """
+        self.max_per_session = max_per_session
+        self.max_global = max_global
+        self.load_threshold = load_threshold
+        self.ttl = ttl
+        self.max_wait = max_wait
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._session_keys: Dict[str, Set[str]] = {}
+        # 会话ID -> 预取完成时的回调（WebSocket会话用来推送预取结果）
+        self._listeners: Dict[str, Callable[[str, str], None]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_per_session > 0 and self.max_global > 0
+
+    def _key(self, session_id: str, question: str) -> str:
+        """预取结果的键：会话 + 问题 + 题目，题目变化后不会命中旧回答"""
+        question_digest = hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()[:16]
+        return f"{session_id}:{question_digest}:{problem_hash(task_executor.problem_content)}"
+
+    def _overloaded(self) -> bool:
+        return ACTIVE_REQUESTS.value() > self.load_threshold
+
+    def schedule(self, predicted_questions: List[Dict[str, Any]], need_code: bool):
+        """为预测的问题提交预取任务，需在事件循环中调用（任务继承当前会话上下文）"""
+        session_id = request_context.get_session_id()
+        if not self.enabled or not predicted_questions or session_id == request_context.DEFAULT_SESSION_ID:
+            return
+        if need_code:
+            PREFETCH_SCHEDULED.inc(result="need_code")
+            return
+
+        questions = [q.get('question', '') for q in predicted_questions if q.get('question')]
+        keys = {self._key(session_id, q): q for q in questions[:self.max_per_session]}
+
+        # 新一轮预测产生后，本会话旧的预取任务已经过时
+        for key in self._session_keys.get(session_id, set()) - set(keys):
+            task = self._tasks.get(key)
+            if task is not None:
+                task.cancel()
+
+        for key, question in keys.items():
+            if key in self._tasks or session_store.cache_get(PREFETCH_CACHE, key) is not None:
+                PREFETCH_SCHEDULED.inc(result="duplicate")
+            elif len(self._tasks) >= self.max_global:
+                PREFETCH_SCHEDULED.inc(result="global_cap")
+            elif self._overloaded():
+                PREFETCH_SCHEDULED.inc(result="overloaded")
+            else:
+                PREFETCH_SCHEDULED.inc(result="scheduled")
+                self._tasks[key] = asyncio.create_task(self._run(session_id, key, question))
+                self._session_keys.setdefault(session_id, set()).add(key)
+
+    async def _run(self, session_id: str, key: str, question: str) -> Optional[str]:
+        """生成并缓存一个预测问题的回答"""
+        try:
+            # 让出事件循环，优先处理已经到达的用户请求
+            await asyncio.sleep(0)
+            if self._overloaded():
+                PREFETCH_COMPLETED.inc(result="overloaded")
+                return None
+            logger.info(f"开始预取回答: {format_payload(question, 100)}")
+            answer = await task_executor.prefetch_answer(question)
+            if not answer:
+                PREFETCH_COMPLETED.inc(result="empty")
+                return None
+            session_store.cache_set(PREFETCH_CACHE, key, {
+                'question': question,
+                'answer': answer,
+                'created_at': time.time()
+            }, ttl=self.ttl)
+            PREFETCH_COMPLETED.inc(result="ok")
+            listener = self._listeners.get(session_id)
+            if listener is not None:
+                listener(question, answer)
+            return answer
+        except asyncio.CancelledError:
+            PREFETCH_COMPLETED.inc(result="cancelled")
+            raise
+        except Exception as e:
+            PREFETCH_COMPLETED.inc(result="failed")
+            logger.error(f"预取回答时出错: {str(e)}")
+            return None
+        finally:
+            self._tasks.pop(key, None)
+            keys = self._session_keys.get(session_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    self._session_keys.pop(session_id, None)
+
+    async def take(self, query: str, need_code: bool) -> Optional[str]:
+        """查找与问题匹配的预取回答；预取仍在进行时最多等待max_wait秒（不超过回答阶段的预算），
+        仍未完成时取消预取，由调用方正常流式回答"""
+        session_id = request_context.get_session_id()
+        if not self.enabled or need_code or session_id == request_context.DEFAULT_SESSION_ID:
+            return None
+        key = self._key(session_id, query)
+        try:
+            entry = session_store.cache_get(PREFETCH_CACHE, key)
+            if entry is not None:
+                PREFETCH_LOOKUPS.inc(result="hit")
+                return entry['answer']
+            task = self._tasks.get(key)
+            if task is not None:
+                budget = deadlines.stage_budget('answer')
+                wait = self.max_wait if budget is None else min(self.max_wait, budget)
+                # asyncio.wait不会因预取任务被取消而抛出异常，也不会在本请求取消时取消预取任务
+                done, _ = await asyncio.wait({task}, timeout=wait)
+                if not done:
+                    task.cancel()
+                    PREFETCH_LOOKUPS.inc(result="inflight_timeout")
+                    return None
+                answer = None if task.cancelled() else task.result()
+                PREFETCH_LOOKUPS.inc(result="inflight_hit" if answer else "miss")
+                return answer
+        except Exception as e:
+            logger.error(f"读取预取回答时出错: {str(e)}")
+        PREFETCH_LOOKUPS.inc(result="miss")
+        return None
+
+    def subscribe(self, session_id: str, listener: Callable[[str, str], None]):
+        """登记会话的预取完成回调listener(question, answer)，回调在事件循环中调用，不能阻塞"""
+        self._listeners[session_id] = listener
+
+    def unsubscribe(self, session_id: str):
+        """取消会话的预取完成回调"""
+        self._listeners.pop(session_id, None)
+
+    def cancel_session(self, session_id: str) -> int:
+        """取消某个会话的全部预取任务，返回取消的数量"""
+        cancelled = 0
+        for key in list(self._session_keys.get(session_id, ())):
+            task = self._tasks.get(key)
+            if task is not None and task.cancel():
+                cancelled += 1
+        return cancelled
+
+# 创建全局预取实例
+answer_prefetcher = AnswerPrefetcher(
+    max_per_session=int(os.getenv('OJ_PREFETCH_PER_SESSION', '3')),
+    max_global=int(os.getenv('OJ_PREFETCH_MAX_GLOBAL', '4')),
+    load_threshold=int(os.getenv('OJ_PREFETCH_LOAD_THRESHOLD', '8')),
+    max_wait=float(os.getenv('OJ_PREFETCH_MAX_WAIT_SECONDS', str(PREFETCH_MAX_WAIT_SECONDS)))
+)
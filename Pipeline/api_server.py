@@ -0,0 +1,291 @@
+import os
+import csv
+import io
+import hmac
+import json
+import time
+import asyncio
+import logging
+from contextlib import aclosing
+from typing import Any, AsyncGenerator, Dict, List, Optional
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from recognition_server import recognition_server
+from usage_ledger import usage_ledger, RECORD_FIELDS
+from problem_artifacts import problem_precomputer, ARTIFACT_CACHE
+from storage import session_store
+from conversation_store import conversation_store
+from retrieval_index import retrieval_index
+from fair_scheduler import fair_scheduler
+from stream_framer import StreamFramer, accepts_gzip
+from ws_session import WebSocketSession
+from request_profiler import request_profiler
+import request_context
+import metrics
+import deadlines
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="AI编程助手")
+
+# 检查客户端是否断开的间隔（秒）
+DISCONNECT_POLL_SECONDS = float(os.getenv('OJ_DISCONNECT_POLL_SECONDS', '0.5'))
+
+# 用量汇总支持的维度
+USAGE_DIMENSIONS = ("session_id", "user_id", "role", "cache")
+
+# 管理接口（用量查询与导出、登记题目）的口令，未设置时不开放这些接口
+ADMIN_TOKEN = os.getenv('OJ_ADMIN_TOKEN', '')
+
+
+class AnalyzeRequest(BaseModel):
+    query: str
+    problem_content: str = ""
+    editor_code: str = ""
+    session_id: str = ""
+    user_id: str = ""
+
+
+class ProblemRequest(BaseModel):
+    problem_content: str
+    editorial: Optional[str] = None
+
+
+class ProfileArmRequest(BaseModel):
+    count: int = 1
+    name: Optional[str] = None
+
+
+def _request_id(http_request: Request) -> str:
+    """沿用调用方传入的X-Request-ID，否则生成新的请求ID"""
+    return http_request.headers.get("x-request-id") or request_context.new_request_id()
+
+
+def _profile_token(http_request: Request) -> Optional[str]:
+    """剖析口令（X-Profile-Token请求头）"""
+    return http_request.headers.get("x-profile-token")
+
+
+def _require_profiler(http_request: Request):
+    """剖析结果接口只在设置了OJ_PROFILE_TOKEN且口令正确时开放"""
+    if not request_profiler.enabled:
+        raise HTTPException(status_code=404, detail="未开启请求剖析")
+    if not request_profiler.authorized(_profile_token(http_request)):
+        raise HTTPException(status_code=403, detail="剖析口令错误")
+
+
+def _require_admin(http_request: Request):
+    """用量接口包含各用户和会话的记录，只在设置了OJ_ADMIN_TOKEN且X-Admin-Token口令正确时开放"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="未开启管理接口")
+    token = http_request.headers.get("x-admin-token") or ""
+    if not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="管理口令错误")
+
+
+def _deadline(http_request: Request) -> float:
+    """按调用方传入的X-Request-Timeout（秒）设置请求截止时间，未传入时使用默认预算"""
+    try:
+        seconds = float(http_request.headers.get("x-request-timeout") or 0)
+    except ValueError:
+        seconds = 0
+    return deadlines.new_deadline(seconds)
+
+
+async def _watch_disconnect(http_request: Request, task: asyncio.Task):
+    """客户端断开时取消生成事件流的任务，取消会沿调用链传到上游流"""
+    while not await http_request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+    logger.info("检测到客户端断开")
+    task.cancel()
+
+
+async def _event_stream(request: AnalyzeRequest, received_at: float, request_id: str,
+                        http_request: Request, deadline: float,
+                        framer: StreamFramer) -> AsyncGenerator[bytes, None]:
+    """生成SSE事件流，由framer合并回答片段并按需压缩"""
+    metrics.observe_queue_wait('request', time.perf_counter() - received_at)
+    watcher = asyncio.create_task(_watch_disconnect(http_request, asyncio.current_task()))
+    try:
+        with request_profiler.profile("stream", request_id, _profile_token(http_request)), \
+                request_context.bind(session_id=request.session_id, user_id=request.user_id,
+                                     request_id=request_id, deadline=deadline):
+            async with aclosing(recognition_server.process_request_stream(
+                query=request.query,
+                problem_content=request.problem_content,
+                editor_code=request.editor_code
+            )) as events:
+                # 上游调用排队期间插入queued事件，告知学生排队位置
+                async with aclosing(fair_scheduler.with_queue_events(events)) as merged:
+                    async with aclosing(framer.frames(merged)) as frames:
+                        async for frame in frames:
+                            yield frame
+    finally:
+        watcher.cancel()
+
+
+@app.post("/api/analyze")
+async def analyze(request: AnalyzeRequest, http_request: Request, http_response: Response) -> Dict[str, Any]:
+    """非流式处理请求"""
+    received_at = time.perf_counter()
+    request_id = _request_id(http_request)
+    deadline = _deadline(http_request)
+    http_response.headers["X-Request-ID"] = request_id
+
+    def job():
+        metrics.observe_queue_wait('request', time.perf_counter() - received_at)
+        with request_context.bind(session_id=request.session_id, user_id=request.user_id,
+                                  request_id=request_id, deadline=deadline):
+            return recognition_server.process_request(
+                query=request.query,
+                problem_content=request.problem_content,
+                editor_code=request.editor_code
+            )
+
+    with request_profiler.profile("analyze", request_id, _profile_token(http_request)):
+        return await run_in_threadpool(job)
+
+
+@app.post("/api/analyze/stream")
+async def analyze_stream(request: AnalyzeRequest, http_request: Request) -> StreamingResponse:
+    """流式处理请求"""
+    request_id = _request_id(http_request)
+    framer = StreamFramer(compress=accepts_gzip(http_request.headers.get("accept-encoding")))
+    headers = {"X-Request-ID": request_id}
+    if framer.compressed:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(_event_stream(request, time.perf_counter(), request_id, http_request,
+                                           _deadline(http_request), framer),
+                             media_type="text/event-stream",
+                             headers=headers)
+
+
+@app.websocket("/api/ws")
+async def websocket_session(websocket: WebSocket):
+    """持久会话：题目和代码只发送一次（之后发送补丁），问题的事件、预测问题和预取回答由服务端推送"""
+    await websocket.accept()
+    await WebSocketSession(websocket).run()
+
+
+@app.post("/api/problems")
+async def register_problem(request: ProblemRequest, http_request: Request) -> Dict[str, Any]:
+    """登记题目（例如在上课前），首次见到时在后台预计算题目级结果，可同时提供题解
+
+    预计算会调用模型且不经过准入和配额，只对持有管理口令的调用方开放。
+    """
+    _require_admin(http_request)
+    digest = await run_in_threadpool(problem_precomputer.submit, request.problem_content)
+    if digest is None:
+        raise HTTPException(status_code=400, detail="题目内容为空")
+    if request.editorial:
+        # 教师提供的题解写入题目检索索引，之后会原样作为兜底回答并加入同一题目所有学生的上下文，
+        # 因此只接受持有管理口令的调用方提交
+        await run_in_threadpool(retrieval_index.add, request.problem_content, "editorial", request.editorial)
+    return {"problem_hash": digest}
+
+
+@app.get("/api/problems/{digest}")
+async def get_problem_artifacts(digest: str) -> Dict[str, Any]:
+    """查询题目的预计算结果，尚未完成时返回404"""
+    artifacts = await run_in_threadpool(session_store.cache_get, ARTIFACT_CACHE, digest)
+    if artifacts is None:
+        raise HTTPException(status_code=404, detail="预计算结果不存在或尚未完成")
+    return artifacts
+
+
+@app.post("/api/profiles/arm")
+async def arm_profiles(request: ProfileArmRequest, http_request: Request) -> Dict[str, Any]:
+    """预约剖析接下来的count个请求（name为analyze/stream/ws时只剖析该类请求），count为0时取消预约"""
+    _require_profiler(http_request)
+    armed = request_profiler.arm(request.count, request.name)
+    return {"armed": [{"name": name, "count": count} for name, count in armed.items()]}
+
+
+@app.get("/api/profiles")
+async def list_profiles(http_request: Request) -> List[Dict[str, Any]]:
+    """列出剖析结果，最新的在前"""
+    _require_profiler(http_request)
+    return await run_in_threadpool(request_profiler.list)
+
+
+@app.get("/api/profiles/{profile_id}")
+async def get_profile(profile_id: str, http_request: Request, format: str = "json") -> Response:
+    """读取一个剖析结果，format=collapsed时返回折叠栈文本（可用flamegraph.pl或speedscope查看）"""
+    _require_profiler(http_request)
+    result = await run_in_threadpool(request_profiler.load, profile_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="剖析结果不存在")
+    if format == "collapsed":
+        return PlainTextResponse(request_profiler.collapsed(result))
+    return Response(json.dumps(result, ensure_ascii=False), media_type="application/json")
+
+
+@app.get("/metrics")
+async def get_metrics() -> PlainTextResponse:
+    """以Prometheus文本格式导出指标"""
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/api/usage")
+async def get_usage(http_request: Request, group_by: str = "session_id,role", session_id: Optional[str] = None,
+                    user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """按维度汇总token用量，group_by可选session_id/user_id/role/cache"""
+    _require_admin(http_request)
+    dimensions = [d.strip() for d in group_by.split(",") if d.strip() in USAGE_DIMENSIONS]
+    return usage_ledger.summary(dimensions, session_id=session_id, user_id=user_id)
+
+
+def _require_history():
+    if conversation_store is None:
+        raise HTTPException(status_code=404, detail="未开启会话历史")
+
+
+@app.get("/api/history/problems/{digest}/answers")
+async def get_problem_history(digest: str, http_request: Request, limit: int = 100) -> List[Dict[str, Any]]:
+    """某道题目的历史回答（最新的在前），digest为题目哈希"""
+    _require_admin(http_request)
+    _require_history()
+    return await run_in_threadpool(conversation_store.answers_for_problem, digest, min(limit, 1000))
+
+
+@app.get("/api/history/users/{user_id}/turns")
+async def get_user_history(user_id: str, http_request: Request, limit: int = 100) -> List[Dict[str, Any]]:
+    """某个用户的历史提问（最新的在前）"""
+    _require_admin(http_request)
+    _require_history()
+    return await run_in_threadpool(conversation_store.turns_for_user, user_id, min(limit, 1000))
+
+
+@app.get("/api/history/usage")
+async def get_history_usage(http_request: Request, since: float = 0.0) -> List[Dict[str, Any]]:
+    """按用户和角色汇总历史库中的token用量（包括进程重启之前和其他工作进程的用量）"""
+    _require_admin(http_request)
+    _require_history()
+    return await run_in_threadpool(conversation_store.usage_by_user, since)
+
+
+@app.get("/api/usage/export")
+async def export_usage(http_request: Request, format: str = "jsonl", session_id: Optional[str] = None,
+                       user_id: Optional[str] = None, role: Optional[str] = None,
+                       since: Optional[float] = None) -> PlainTextResponse:
+    """批量导出用量明细（jsonl或csv）"""
+    _require_admin(http_request)
+    records = usage_ledger.query(session_id=session_id, user_id=user_id, role=role, since=since)
+    if format == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=RECORD_FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+        return PlainTextResponse(buffer.getvalue(), media_type="text/csv")
+    body = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+    return PlainTextResponse(body, media_type="application/x-ndjson")
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=5001)
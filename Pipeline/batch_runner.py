@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+import logging
+from contextlib import aclosing
+from typing import Any, Dict, Iterator, Optional, Tuple
+from recognition_server import recognition_server
+from answer_prefetcher import answer_prefetcher
+from fair_scheduler import fair_scheduler
+from load_tester import percentile
+import request_context
+import deadlines
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# 每条记录使用独立会话，避免记录之间共享题目和代码
+BATCH_SESSION_PREFIX = "batch"
+BATCH_USER_ID = "batch"
+
+# 已完成但因前面的记录未完成而暂存的结果数上限（相对于并发数的倍数）
+REORDER_WINDOW_FACTOR = 4
+
+
+def read_records(path: str, skip: int = 0) -> Iterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+    """逐行读取JSONL输入，产出(序号, 记录, 错误)，跳过前skip条和空行"""
+    with open(path, encoding="utf-8") as f:
+        index = 0
+        for line in f:
+            if not line.strip():
+                continue
+            if index >= skip:
+                try:
+                    record = json.loads(line)
+                    if not isinstance(record, dict) or not record.get("query"):
+                        raise ValueError("缺少query字段")
+                    yield index, record, None
+                except ValueError as e:
+                    yield index, None, f"无效记录: {str(e)}"
+            index += 1
+
+
+def completed_count(path: str) -> int:
+    """统计输出文件中已完成的记录数，并截掉中断时写了一半的最后一行"""
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    return data[:end].count(b"\n")
+
+
+async def run_record(index: int, record: Dict[str, Any], budget: Optional[float]) -> Dict[str, Any]:
+    """用完整流水线处理一条记录，记录各事件的时间点"""
+    result = {
+        "index": index,
+        "id": record.get("id"),
+        "query": record["query"],
+        "ok": False,
+        "action": None,
+        "need_code": None,
+        "answer": "",
+        "predicted_questions": [],
+        "degraded": [],
+        "error": None,
+        "timings": {"intent_seconds": None, "ttft_seconds": None, "total_seconds": None}
+    }
+    parts = []
+    start = time.perf_counter()
+    session_id = record.get("session_id") or f"{BATCH_SESSION_PREFIX}-{index}"
+    deadline = deadlines.new_deadline(budget) if budget else None
+    try:
+        with request_context.bind(session_id=session_id, user_id=BATCH_USER_ID,
+                                  request_id=request_context.new_request_id(), deadline=deadline):
+            async with aclosing(recognition_server.process_request_stream(
+                query=record["query"],
+                problem_content=record.get("problem_content", ""),
+                editor_code=record.get("editor_code", "")
+            )) as events:
+                async for event in events:
+                    elapsed = round(time.perf_counter() - start, 3)
+                    if event["type"] == "intent":
+                        result["timings"]["intent_seconds"] = elapsed
+                        result["action"] = event["data"]["action"]
+                        result["need_code"] = event["data"]["need_code"]
+                    elif event["type"] == "content":
+                        if result["timings"]["ttft_seconds"] is None:
+                            result["timings"]["ttft_seconds"] = elapsed
+                        parts.append(event["data"])
+                    elif event["type"] == "predicted_questions":
+                        result["predicted_questions"] = event["data"]
+                    elif event["type"] == "degraded":
+                        result["degraded"].append(event["data"])
+                    elif event["type"] in ("error", "rejected"):
+                        result["error"] = str(event["data"])
+        result["ok"] = result["error"] is None and result["action"] not in (None, "block")
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {str(e)}"
+    result["answer"] = "".join(parts)
+    result["timings"]["total_seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+async def run_batch(input_path: str, output_path: str, concurrency: int = 4, resume: bool = False,
+                    budget: Optional[float] = None) -> Dict[str, Any]:
+    """以有限并发处理JSONL输入，按输入顺序逐条写出结果
+
+    输出文件本身即检查点：每条结果写完立即落盘，resume时跳过输出中已有的记录继续处理。
+    """
+    skip = completed_count(output_path) if resume else 0
+    if skip:
+        logger.info(f"从第 {skip} 条记录继续处理")
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+    window = asyncio.Semaphore(concurrency * REORDER_WINDOW_FACTOR)
+    finished: Dict[int, Dict[str, Any]] = {}
+    next_index = skip
+    totals = []
+    errors = 0
+    started = time.perf_counter()
+
+    with open(output_path, "a" if resume else "w", encoding="utf-8") as out:
+
+        def flush():
+            # 只写出从next_index开始连续完成的结果，保证输出顺序与输入一致
+            nonlocal next_index, errors
+            while next_index in finished:
+                result = finished.pop(next_index)
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                totals.append(result["timings"]["total_seconds"])
+                errors += 0 if result["ok"] else 1
+                next_index += 1
+                window.release()
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                index, record, error = item
+                if error is not None:
+                    result = {"index": index, "ok": False, "error": error, "timings": {"total_seconds": 0.0}}
+                else:
+                    result = await run_record(index, record, budget)
+                logger.info(f"记录 {index} 完成 - action: {result.get('action')}, "
+                            f"耗时: {result['timings']['total_seconds']}秒")
+                finished[index] = result
+                flush()
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        for item in read_records(input_path, skip):
+            # 前面的记录迟迟未完成时暂停读取，限制暂存的结果数
+            await window.acquire()
+            await queue.put(item)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+    wall = time.perf_counter() - started
+    return {
+        "processed": len(totals),
+        "skipped": skip,
+        "errors": errors,
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(totals) / wall, 3) if wall > 0 else None,
+        "total": {f"p{int(q * 100)}": percentile(totals, q) for q in (0.5, 0.95, 0.99)}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量离线处理JSONL问题集")
+    parser.add_argument("input", help="输入JSONL，每行包含query，可选problem_content、editor_code、id、session_id")
+    parser.add_argument("output", help="输出JSONL，按输入顺序写出回答和各阶段耗时")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时处理的记录数")
+    parser.add_argument("--resume", action="store_true", help="跳过输出文件中已完成的记录继续处理")
+    parser.add_argument("--budget", type=float, default=None, help="每条记录的时间预算（秒），默认不限时")
+    parser.add_argument("--prefetch", action="store_true", help="为预测问题预取回答（默认关闭）")
+    args = parser.parse_args()
+
+    if not args.prefetch:
+        # 批量处理时没有学生点击预测问题，预取只会浪费token
+        answer_prefetcher.max_per_session = 0
+    # 所有记录属于同一批量用户，不受单用户请求数和token配额限制
+    fair_scheduler.requests_per_minute = 0
+    fair_scheduler.tokens_per_minute = 0
+    summary = asyncio.run(run_batch(args.input, args.output, max(args.concurrency, 1),
+                                    args.resume, args.budget))
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import json
+import random
+import asyncio
+import pytest
+import batch_runner
+from batch_runner import completed_count, read_records, run_batch
+
+
+@pytest.fixture
+def fake_pipeline(monkeypatch):
+    """用随机耗时的假流水线代替完整流水线，记录实际处理的记录"""
+    processed = []
+
+    async def run_record(index, record, budget):
+        processed.append(index)
+        seconds = random.uniform(0, 0.01)
+        await asyncio.sleep(seconds)
+        return {"index": index, "query": record["query"], "ok": True, "answer": record["query"].upper(),
+                "timings": {"total_seconds": seconds}}
+
+    monkeypatch.setattr(batch_runner, "run_record", run_record)
+    return processed
+
+
+def _write_input(path, count, invalid=()):
+    lines = []
+    for i in range(count):
+        lines.append("not json" if i in invalid else json.dumps({"id": i, "query": f"q{i}"}))
+        if i % 5 == 0:
+            lines.append("")
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def _read_output(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_read_records_skips_blank_lines_and_reports_invalid(tmp_path):
+    path = tmp_path / "in.jsonl"
+    path.write_text('{"query": "a"}\n\n[1]\n{"id": 3}\nnot json\n{"query": "b"}\n', encoding="utf-8")
+    records = list(read_records(str(path)))
+    assert [index for index, _, _ in records] == [0, 1, 2, 3, 4]
+    assert records[0][1] == {"query": "a"} and records[4][1] == {"query": "b"}
+    assert all(record is None and error for _, record, error in records[1:4])
+    assert [index for index, _, _ in read_records(str(path), skip=3)] == [3, 4]
+
+
+def test_completed_count_truncates_partial_line(tmp_path):
+    path = tmp_path / "out.jsonl"
+    assert completed_count(str(path)) == 0
+    path.write_bytes(b'{"index": 0}\n{"index": 1}\n{"ind')
+    assert completed_count(str(path)) == 2
+    assert path.read_bytes() == b'{"index": 0}\n{"index": 1}\n'
+
+
+def test_output_keeps_input_order(tmp_path, fake_pipeline):
+    input_path, output_path = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    _write_input(input_path, 30, invalid={7})
+    summary = asyncio.run(run_batch(str(input_path), str(output_path), concurrency=4))
+    results = _read_output(output_path)
+    assert [r["index"] for r in results] == list(range(30))
+    assert not results[7]["ok"] and results[7]["error"].startswith("无效记录")
+    assert results[8]["answer"] == "Q8"
+    assert summary["processed"] == 30 and summary["errors"] == 1 and summary["skipped"] == 0
+
+
+def test_resume_after_interruption(tmp_path, fake_pipeline):
+    input_path, output_path = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    _write_input(input_path, 20)
+    asyncio.run(run_batch(str(input_path), str(output_path), concurrency=3))
+    complete = output_path.read_text(encoding="utf-8").splitlines()
+
+    # 模拟处理到第12条时中断，最后一行只写了一半
+    output_path.write_text("\n".join(complete[:12]) + "\n" + complete[12][:10], encoding="utf-8")
+    fake_pipeline.clear()
+    summary = asyncio.run(run_batch(str(input_path), str(output_path), concurrency=3, resume=True))
+
+    assert sorted(fake_pipeline) == list(range(12, 20))
+    assert summary["skipped"] == 12 and summary["processed"] == 8
+    assert [r["index"] for r in _read_output(output_path)] == list(range(20))
+
+
+def test_resume_with_finished_output_does_nothing(tmp_path, fake_pipeline):
+    input_path, output_path = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    _write_input(input_path, 5)
+    asyncio.run(run_batch(str(input_path), str(output_path), concurrency=2))
+    fake_pipeline.clear()
+    summary = asyncio.run(run_batch(str(input_path), str(output_path), concurrency=2, resume=True))
+    assert fake_pipeline == [] and summary["processed"] == 0 and summary["skipped"] == 5
+    assert len(_read_output(output_path)) == 5
+
+
+def test_without_resume_output_is_overwritten(tmp_path, fake_pipeline):
+    input_path, output_path = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    _write_input(input_path, 5)
+    output_path.write_text('{"index": 0}\n{"index": 1}\n', encoding="utf-8")
+    summary = asyncio.run(run_batch(str(input_path), str(output_path), concurrency=2))
+    assert summary["skipped"] == 0
+    assert [r["index"] for r in _read_output(output_path)] == list(range(5))
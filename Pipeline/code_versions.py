@@ -0,0 +1,244 @@
+import os
+import ast
+import difflib
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from metrics import registry
+from storage import session_store, problem_hash
+from sample_judge import code_digest, detect_function
+import request_context
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# 上一版代码摘要加改动不超过完整代码的这一比例时，上下文中只放摘要和改动
+DIFF_PROMPT_RATIO = float(os.getenv('OJ_CODE_DIFF_RATIO', '0.6'))
+# 代码没有实质改动时复用的回答缓存名称及有效期
+CODE_ANSWER_CACHE = "code_answer"
+CODE_ANSWER_TTL = 3600
+# 模块级语句（导入、全局变量、类的属性）组成的代码单元名称
+MODULE_UNIT = "<module>"
+
+CODE_PROMPTS = registry.counter(
+    "oj_agent_code_prompts_total", "上下文中编辑区代码的形式（full完整代码，diff摘要加改动）", ["form"])
+CODE_ARTIFACT_REUSE = registry.counter(
+    "oj_agent_code_artifact_reuse_total", "代码未实质改动而复用的分析结果", ["artifact"])
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def split_units(code: str) -> Optional[Dict[str, Dict[str, Any]]]:
+    """把代码拆分为函数单元：顶层函数、顶层类中的方法（名称为类名.方法名），其余语句归入MODULE_UNIT
+
+    每个单元记录源码行范围、签名、调用的函数名，以及语法树的哈希（不受空白、注释和行号影响）；
+    MODULE_UNIT的源码为模块级语句和类头、类属性。代码无法解析时返回None。
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    lines = code.splitlines()
+    units: Dict[str, Dict[str, Any]] = {}
+    module_nodes: List[str] = []
+    module_sources: List[str] = []
+
+    def source(node: ast.AST) -> str:
+        start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+        return "\n".join(lines[start - 1:node.end_lineno])
+
+    def add(name: str, node: ast.AST):
+        start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+        calls = sorted({n.func.id if isinstance(n.func, ast.Name) else n.func.attr
+                        for n in ast.walk(node)
+                        if isinstance(n, ast.Call) and isinstance(n.func, (ast.Name, ast.Attribute))})
+        units[name] = {
+            "name": name,
+            "start": start,
+            "end": node.end_lineno,
+            "signature": lines[node.lineno - 1].strip(),
+            "source": "\n".join(lines[start - 1:node.end_lineno]),
+            "calls": calls,
+            "digest": _digest(ast.dump(node))
+        }
+
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            add(node.name, node)
+        elif isinstance(node, ast.ClassDef):
+            rest = []
+            header = lines[min([node.lineno] + [d.lineno for d in node.decorator_list]) - 1:node.lineno]
+            for item in node.body:
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    add(f"{node.name}.{item.name}", item)
+                else:
+                    rest.append(ast.dump(item))
+                    header.append(source(item))
+            module_nodes.append(f"class {node.name}({','.join(ast.dump(b) for b in node.bases)}):{rest}")
+            module_sources.append("\n".join(header))
+        else:
+            module_nodes.append(ast.dump(node))
+            module_sources.append(source(node))
+    calls = sorted({n.func.id if isinstance(n.func, ast.Name) else n.func.attr
+                    for node in tree.body if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+                    for n in ast.walk(node)
+                    if isinstance(n, ast.Call) and isinstance(n.func, (ast.Name, ast.Attribute))})
+    units[MODULE_UNIT] = {"name": MODULE_UNIT, "digest": _digest("\n".join(module_nodes)),
+                          "source": "\n".join(module_sources), "calls": calls}
+    return units
+
+
+def semantic_digest(code: str, units: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+    """整段代码语法树的哈希，只改空白和注释时不变；无法解析时退回原文哈希"""
+    units = units if units is not None else split_units(code)
+    if units is None:
+        return code_digest(code)
+    return _digest("|".join(f"{name}:{unit['digest']}" for name, unit in sorted(units.items())))
+
+
+def artifact_digest(code: str) -> str:
+    """样例评测用到的代码的哈希：入口函数及其（间接）调用的函数，加上模块级语句
+
+    只改动了评测不会执行的函数时哈希不变，可以复用上一版代码的评测结果。
+    没有入口函数（作为标准输入程序运行）时等同于semantic_digest。
+    """
+    units = split_units(code)
+    if units is None:
+        return code_digest(code)
+    entry = detect_function(code)
+    if entry is None or entry not in units:
+        return semantic_digest(code, units)
+    by_short_name: Dict[str, List[str]] = {}
+    for name in units:
+        by_short_name.setdefault(name.rsplit(".", 1)[-1], []).append(name)
+    reachable = {MODULE_UNIT}
+    pending = [entry] + [name for call in units[MODULE_UNIT]["calls"] for name in by_short_name.get(call, [])]
+    while pending:
+        name = pending.pop()
+        if name in reachable:
+            continue
+        reachable.add(name)
+        for call in units[name]["calls"]:
+            pending.extend(by_short_name.get(call, []))
+    return _digest("|".join(f"{name}:{units[name]['digest']}" for name in sorted(reachable)))
+
+
+def _unit_diff(old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]) -> List[str]:
+    """单元的完整diff：未改动的行作为上下文全部保留，模型能看到修改后的整个函数"""
+    old_lines = old["source"].splitlines() if old else []
+    new_lines = new["source"].splitlines() if new else []
+    start = (new or old)["start"]
+    header = f"@@ {(new or old)['name']}（第{start}行起）@@"
+    body = [line for line in difflib.ndiff(old_lines, new_lines) if not line.startswith("? ")]
+    return [header] + [f"{line[0]}{line[2:]}" if line[0] in "+-" else f" {line[2:]}" for line in body]
+
+
+class CodeVersions:
+    def __init__(self, ratio: float = DIFF_PROMPT_RATIO):
+        """按会话记录编辑区代码的版本，供上下文和分析结果复用
+
+        每次需要代码的提问更新一次版本，保留上一版代码。上下文中可以只放上一版代码的结构摘要
+        （各函数的签名和行号）和按函数给出的改动，代码分析结果按只与实际执行代码相关的哈希缓存。
+        """
+        self.ratio = ratio
+
+    def update(self, code: str) -> int:
+        """记录当前会话的新代码，返回版本号；代码与当前版本相同时版本号不变"""
+        session_id = request_context.get_session_id()
+        current = session_store.get_field(session_id, 'editor_code', '')
+        version = session_store.get_field(session_id, 'editor_code_version', 0)
+        if code == current:
+            return version
+        version += 1
+        if current:
+            session_store.set_field(session_id, 'editor_code_previous', current)
+        session_store.set_field(session_id, 'editor_code', code)
+        session_store.set_field(session_id, 'editor_code_version', version)
+        logger.info(f"编辑区代码更新到第{version}版")
+        return version
+
+    def prompt_code(self, code: str, query: str = "") -> Tuple[str, str]:
+        """上下文中的编辑区代码，返回(文本, 形式)
+
+        与上一版代码相比只改动了部分函数、且摘要加改动明显短于完整代码时，形式为diff：
+        上一版代码的结构摘要、改动的函数（完整列出并标注增删行）、完整的模块级代码，以及调用了改动函数、
+        被改动函数调用或问题中提到的未改动函数；模块级语句有改动、代码无法解析或没有上一版代码时给出完整代码。
+        """
+        previous = session_store.get_field(request_context.get_session_id(), 'editor_code_previous', '')
+        text = self._diff_text(previous, code, query) if previous and previous != code else None
+        form = "diff" if text is not None and len(text) <= len(code) * self.ratio else "full"
+        CODE_PROMPTS.inc(form=form)
+        if form == "full":
+            return f"用户代码:\n{code}", form
+        return text, form
+
+    @staticmethod
+    def _diff_text(previous: str, code: str, query: str) -> Optional[str]:
+        old_units, new_units = split_units(previous), split_units(code)
+        if old_units is None or new_units is None:
+            return None
+        if old_units[MODULE_UNIT]["digest"] != new_units[MODULE_UNIT]["digest"]:
+            return None
+        names = [name for name in new_units if name != MODULE_UNIT] + \
+                [name for name in old_units if name != MODULE_UNIT and name not in new_units]
+        changed = [name for name in names
+                   if old_units.get(name, {}).get("digest") != new_units.get(name, {}).get("digest")]
+        if not changed:
+            return None
+
+        summary = []
+        for name, unit in old_units.items():
+            if name == MODULE_UNIT:
+                continue
+            mark = "（已修改）" if name in changed else ""
+            summary.append(f"- 第{unit['start']}-{unit['end']}行 {unit['signature']}{mark}")
+        diff = []
+        for name in changed:
+            diff.extend(_unit_diff(old_units.get(name), new_units.get(name)))
+
+        # 调用了改动函数的、被改动函数调用的，以及问题中提到的未改动函数也要完整给出
+        called = {call for name in changed for call in new_units.get(name, {}).get("calls", [])}
+        changed_short_names = {name.rsplit(".", 1)[-1] for name in changed}
+        related = []
+        for name, unit in new_units.items():
+            short_name = name.rsplit(".", 1)[-1]
+            if name != MODULE_UNIT and name not in changed and \
+                    (short_name in called or changed_short_names.intersection(unit["calls"]) or
+                     (len(short_name) > 1 and short_name in query)):
+                related.append(unit["source"])
+
+        text = "用户代码（与上一次提问时相比只改动了部分函数）:\n上一版代码的结构:\n" + "\n".join(summary)
+        text += "\n\n本次改动（+为新增行，-为删除行）:\n```diff\n" + "\n".join(diff) + "\n```"
+        module_source = new_units[MODULE_UNIT]["source"].strip()
+        if module_source:
+            text += "\n\n模块级代码（导入、全局变量、类属性等，未改动）:\n```python\n" + module_source + "\n```"
+        if related:
+            text += "\n\n相关的未改动函数:\n```python\n" + "\n\n".join(related) + "\n```"
+        return text
+
+    @staticmethod
+    def _answer_key(problem_content: str, code: str, query: str) -> str:
+        return (f"{request_context.get_session_id()}:{problem_hash(problem_content)}:"
+                f"{semantic_digest(code)}:{_digest(' '.join(query.split()).lower())}")
+
+    def cached_answer(self, problem_content: str, code: str, query: str) -> Optional[str]:
+        """同一会话中代码没有实质改动（只改了空白或注释）时，相同问题复用上次的回答"""
+        if not code.strip():
+            return None
+        answer = session_store.cache_get(CODE_ANSWER_CACHE, self._answer_key(problem_content, code, query))
+        if answer:
+            CODE_ARTIFACT_REUSE.inc(artifact="answer")
+        return answer
+
+    def remember_answer(self, problem_content: str, code: str, query: str, answer: str):
+        """记录针对当前代码的回答"""
+        if code.strip() and answer:
+            session_store.cache_set(CODE_ANSWER_CACHE, self._answer_key(problem_content, code, query), answer,
+                                    ttl=CODE_ANSWER_TTL)
+
+# 创建全局代码版本实例
+code_versions = CodeVersions()
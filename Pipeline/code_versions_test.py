@@ -0,0 +1,100 @@
+import uuid
+import request_context
+from code_versions import CodeVersions, MODULE_UNIT, artifact_digest, split_units
+
+PREVIOUS = '''import bisect
+LIMIT = 10 ** 9 + 7
+
+
+def helper(nums, x):
+    return bisect.bisect_left(nums, x)
+
+
+def count(nums, x):
+    i = helper(nums, x)
+    return len(nums) - i
+
+
+def unrelated(a):
+    total = 0
+    for v in a:
+        total += v
+    return total
+
+
+def other(a):
+    best = 0
+    for v in a:
+        best = max(best, v)
+    return best
+
+
+def solution(nums, x):
+    nums.sort()
+    return count(nums, x) % LIMIT
+''' + "".join(f"""
+
+def unused_{i}(grid):
+    rows, cols = len(grid), len(grid[0])
+    seen = [[False] * cols for _ in range(rows)]
+    for r in range(rows):
+        for c in range(cols):
+            seen[r][c] = grid[r][c] > {i}
+    return sum(sum(row) for row in seen)
+""" for i in range(4))
+
+
+def _prompt(previous, code, query="", ratio=0.6):
+    versions = CodeVersions(ratio=ratio)
+    with request_context.bind(session_id=uuid.uuid4().hex):
+        versions.update(previous)
+        versions.update(code)
+        return versions.prompt_code(code, query)
+
+
+def test_module_unit_source():
+    units = split_units("import os\nX = 1\nclass A:\n    k = 2\n    def f(self):\n        return 1\n")
+    assert units[MODULE_UNIT]["source"] == "import os\nX = 1\nclass A:\n    k = 2"
+    assert "A.f" in units
+
+
+def test_diff_includes_module_code_callers_and_callees():
+    code = PREVIOUS.replace("return bisect.bisect_left(nums, x)", "return bisect.bisect_right(nums, x)")
+    text, form = _prompt(PREVIOUS, code)
+    assert form == "diff"
+    assert "-    return bisect.bisect_left(nums, x)" in text
+    assert "+    return bisect.bisect_right(nums, x)" in text
+    # 模块级代码（导入、全局常量）总是给出
+    assert "import bisect\nLIMIT = 10 ** 9 + 7" in text
+    # 调用了改动函数的count完整给出，与改动无关的函数只出现在结构摘要中
+    assert "def count(nums, x):\n    i = helper(nums, x)" in text
+    assert "total += v" not in text and "best = max(best, v)" not in text and "seen[r][c]" not in text
+
+
+def test_diff_includes_callers_of_removed_function():
+    code = PREVIOUS.replace("def helper(nums, x):\n    return bisect.bisect_left(nums, x)\n\n\n", "")
+    text, form = _prompt(PREVIOUS, code)
+    assert form == "diff"
+    assert "-def helper(nums, x):" in text
+    assert "def count(nums, x):\n    i = helper(nums, x)" in text
+
+
+def test_module_change_falls_back_to_full_code():
+    code = PREVIOUS.replace("LIMIT = 10 ** 9 + 7", "LIMIT = 998244353")
+    text, form = _prompt(PREVIOUS, code)
+    assert form == "full" and text == f"用户代码:\n{code}"
+
+
+def test_long_diff_falls_back_to_full_code():
+    code = PREVIOUS.replace("return bisect.bisect_left(nums, x)", "return bisect.bisect_right(nums, x)")
+    text, form = _prompt(PREVIOUS, code, ratio=0.05)
+    assert form == "full"
+
+
+def test_artifact_digest_follows_module_level_calls():
+    code = "def build():\n    return [1, 2]\n\nTABLE = build()\n\ndef solution(i):\n    return TABLE[i]\n\n" \
+           "def unused():\n    return 0\n"
+    changed_build = code.replace("return [1, 2]", "return [2, 1]")
+    changed_unused = code.replace("return 0", "return 1")
+    assert artifact_digest(changed_build) != artifact_digest(code)
+    assert artifact_digest(changed_unused) == artifact_digest(code)
@@ -0,0 +1,636 @@
+import ast
+import copy
+import json
+import time
+import argparse
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+from metrics import registry
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# 置信度名称
+CONFIDENCE_NAMES = {"high": "高", "medium": "中", "low": "低"}
+
+# 问题中出现这些词时视为复杂度问题；同时出现后一组词时问题不只关心复杂度，交给模型回答
+COMPLEXITY_HINTS = ("复杂度",)
+OPEN_ENDED_HINTS = ("优化", "改进", "怎么改", "如何", "为什么", "更快", "降低")
+
+# 单次调用的代价（相对于输入规模n）
+LINEAR_BUILTINS = {"sum", "max", "min", "any", "all", "list", "set", "tuple", "dict", "sorted", "reversed",
+                   "frozenset", "Counter", "deque", "deepcopy", "copy"}
+LINEAR_METHODS = {"index", "count", "remove", "insert", "copy", "extend", "join", "split", "replace",
+                  "find", "strip", "reverse", "values", "keys", "items"}
+HEAP_LOG_FUNCTIONS = {"heappush", "heappop", "heappushpop", "heapreplace"}
+BISECT_FUNCTIONS = {"bisect", "bisect_left", "bisect_right", "insort", "insort_left", "insort_right"}
+MEMO_DECORATORS = {"lru_cache", "cache"}
+HASH_CONSTRUCTORS = {"dict", "set", "defaultdict", "Counter", "OrderedDict", "frozenset"}
+LIST_CONSTRUCTORS = {"list", "deque"}
+STRING_CONSTRUCTORS = {"str"}
+# 使循环变量按常数倍缩放的运算（while循环次数为log n）
+SCALING_OPS = (ast.FloorDiv, ast.RShift, ast.Div, ast.Mult, ast.LShift)
+# 分析while循环体时不进入的嵌套结构，其中的更新不影响本层循环的次数
+NESTED_SCOPES = (ast.For, ast.AsyncFor, ast.While, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef,
+                 ast.Lambda)
+# 不含子表达式的节点，分析时直接跳过
+LEAF_NODES = (ast.Name, ast.Constant, ast.expr_context, ast.operator, ast.cmpop, ast.unaryop, ast.boolop)
+
+COMPLEXITY_ANALYSES = registry.counter(
+    "oj_agent_complexity_analyses_total", "静态复杂度分析结果的使用情况", ["result"])
+
+
+class Cost(NamedTuple):
+    """复杂度 O(n^poly · log^log n)，exp为True时表示指数级"""
+    exp: bool = False
+    poly: int = 0
+    log: int = 0
+
+    def __mul__(self, other: "Cost") -> "Cost":
+        return Cost(self.exp or other.exp, self.poly + other.poly, self.log + other.log)
+
+    def __str__(self) -> str:
+        if self.exp:
+            return "O(2^n)"
+        parts = []
+        if self.poly:
+            parts.append("n" if self.poly == 1 else f"n^{self.poly}")
+        if self.log:
+            parts.append("log n" if self.log == 1 else f"log^{self.log} n")
+        return f"O({' '.join(parts) or '1'})"
+
+
+CONSTANT = Cost()
+LINEAR = Cost(poly=1)
+LOGARITHMIC = Cost(log=1)
+LINEARITHMIC = Cost(poly=1, log=1)
+EXPONENTIAL = Cost(exp=True)
+
+
+def _call_name(node: ast.Call) -> str:
+    func = node.func
+    if isinstance(func, ast.Name):
+        return func.id
+    if isinstance(func, ast.Attribute):
+        return func.attr
+    return ""
+
+
+def _is_constant_size(node: ast.AST) -> bool:
+    """range(26)、字符串常量等固定大小的迭代对象"""
+    if isinstance(node, ast.Call) and _call_name(node) == "range":
+        return all(isinstance(arg, ast.Constant) for arg in node.args)
+    if isinstance(node, (ast.Constant, ast.Tuple)):
+        return True
+    if isinstance(node, ast.List):
+        return all(isinstance(e, ast.Constant) for e in node.elts)
+    return False
+
+
+def _is_input_size(node: Optional[ast.AST]) -> bool:
+    """n、len(a)、self.n 以及它们加减常数，循环到这些位置时次数按n计"""
+    if isinstance(node, (ast.Name, ast.Attribute)):
+        return True
+    if isinstance(node, ast.Call):
+        return _call_name(node) == "len" and len(node.args) == 1
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Sub)):
+        return _is_input_size(node.left) and isinstance(node.right, ast.Constant)
+    return False
+
+
+def _is_constant_number(node: Optional[ast.AST]) -> bool:
+    """整数常量，包括 -1 这样带负号的常量"""
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        node = node.operand
+    return isinstance(node, ast.Constant) and isinstance(node.value, int) and not isinstance(node.value, bool)
+
+
+def _is_halving(node: ast.AST) -> bool:
+    """n // 2、n >> 1、lo + (hi - lo) // 2 之类的折半表达式"""
+    if not isinstance(node, ast.BinOp):
+        return False
+    if isinstance(node.op, (ast.FloorDiv, ast.RShift, ast.Div)) and \
+            isinstance(node.right, ast.Constant) and node.right.value in (1, 2):
+        return True
+    return _is_halving(node.left) or _is_halving(node.right)
+
+
+def _is_scaling(op: ast.operator, operand: ast.AST) -> bool:
+    """x *= 2、x //= 3、x >>= 1 之类按常数倍缩放的更新"""
+    if not (isinstance(op, SCALING_OPS) and isinstance(operand, ast.Constant)):
+        return False
+    value = operand.value
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    return value >= 1 if isinstance(op, (ast.RShift, ast.LShift)) else value > 1
+
+
+def _names(node: ast.AST) -> Set[str]:
+    return {sub.id for sub in ast.walk(node) if isinstance(sub, ast.Name)}
+
+
+def _own_statements(stmts: List[ast.stmt]):
+    """循环体中属于本层循环的语句（不进入嵌套循环、函数和类）"""
+    for stmt in stmts:
+        yield stmt
+        if isinstance(stmt, NESTED_SCOPES):
+            continue
+        for field in ("body", "orelse", "finalbody"):
+            yield from _own_statements(getattr(stmt, field, None) or [])
+        for handler in getattr(stmt, "handlers", None) or []:
+            yield from _own_statements(handler.body)
+
+
+def _decorator_name(node: ast.expr) -> str:
+    """@lru_cache(None)、@functools.cache 等装饰器的名称"""
+    if isinstance(node, ast.Call):
+        node = node.func
+    return getattr(node, "id", None) or getattr(node, "attr", None) or ""
+
+
+def _collect_functions(stmts: List[ast.stmt], functions: Dict[str, ast.FunctionDef]):
+    """收集所有函数定义（包括嵌套函数和类方法），只遍历语句不遍历表达式"""
+    for stmt in stmts:
+        if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            functions.setdefault(stmt.name, stmt)
+        for field in ("body", "orelse", "finalbody"):
+            _collect_functions(getattr(stmt, field, None) or [], functions)
+        for handler in getattr(stmt, "handlers", None) or []:
+            _collect_functions(handler.body, functions)
+
+
+def _is_main_guard(node: ast.stmt) -> bool:
+    return isinstance(node, ast.If) and isinstance(node.test, ast.Compare) and \
+        isinstance(node.test.left, ast.Name) and node.test.left.id == "__name__"
+
+
+class _Analyzer:
+    def __init__(self, tree: ast.Module):
+        self.tree = tree
+        self.functions: Dict[str, ast.FunctionDef] = {}
+        _collect_functions(tree.body, self.functions)
+        self.function_costs: Dict[str, Cost] = {}
+        # 正在分析的函数栈，以及分析过程中顺带记录的自调用、记忆化判断和折半变量
+        self._stack: List[str] = []
+        self._self_calls: Dict[str, List[tuple]] = {}
+        self._memo_checks: Set[str] = set()
+        self._halving_names: Set[str] = set()
+        self.hotspots: List[tuple] = []
+        self.features: Set[str] = set()
+        self.recursion: List[str] = []
+        self.notes: List[str] = []
+        self.confidence = "high"
+        self.loop_depth = 0
+        self._depth = 0
+        self._containers: Dict[str, str] = {}
+
+    def _lower(self, confidence: str, note: str):
+        order = ("high", "medium", "low")
+        if order.index(confidence) > order.index(self.confidence):
+            self.confidence = confidence
+        if note not in self.notes:
+            self.notes.append(note)
+
+    def _hotspot(self, node: ast.AST, detail: str, cost: Cost):
+        if cost != CONSTANT:
+            self.hotspots.append((cost, node.lineno, detail))
+
+    # ---------- 函数 ----------
+
+    def function_cost(self, name: str) -> Cost:
+        if name in self.function_costs:
+            return self.function_costs[name]
+        node = self.functions[name]
+        if name in self._stack:
+            # 相互递归，无法静态确定
+            self._lower("low", f"函数{name}存在相互递归，按线性估计")
+            return LINEAR
+        self._stack.append(name)
+        saved = self._containers, self._depth, self._halving_names
+        self._containers, self._depth, self._halving_names = {}, 0, set()
+        body_cost = self.block_cost(node.body, CONSTANT)
+        cost = self._apply_recursion(node, body_cost)
+        self._containers, self._depth, self._halving_names = saved
+        self._stack.pop()
+        self.function_costs[name] = cost
+        return cost
+
+    def _apply_recursion(self, node: ast.FunctionDef, body_cost: Cost) -> Cost:
+        self_calls = self._self_calls.get(node.name, [])
+        if not self_calls:
+            return body_cost
+        self.recursion.append(node.name)
+        self.features.add("recursion")
+        cost = self._recursion_cost(node, self_calls, body_cost)
+        self._hotspot(node, f"递归函数{node.name}", cost)
+        return cost
+
+    def _recursion_cost(self, node: ast.FunctionDef, self_calls: List[tuple], body_cost: Cost) -> Cost:
+        """按自调用的次数、参数是否折半以及是否记忆化估计递归函数的复杂度"""
+        memoized = any(_decorator_name(d) in MEMO_DECORATORS for d in node.decorator_list) or \
+            node.name in self._memo_checks
+        halving = any(self._is_halving_arg(arg) for call, _ in self_calls for arg in call.args)
+        in_loop = any(factor.poly or factor.exp for _, factor in self_calls)
+        params = [a for a in node.args.args if a.arg != "self"]
+
+        if memoized:
+            # 记忆化：状态数 × 每个状态的代价，状态数按参数个数估计
+            states = Cost(poly=max(len(params), 1))
+            self.features.add("memoization")
+            self._lower("medium", f"{node.name}使用记忆化递归，按状态数n^{max(len(params), 1)}估计")
+            return states * body_cost
+        if in_loop and not halving:
+            # 在循环中递归（回溯枚举）
+            self._lower("low", f"{node.name}在循环中递归调用，可能是指数级")
+            return EXPONENTIAL
+        if len(self_calls) == 1:
+            depth = LOGARITHMIC if halving else LINEAR
+            self._lower("medium", f"{node.name}为单路递归，递归深度按{depth}估计")
+            return depth * body_cost
+        if halving:
+            # 分治：T(n) = aT(n/2) + O(n^k)
+            self._lower("medium", f"{node.name}为分治递归，按主定理估计")
+            if body_cost.poly >= 1:
+                return Cost(poly=body_cost.poly, log=body_cost.log + (1 if body_cost.poly == 1 else 0))
+            return LINEAR
+        self._lower("low", f"{node.name}存在多路递归且没有记忆化，可能是指数级")
+        return EXPONENTIAL
+
+    def _is_halving_arg(self, node: ast.AST) -> bool:
+        """递归参数是否折半：n // 2、a[:mid]、或由折半表达式赋值的变量"""
+        if _is_halving(node) or (isinstance(node, ast.Subscript) and isinstance(node.slice, ast.Slice)):
+            return True
+        return isinstance(node, ast.Name) and node.id in self._halving_names
+
+    # ---------- 语句 ----------
+
+    def block_cost(self, stmts: List[ast.stmt], factor: Cost) -> Cost:
+        worst = factor
+        for stmt in stmts:
+            worst = max(worst, self.stmt_cost(stmt, factor))
+        return worst
+
+    def stmt_cost(self, node: ast.stmt, factor: Cost) -> Cost:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            return factor
+        if isinstance(node, (ast.For, ast.AsyncFor)):
+            return self._loop_cost(node, factor, self.iter_cost(node.iter, factor), "for循环",
+                                   [node.iter], node.body + node.orelse)
+        if isinstance(node, ast.While):
+            return self._loop_cost(node, factor, self._while_factor(node), "while循环",
+                                   [node.test], node.body + node.orelse)
+        worst = factor
+        if self._depth and self._is_string_concat(node):
+            # 循环中 s = s + c 每次复制整个字符串
+            self.features.add("string_concat")
+            self._hotspot(node, "字符串拼接", factor * LINEAR)
+            worst = factor * LINEAR
+        if isinstance(node, ast.Assign):
+            self._track_container(node)
+            if _is_halving(node.value):
+                self._halving_names.update(t.id for t in node.targets if isinstance(t, ast.Name))
+        elif isinstance(node, ast.If) and self._stack and self._is_memo_check(node):
+            self._memo_checks.add(self._stack[-1])
+
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, list) and value and isinstance(value[0], ast.stmt):
+                worst = max(worst, self.block_cost(value, factor))
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, ast.excepthandler):
+                        worst = max(worst, self.block_cost(item.body, factor))
+                    elif isinstance(item, ast.AST):
+                        worst = max(worst, self.expr_cost(item, factor))
+            elif isinstance(value, ast.AST):
+                worst = max(worst, self.expr_cost(value, factor))
+        return worst
+
+    def _is_string_concat(self, node: ast.stmt) -> bool:
+        """s += c 或 s = s + c，且s是字符串变量"""
+        if isinstance(node, ast.AugAssign) and isinstance(node.op, ast.Add):
+            target = node.target
+        elif isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.value, ast.BinOp) and \
+                isinstance(node.value.op, ast.Add) and isinstance(node.value.left, ast.Name):
+            target = node.targets[0]
+            if not isinstance(target, ast.Name) or target.id != node.value.left.id:
+                return False
+        else:
+            return False
+        return isinstance(target, ast.Name) and self._containers.get(target.id) == "str"
+
+    @staticmethod
+    def _is_memo_check(node: ast.If) -> bool:
+        """if key in memo: return memo[key] 形式的手写记忆化"""
+        return isinstance(node.test, ast.Compare) and any(isinstance(op, ast.In) for op in node.test.ops) and \
+            any(isinstance(s, ast.Return) for s in node.body)
+
+    def _loop_cost(self, node: ast.stmt, factor: Cost, iterations: Cost, kind: str,
+                   headers: List[ast.AST], body: List[ast.stmt]) -> Cost:
+        header_cost = max([self.expr_cost(h, factor) for h in headers] + [factor])
+        iterations = self._early_exit(node, iterations, kind)
+        inner = factor * iterations
+        if iterations != CONSTANT:
+            self._depth += 1
+            self.loop_depth = max(self.loop_depth, self._depth)
+            self._hotspot(node, f"{kind}（嵌套{self._depth}层）", inner)
+        body_cost = self.block_cost(body, inner)
+        if iterations != CONSTANT:
+            self._depth -= 1
+        return max(header_cost, inner, body_cost)
+
+    def _early_exit(self, node: ast.stmt, iterations: Cost, kind: str) -> Cost:
+        """循环体中直接（不在条件分支中）return或break时只执行一次；有条件的提前退出按完整次数估计，
+        但实际次数取决于数据，降低置信度"""
+        if iterations == CONSTANT:
+            return iterations
+        statements = list(_own_statements(node.body))
+        if any(isinstance(s, ast.Continue) for s in statements):
+            return iterations
+        if any(isinstance(s, (ast.Return, ast.Break)) for s in node.body):
+            self._lower("medium", f"第{node.lineno}行的{kind}在第一次迭代就返回或跳出，按常数次估计")
+            return CONSTANT
+        if any(isinstance(s, (ast.Return, ast.Break)) for s in statements):
+            self._lower("medium", f"第{node.lineno}行的{kind}可能提前返回或跳出，按完整次数估计")
+        return iterations
+
+    def iter_cost(self, node: ast.AST, factor: Cost) -> Cost:
+        """迭代次数：固定大小的对象为常数，range见_range_cost，直接遍历集合按n计"""
+        if _is_constant_size(node):
+            return CONSTANT
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "range" and \
+                node.args and not any(isinstance(arg, ast.Starred) for arg in node.args):
+            return self._range_cost(node)
+        return LINEAR
+
+    def _range_cost(self, node: ast.Call) -> Cost:
+        """range(n)、range(len(a))、range(1, n + 1)、range(n - 1, -1, -1)按n计；
+        range(i, i + 3)为常数次；偏移的起点、min(...)等有界的终点、变量步长（如筛法）的实际次数
+        无法静态确定，按n估计并降低置信度"""
+        args = node.args
+        start, stop, step = (None, args[0], None) if len(args) == 1 else (args + [None])[:3]
+        if start is not None and isinstance(stop, ast.BinOp) and isinstance(stop.op, ast.Add) and \
+                _is_constant_number(stop.right) and ast.dump(stop.left) == ast.dump(start):
+            self._lower("medium", f"第{node.lineno}行的range(i, i + k)循环常数次")
+            return CONSTANT
+        if step is None or _is_constant_number(step):
+            low, high = (stop, start) if isinstance(step, ast.UnaryOp) else (start, stop)
+            if (low is None or _is_constant_number(low)) and _is_input_size(high):
+                return LINEAR
+        if step is not None and not _is_constant_number(step):
+            note = f"第{node.lineno}行range的步长不是常数（如筛法），次数按n估计"
+        elif start is not None and not _is_constant_number(start) and _is_input_size(stop):
+            note = f"第{node.lineno}行range的起点随外层变化，次数按n估计"
+        else:
+            note = f"第{node.lineno}行range的范围有界或不是n、len(...)，次数按n估计"
+        self._lower("medium", note)
+        return LINEAR
+
+    def _while_factor(self, node: ast.While) -> Cost:
+        """while循环：循环条件中的变量在本层循环体中按常数倍缩放（n //= 2、i *= 2）
+        或由折半的中点更新（二分查找）时为log n，否则按n估计"""
+        condition = _names(node.test)
+        statements = list(_own_statements(node.body))
+        midpoints = {t.id for s in statements if isinstance(s, ast.Assign) and _is_halving(s.value)
+                     for t in s.targets if isinstance(t, ast.Name)}
+        unrelated_scaling = False
+        for stmt in statements:
+            if isinstance(stmt, ast.AugAssign) and isinstance(stmt.op, SCALING_OPS):
+                if isinstance(stmt.target, ast.Name) and stmt.target.id in condition and \
+                        _is_scaling(stmt.op, stmt.value):
+                    return LOGARITHMIC
+                unrelated_scaling = True
+            elif isinstance(stmt, ast.Assign):
+                targets = {t.id for t in stmt.targets if isinstance(t, ast.Name)} & condition
+                value = stmt.value
+                if targets and isinstance(value, ast.BinOp) and isinstance(value.left, ast.Name) and \
+                        value.left.id in targets and _is_scaling(value.op, value.right):
+                    return LOGARITHMIC
+                if targets and (_is_halving(value) or _names(value) & midpoints):
+                    self.features.add("binary_search")
+                    return LOGARITHMIC
+                if isinstance(value, ast.BinOp) and isinstance(value.op, SCALING_OPS):
+                    unrelated_scaling = True
+        if unrelated_scaling:
+            self._lower("low", "while循环中有乘除更新，但不是循环条件中的变量按常数倍缩放，次数按n估计")
+        else:
+            self._lower("medium", "while循环的次数按n估计")
+        return LINEAR
+
+    def _track_container(self, node: ast.Assign):
+        """记录变量是哈希容器还是列表，用于估计 in 判断的代价"""
+        value = node.value
+        kind = None
+        if isinstance(value, (ast.Dict, ast.Set, ast.DictComp, ast.SetComp)):
+            kind = "hash"
+        elif isinstance(value, (ast.List, ast.ListComp)):
+            kind = "list"
+        elif isinstance(value, ast.JoinedStr) or (isinstance(value, ast.Constant) and isinstance(value.value, str)):
+            kind = "str"
+        elif isinstance(value, ast.Call):
+            name = _call_name(value)
+            kind = "hash" if name in HASH_CONSTRUCTORS else "list" if name in LIST_CONSTRUCTORS else \
+                "str" if name in STRING_CONSTRUCTORS else None
+        if kind:
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    self._containers[target.id] = kind
+                    if kind == "hash":
+                        self.features.add("dict")
+
+    # ---------- 表达式 ----------
+
+    def expr_cost(self, node: ast.AST, factor: Cost) -> Cost:
+        if isinstance(node, LEAF_NODES):
+            return factor
+        worst = factor
+        if isinstance(node, (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)):
+            inner = factor
+            for generator in node.generators:
+                worst = max(worst, self.expr_cost(generator.iter, inner))
+                inner = inner * self.iter_cost(generator.iter, inner)
+            self._hotspot(node, "推导式", inner)
+            elements = [node.key, node.value] if isinstance(node, ast.DictComp) else [node.elt]
+            return max([worst, inner] + [self.expr_cost(e, inner) for e in elements])
+        if isinstance(node, ast.Lambda):
+            return factor
+        if isinstance(node, ast.Call):
+            op = self.call_cost(node, factor)
+            if op != CONSTANT:
+                self._hotspot(node, f"调用{_call_name(node) or '函数'}", factor * op)
+                worst = factor * op
+        elif isinstance(node, ast.Compare) and any(isinstance(op, (ast.In, ast.NotIn)) for op in node.ops):
+            container = node.comparators[-1]
+            kind = self._containers.get(container.id) if isinstance(container, ast.Name) else None
+            if kind in ("list", "str") or (kind is None and not _is_constant_size(container)):
+                if kind is None:
+                    self._lower("medium", "部分 in 判断的容器类型未知，按列表估计")
+                self._hotspot(node, "列表成员判断", factor * LINEAR)
+                worst = factor * LINEAR
+        elif isinstance(node, ast.Subscript) and isinstance(node.slice, ast.Slice):
+            self.features.add("slice")
+            self._hotspot(node, "切片复制", factor * LINEAR)
+            worst = factor * LINEAR
+        for field in node._fields:
+            value = getattr(node, field, None)
+            if isinstance(value, ast.AST):
+                worst = max(worst, self.expr_cost(value, factor))
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, ast.AST):
+                        worst = max(worst, self.expr_cost(item, factor))
+        return worst
+
+    def call_cost(self, node: ast.Call, factor: Cost = CONSTANT) -> Cost:
+        name = _call_name(node)
+        is_method = isinstance(node.func, ast.Attribute)
+        if name in ("sorted", "sort", "nlargest", "nsmallest"):
+            self.features.add("sort")
+            return LINEARITHMIC
+        if name in HEAP_LOG_FUNCTIONS:
+            self.features.add("heap")
+            return LOGARITHMIC
+        if name == "heapify":
+            self.features.add("heap")
+            return LINEAR
+        if name in BISECT_FUNCTIONS:
+            self.features.add("binary_search")
+            return LINEAR if name.startswith("insort") else LOGARITHMIC
+        if self._stack and name == self._stack[-1]:
+            # 自调用由 _apply_recursion 统一估计
+            self._self_calls.setdefault(name, []).append((node, factor))
+            return CONSTANT
+        if name in self.functions and not is_method or (is_method and name in self.functions and
+                                                         isinstance(node.func.value, ast.Name) and
+                                                         node.func.value.id == "self"):
+            return self.function_cost(name)
+        if name == "pop" and is_method and node.args and isinstance(node.args[0], ast.Constant) and \
+                node.args[0].value == 0:
+            return LINEAR
+        if is_method and name in LINEAR_METHODS:
+            return LINEAR
+        if not is_method and name in LINEAR_BUILTINS:
+            # max(a, b) 之类的多参数调用是常数代价
+            if len(node.args) == 1 and not _is_constant_size(node.args[0]):
+                return LINEAR
+        return CONSTANT
+
+    # ---------- 汇总 ----------
+
+    def run(self, entry: Optional[str]) -> Cost:
+        if entry:
+            return self.function_cost(entry)
+        module_body = [stmt for stmt in self.tree.body if not _is_main_guard(stmt)]
+        worst = self.block_cost(module_body, CONSTANT)
+        for name in self.functions:
+            worst = max(worst, self.function_cost(name))
+        return worst
+
+
+def _entry_function(tree: ast.Module) -> Optional[str]:
+    """评测入口：solution函数，或唯一的顶层函数，或Solution类中唯一的方法"""
+    functions = [n.name for n in tree.body if isinstance(n, ast.FunctionDef)]
+    if "solution" in functions:
+        return "solution"
+    if len(functions) == 1:
+        return functions[0]
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            methods = [n.name for n in node.body if isinstance(n, ast.FunctionDef) and not n.name.startswith("__")]
+            if len(methods) == 1:
+                return methods[0]
+    return None
+
+
+def analyze_complexity(code: str) -> Optional[Dict[str, Any]]:
+    """静态估计代码的时间复杂度，代码为空或无法解析时返回None；返回缓存结果的副本，调用方可以修改"""
+    return copy.deepcopy(_analyze_complexity(code))
+
+
+@lru_cache(maxsize=1024)
+def _analyze_complexity(code: str) -> Optional[Dict[str, Any]]:
+    if not (code or "").strip():
+        return None
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+
+    entry = _entry_function(tree)
+    analyzer = _Analyzer(tree)
+    if entry is None:
+        analyzer._lower("medium", "没有找到入口函数，按所有代码中代价最大的部分估计")
+    cost = analyzer.run(entry)
+
+    # 只保留与整体复杂度同阶或次一阶的热点
+    hotspots = sorted(set(analyzer.hotspots), key=lambda h: (h[0], -h[1]), reverse=True)
+    hotspots = [{"line": line, "detail": detail, "cost": str(c)} for c, line, detail in hotspots
+                if c == cost or (not cost.exp and c.poly > 0 and c.poly >= cost.poly - 1)][:5]
+    return {
+        "time": str(cost),
+        "confidence": analyzer.confidence,
+        "entry": entry,
+        "loop_depth": analyzer.loop_depth,
+        "recursion": analyzer.recursion,
+        "features": sorted(analyzer.features),
+        "hotspots": hotspots,
+        "notes": analyzer.notes
+    }
+
+
+def is_complexity_query(query: str) -> bool:
+    """问题是否只询问复杂度（不包含优化等开放性要求）"""
+    return any(h in query for h in COMPLEXITY_HINTS) and not any(h in query for h in OPEN_ENDED_HINTS)
+
+
+def format_complexity_hints(result: Dict[str, Any]) -> str:
+    """整理为简短的提示，加入模型上下文"""
+    parts = [f"静态分析：时间复杂度约为{result['time']}（置信度：{CONFIDENCE_NAMES[result['confidence']]}）",
+             f"最大循环嵌套{result['loop_depth']}层"]
+    if result["recursion"]:
+        parts.append(f"递归函数：{'、'.join(result['recursion'])}")
+    if result["hotspots"]:
+        parts.append("热点：" + "；".join(f"第{h['line']}行 {h['detail']} {h['cost']}" for h in result["hotspots"][:3]))
+    return "；".join(parts)
+
+
+def format_complexity_answer(result: Dict[str, Any]) -> str:
+    """直接回答复杂度问题"""
+    lines = [f"通过分析代码结构，这段代码的时间复杂度约为 **{result['time']}**。", ""]
+    if result["hotspots"]:
+        lines.append("主要的耗时位置：")
+        lines.extend(f"- 第{h['line']}行：{h['detail']}，总执行代价 {h['cost']}" for h in result["hotspots"])
+        lines.append("")
+    for note in result["notes"]:
+        lines.append(f"> {note}")
+    if result["notes"]:
+        lines.append("")
+    lines.append("你可以试着数一数最内层语句一共会被执行多少次，看看是否和这个结论一致？"
+                 "如果想进一步优化，可以思考哪些计算是重复的。")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="时间复杂度静态分析")
+    parser.add_argument("files", nargs="+", help="待分析的Python源文件")
+    parser.add_argument("--benchmark", type=int, default=0, help="重复分析的次数，用于测量分析速度")
+    args = parser.parse_args()
+
+    repeat = args.benchmark
+    sources = [open(path, encoding="utf-8").read() for path in args.files]
+    for path, source in zip(args.files, sources):
+        print(path, json.dumps(analyze_complexity(source), ensure_ascii=False, indent=2))
+    if repeat:
+        _analyze_complexity.cache_clear()
+        start = time.perf_counter()
+        for i in range(repeat):
+            # 每次加入不同的注释，避免命中缓存
+            analyze_complexity(sources[i % len(sources)] + f"\n# {i}")
+        elapsed = time.perf_counter() - start
+        print(f"{repeat}次分析耗时{elapsed:.3f}秒，{repeat / elapsed:.0f}次/秒")
+
+
+if __name__ == "__main__":
+    main()
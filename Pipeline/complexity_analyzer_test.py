@@ -0,0 +1,197 @@
+import pytest
+from complexity_analyzer import analyze_complexity, is_complexity_query
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("def solution(m, s):\n    pass\n", "O(1)"),
+    ("def solution(nums):\n    for i in range(len(nums)):\n        for j in range(i + 1, len(nums)):\n"
+     "            pass\n", "O(n^2)"),
+    ("def solution(nums):\n    for i in range(26):\n        for x in nums:\n            pass\n", "O(n)"),
+    ("def solution(nums):\n    nums.sort()\n    return nums\n", "O(n log n)"),
+    ("def solution(n):\n    if n < 2:\n        return n\n    return solution(n - 1) + solution(n - 2)\n",
+     "O(2^n)"),
+    ("def solution(a):\n    if len(a) <= 1:\n        return a\n    mid = len(a) // 2\n"
+     "    return sorted(solution(a[:mid]) + solution(a[mid:]))\n", "O(n log^2 n)"),
+])
+def test_basic_shapes(code, expected):
+    assert analyze_complexity(code)["time"] == expected
+
+
+def test_binary_search_is_logarithmic():
+    code = """
+def solution(nums, target):
+    lo, hi = 0, len(nums) - 1
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if nums[mid] < target:
+            lo = mid + 1
+        else:
+            hi = mid - 1
+    return lo
+"""
+    result = analyze_complexity(code)
+    assert result["time"] == "O(log n)"
+    assert "binary_search" in result["features"]
+
+
+@pytest.mark.parametrize("update", ["n //= 10", "n = n // 2", "n >>= 1"])
+def test_scaling_condition_variable_is_logarithmic(update):
+    code = f"def solution(n):\n    count = 0\n    while n > 0:\n        {update}\n        count += 1\n    return count\n"
+    assert analyze_complexity(code)["time"] == "O(log n)"
+
+
+def test_doubling_counter_is_logarithmic():
+    code = "def solution(n):\n    i = 1\n    while i < n:\n        i *= 2\n    return i\n"
+    assert analyze_complexity(code)["time"] == "O(log n)"
+
+
+def test_scaling_unrelated_variable_is_linear_with_low_confidence():
+    code = """
+def solution(n):
+    i, res = 0, 1
+    while i < n:
+        res *= 3
+        res = res * 2 % 1000000007
+        i += 1
+    return res
+"""
+    result = analyze_complexity(code)
+    assert result["time"] == "O(n)"
+    assert result["confidence"] == "low"
+
+
+def test_scaling_in_nested_loop_does_not_count():
+    code = """
+def solution(nums):
+    i = 0
+    while i < len(nums):
+        for x in nums:
+            i *= 2
+        i += 1
+"""
+    assert analyze_complexity(code)["time"] == "O(n^2)"
+
+
+def test_scaling_by_variable_is_not_logarithmic():
+    code = "def solution(n, k):\n    while n > 0:\n        n //= k\n"
+    result = analyze_complexity(code)
+    assert result["time"] == "O(n)" and result["confidence"] == "low"
+
+
+def test_digit_loop_inside_linear_loop():
+    code = """
+def solution(nums):
+    total = 0
+    for x in nums:
+        while x:
+            total += x % 10
+            x //= 10
+    return total
+"""
+    assert analyze_complexity(code)["time"] == "O(n log n)"
+
+
+@pytest.mark.parametrize("concat", ["t = t + c", "t += c"])
+def test_string_concatenation_in_loop_is_quadratic(concat):
+    code = f"def solution(s):\n    t = ''\n    for c in s:\n        {concat}\n    return t\n"
+    result = analyze_complexity(code)
+    assert result["time"] == "O(n^2)"
+    assert "string_concat" in result["features"]
+
+
+def test_integer_accumulation_stays_linear():
+    code = "def solution(nums):\n    t = 0\n    for x in nums:\n        t = t + x\n    return t\n"
+    assert analyze_complexity(code)["time"] == "O(n)"
+
+
+def test_memoized_recursion():
+    code = """
+from functools import lru_cache
+def solution(n):
+    @lru_cache(None)
+    def f(i):
+        if i < 2:
+            return i
+        return f(i - 1) + f(i - 2)
+    return f(n)
+"""
+    result = analyze_complexity(code)
+    assert "memoization" in result["features"]
+    assert result["time"] == "O(n)"
+
+
+@pytest.mark.parametrize("header", ["for i in range(len(nums)):", "for i in range(1, n + 1):",
+                                    "for i in range(n - 1, -1, -1):", "for x in nums:", "for i, x in enumerate(nums):"])
+def test_full_length_loops_are_high_confidence(header):
+    code = f"def solution(nums, n):\n    total = 0\n    {header}\n        total += 1\n    return total\n"
+    result = analyze_complexity(code)
+    assert result["time"] == "O(n)" and result["confidence"] == "high"
+
+
+def test_bounded_range_is_medium_confidence():
+    code = """
+def solution(a, k):
+    for i in range(len(a)):
+        for j in range(i, min(i + k, len(a))):
+            pass
+"""
+    assert analyze_complexity(code)["confidence"] == "medium"
+
+
+def test_fixed_width_range_is_constant():
+    code = "def solution(a):\n    for i in range(len(a)):\n        for j in range(i, i + 3):\n            pass\n"
+    result = analyze_complexity(code)
+    assert result["time"] == "O(n)" and result["confidence"] == "medium"
+
+
+def test_offset_range_is_medium_confidence():
+    code = "def solution(a):\n    for i in range(len(a)):\n        for j in range(i + 1, len(a)):\n            pass\n"
+    result = analyze_complexity(code)
+    assert result["time"] == "O(n^2)" and result["confidence"] == "medium"
+
+
+def test_sieve_step_is_medium_confidence():
+    code = """
+def solution(n):
+    prime = [True] * (n + 1)
+    for i in range(2, n + 1):
+        if prime[i]:
+            for j in range(i * i, n + 1, i):
+                prime[j] = False
+    return prime
+"""
+    result = analyze_complexity(code)
+    assert result["confidence"] == "medium"
+    assert any("步长" in note for note in result["notes"])
+
+
+def test_loop_returning_on_first_iteration():
+    code = "def solution(a):\n    for i in range(len(a)):\n        for j in range(len(a)):\n            return j\n"
+    result = analyze_complexity(code)
+    assert result["time"] == "O(n)" and result["confidence"] == "medium"
+
+
+def test_conditional_early_exit_is_medium_confidence():
+    code = "def solution(a, t):\n    for x in a:\n        if x == t:\n            return True\n    return False\n"
+    result = analyze_complexity(code)
+    assert result["time"] == "O(n)" and result["confidence"] == "medium"
+
+
+def test_invalid_code():
+    assert analyze_complexity("") is None
+    assert analyze_complexity("def solution(:\n") is None
+
+
+def test_result_is_a_copy():
+    code = "def solution(nums):\n    for x in nums:\n        pass\n"
+    result = analyze_complexity(code)
+    result["time"] = "changed"
+    result["notes"].append("changed")
+    again = analyze_complexity(code)
+    assert again["time"] == "O(n)" and "changed" not in again["notes"]
+
+
+def test_is_complexity_query():
+    assert is_complexity_query("这段代码的时间复杂度是多少")
+    assert not is_complexity_query("怎么降低复杂度")
+    assert not is_complexity_query("代码对吗")
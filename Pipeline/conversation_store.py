@@ -0,0 +1,327 @@
+import os
+import json
+import time
+import queue
+import atexit
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from log_config import setup_logging
+from metrics import registry
+from storage import problem_hash
+from usage_ledger import usage_ledger
+from retrieval_index import retrieval_index
+import request_context
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# 历史库路径，设置为空字符串时关闭持久化
+DEFAULT_HISTORY_DB = "oj_agent_history.db"
+
+# 预热一道题目的检索索引时读取的历史回答数
+WARM_ANSWERS = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    turn_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS problems (
+    problem_hash TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    first_seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS turns (
+    request_id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    problem_hash TEXT NOT NULL,
+    query TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS intents (
+    request_id TEXT PRIMARY KEY,
+    safe INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    need_code INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS answers (
+    request_id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    problem_hash TEXT NOT NULL,
+    action TEXT NOT NULL,
+    query TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    predicted_questions TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    latency_ms REAL,
+    created_at REAL NOT NULL,
+    reusable INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    request_id TEXT,
+    session_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    cache TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_turns_problem ON turns(problem_hash, created_at);
+CREATE INDEX IF NOT EXISTS idx_turns_user ON turns(user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_turns_session ON turns(session_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_answers_problem ON answers(problem_hash, created_at);
+CREATE INDEX IF NOT EXISTS idx_answers_user ON answers(user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_usage_user ON usage(user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_usage_session ON usage(session_id, created_at);
+"""
+
+HISTORY_WRITES = registry.counter(
+    "oj_agent_history_writes_total", "写入历史库的记录数", ["table"])
+HISTORY_DROPPED = registry.counter(
+    "oj_agent_history_dropped_total", "写入队列已满或历史库无法打开而丢弃的记录数", ["table"])
+HISTORY_FAILED = registry.counter(
+    "oj_agent_history_failed_total", "逐条重试后仍写入失败的记录数", ["table"])
+
+
+class ConversationStore:
+    def __init__(self, path: str, batch_size: int = 200, flush_interval: float = 0.5,
+                 max_queue: int = 10000):
+        """会话历史持久化存储
+
+        写操作只放入内存队列，由后台线程按批次在一个事务中写入SQLite，
+        请求路径不会等待磁盘；队列满时丢弃并计数，而不是阻塞请求。
+        历史库文件和后台线程在第一次写入时才创建，某一批写入失败时逐条重试，只丢弃出错的记录。
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._local = threading.local()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def _start(self) -> bool:
+        """创建历史库（或为旧版历史库补充字段）并启动后台写线程，历史库无法打开时返回False"""
+        if self._thread is not None:
+            return True
+        with self._start_lock:
+            if self._thread is not None:
+                return True
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                conn = self._connect()
+                conn.executescript(SCHEMA)
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(answers)")}
+                if "reusable" not in columns:
+                    conn.execute("ALTER TABLE answers ADD COLUMN reusable INTEGER NOT NULL DEFAULT 0")
+                conn.close()
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"打开历史库时出错: {str(e)}")
+                return False
+            thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            thread.start()
+            self._thread = thread
+            atexit.register(self.close)
+            return True
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # ---------- 写入（非阻塞） ----------
+
+    def _enqueue(self, table: str, sql: str, params: Tuple):
+        if not self._start():
+            HISTORY_DROPPED.inc(table=table)
+            return
+        try:
+            self._queue.put_nowait((table, sql, params))
+        except queue.Full:
+            HISTORY_DROPPED.inc(table=table)
+
+    def record_turn(self, request_id: str, query: str, problem_content: str):
+        """记录一轮提问，同时登记会话和题目"""
+        now = time.time()
+        session_id = request_context.get_session_id()
+        user_id = request_context.get_user_id()
+        digest = problem_hash(problem_content)
+        self._enqueue("sessions", """INSERT INTO sessions (session_id, user_id, first_seen, last_seen, turn_count)
+            VALUES (?, ?, ?, ?, 1)
+            ON CONFLICT(session_id) DO UPDATE SET last_seen = excluded.last_seen, turn_count = turn_count + 1""",
+                      (session_id, user_id, now, now))
+        if problem_content:
+            self._enqueue("problems", "INSERT OR IGNORE INTO problems (problem_hash, content, first_seen) VALUES (?, ?, ?)",
+                          (digest, problem_content, now))
+        self._enqueue("turns", """INSERT OR REPLACE INTO turns (request_id, session_id, user_id, problem_hash, query, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)""", (request_id, session_id, user_id, digest, query, now))
+
+    def record_intent(self, request_id: str, intent: Dict[str, Any]):
+        """记录意图识别结果"""
+        self._enqueue("intents", """INSERT OR REPLACE INTO intents (request_id, safe, action, need_code, created_at)
+            VALUES (?, ?, ?, ?, ?)""", (request_id, int(bool(intent.get('safe'))), intent.get('action', 'block'),
+                                        int(bool(intent.get('need_code'))), time.time()))
+
+    def record_answer(self, request_id: str, problem_content: str, action: str, query: str, answer: str,
+                      predicted_questions: Optional[List[Dict[str, Any]]] = None, success: bool = True,
+                      latency_ms: Optional[float] = None, reusable: bool = False):
+        """记录回答和预测的后续问题，reusable表示回答可以提供给同一题目下的其他学生（用于预热检索索引）"""
+        self._enqueue("answers", """INSERT OR REPLACE INTO answers (request_id, session_id, user_id, problem_hash, action,
+            query, answer, predicted_questions, success, latency_ms, created_at, reusable)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                      (request_id, request_context.get_session_id(), request_context.get_user_id(),
+                       problem_hash(problem_content), action, query, answer,
+                       json.dumps(predicted_questions or [], ensure_ascii=False), int(bool(success)),
+                       latency_ms, time.time(), int(bool(reusable))))
+
+    def record_usage(self, record: Dict[str, Any]):
+        """记录一条token用量（作为usage_ledger的回调）"""
+        self._enqueue("usage", """INSERT INTO usage (request_id, session_id, user_id, role, cache,
+            prompt_tokens, completion_tokens, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                      (request_context.get_request_id(), record["session_id"], record["user_id"], record["role"],
+                       record["cache"], record["prompt_tokens"], record["completion_tokens"], record["timestamp"]))
+
+    # ---------- 后台写线程 ----------
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=self.flush_interval if len(batch) == 1 else 0))
+                except queue.Empty:
+                    break
+            stop = self._write_batch(conn, batch)
+            if stop:
+                conn.close()
+                return
+
+    def _write_batch(self, conn: sqlite3.Connection, batch: List) -> bool:
+        stop = None in batch
+        waiters = [item for item in batch if isinstance(item, threading.Event)]
+        rows = [item for item in batch if isinstance(item, tuple)]
+        try:
+            with conn:
+                for _, sql, params in rows:
+                    conn.execute(sql, params)
+            written = rows
+        except Exception as e:
+            # 一条记录出错会回滚整批，逐条重试，只丢弃出错的记录
+            logger.error(f"批量写入历史库时出错，逐条重试: {str(e)}")
+            written = []
+            for row in rows:
+                try:
+                    with conn:
+                        conn.execute(row[1], row[2])
+                    written.append(row)
+                except Exception as e:
+                    HISTORY_FAILED.inc(table=row[0])
+                    logger.error(f"写入历史库时出错 - 表: {row[0]}, 错误: {str(e)}")
+        counts: Dict[str, int] = {}
+        for table, _, _ in written:
+            counts[table] = counts.get(table, 0) + 1
+        for table, count in counts.items():
+            HISTORY_WRITES.inc(count, table=table)
+        for waiter in waiters:
+            waiter.set()
+        return stop
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待此前排队的写入全部落盘"""
+        if self._thread is None:
+            return True
+        if not self._thread.is_alive():
+            return False
+        marker = threading.Event()
+        self._queue.put(marker)
+        return marker.wait(timeout)
+
+    def close(self):
+        """写完剩余数据后停止后台线程"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+
+    # ---------- 查询 ----------
+
+    def _reader(self) -> Optional[sqlite3.Connection]:
+        """读连接，历史库还不存在时返回None（查询不创建历史库）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if not os.path.exists(self.path) or not self._start():
+                return None
+            conn = self._connect()
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def answers_for_problem(self, digest: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """查询某道题目的历史回答（最新的在前）"""
+        conn = self._reader()
+        if conn is None:
+            return []
+        rows = conn.execute(
+            "SELECT * FROM answers WHERE problem_hash = ? ORDER BY created_at DESC LIMIT ?", (digest, limit))
+        return [dict(row) for row in rows]
+
+    def reusable_answers(self, digest: str, limit: int = WARM_ANSWERS) -> List[Dict[str, Any]]:
+        """某道题目可提供给其他学生的历史回答，作为检索索引的预热文档"""
+        conn = self._reader()
+        if conn is None:
+            return []
+        rows = conn.execute(
+            """SELECT query, answer FROM answers WHERE problem_hash = ? AND reusable = 1
+               ORDER BY created_at DESC LIMIT ?""", (digest, limit))
+        return [{'kind': 'answer', 'text': row['answer'], 'question': row['query']} for row in rows]
+
+    def turns_for_user(self, user_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """查询某个用户的历史提问（最新的在前）"""
+        conn = self._reader()
+        if conn is None:
+            return []
+        rows = conn.execute(
+            "SELECT * FROM turns WHERE user_id = ? ORDER BY created_at DESC LIMIT ?", (user_id, limit))
+        return [dict(row) for row in rows]
+
+    def usage_by_user(self, since: float = 0.0) -> List[Dict[str, Any]]:
+        """按用户和角色汇总token用量"""
+        conn = self._reader()
+        if conn is None:
+            return []
+        rows = conn.execute(
+            """SELECT user_id, role, COUNT(*) AS calls, SUM(prompt_tokens) AS prompt_tokens,
+                      SUM(completion_tokens) AS completion_tokens
+               FROM usage WHERE created_at >= ? GROUP BY user_id, role
+               ORDER BY SUM(prompt_tokens + completion_tokens) DESC""", (since,))
+        return [dict(row) for row in rows]
+
+
+def create_store(path: Optional[str] = None) -> Optional[ConversationStore]:
+    """根据环境变量OJ_HISTORY_DB创建历史库，设置为空时返回None"""
+    path = os.getenv("OJ_HISTORY_DB", DEFAULT_HISTORY_DB) if path is None else path
+    if not path:
+        logger.info("会话历史持久化已关闭")
+        return None
+    return ConversationStore(path)
+
+# 创建全局历史库实例，持久化每条token用量，并用历史回答预热检索索引
+conversation_store = create_store()
+if conversation_store is not None:
+    usage_ledger.add_sink(conversation_store.record_usage)
+    retrieval_index.add_loader(conversation_store.reusable_answers)
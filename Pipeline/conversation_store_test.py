@@ -0,0 +1,66 @@
+import os
+import sqlite3
+from conversation_store import ConversationStore
+from retrieval_index import RetrievalIndex
+from storage import problem_hash
+import request_context
+
+
+def test_database_created_on_first_write(tmp_path):
+    path = tmp_path / "history" / "history.db"
+    store = ConversationStore(str(path))
+    assert not path.exists()
+    assert store.answers_for_problem("x") == []
+    assert not path.exists()
+    with request_context.bind(session_id="s1", user_id="u1"):
+        store.record_turn("r1", "什么是前缀和", "题目A")
+    assert store.flush()
+    assert path.exists()
+    assert [turn["request_id"] for turn in store.turns_for_user("u1")] == ["r1"]
+    store.close()
+
+
+def test_failed_row_does_not_drop_batch(tmp_path):
+    store = ConversationStore(str(tmp_path / "history.db"), flush_interval=0.2)
+    with request_context.bind(session_id="s1", user_id="u1"):
+        store.record_answer("r1", "题目A", "proceed", "问题1", "回答1")
+        # 违反NOT NULL约束的记录，与前后的记录在同一批中
+        store._enqueue("answers", "INSERT INTO answers (request_id) VALUES (?)", ("bad",))
+        store.record_answer("r2", "题目A", "proceed", "问题2", "回答2")
+    assert store.flush()
+    answers = store.answers_for_problem(problem_hash("题目A"))
+    assert sorted(answer["request_id"] for answer in answers) == ["r1", "r2"]
+    store.close()
+
+
+def test_old_database_gets_reusable_column(tmp_path):
+    path = str(tmp_path / "history.db")
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE answers (request_id TEXT PRIMARY KEY, session_id TEXT NOT NULL,
+        user_id TEXT NOT NULL, problem_hash TEXT NOT NULL, action TEXT NOT NULL, query TEXT NOT NULL,
+        answer TEXT NOT NULL, predicted_questions TEXT NOT NULL, success INTEGER NOT NULL,
+        latency_ms REAL, created_at REAL NOT NULL)""")
+    conn.commit()
+    conn.close()
+    store = ConversationStore(path)
+    store.record_answer("r1", "题目A", "proceed", "问题", "回答", reusable=True)
+    assert store.flush()
+    assert store.reusable_answers(problem_hash("题目A")) == [{"kind": "answer", "text": "回答", "question": "问题"}]
+    store.close()
+
+
+def test_reusable_answers_warm_retrieval_index(tmp_path):
+    store = ConversationStore(str(tmp_path / "history.db"))
+    store.record_answer("r1", "题目A", "proceed", "什么是前缀和", "前缀和是……", reusable=True)
+    store.record_answer("r2", "题目A", "proceed", "我的代码哪里错了", "第3行……", reusable=False)
+    store.record_answer("r3", "题目A", "proceed", "什么是差分", "出错: timeout", success=False)
+    assert store.flush()
+
+    index = RetrievalIndex(directory=str(tmp_path / "index"))
+    index.add_loader(store.reusable_answers)
+    documents = index.search("题目A", "前缀和 差分 代码", k=10)
+    assert [document["text"] for document in documents] == ["前缀和是……"]
+    assert index.match("题目A", "什么是前缀和")["text"] == "前缀和是……"
+    # 预热的文档写入索引文件，之后不再重复预热
+    assert os.path.exists(tmp_path / "index" / f"{problem_hash('题目A')}.jsonl")
+    store.close()
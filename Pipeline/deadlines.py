@@ -0,0 +1,113 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, Optional
+from metrics import registry
+import request_context
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# 请求的默认时间预算和允许调用方设置的上限（秒）
+DEFAULT_BUDGET_SECONDS = float(os.getenv('OJ_REQUEST_BUDGET_SECONDS', '25'))
+MAX_BUDGET_SECONDS = float(os.getenv('OJ_REQUEST_MAX_BUDGET_SECONDS', '120'))
+
+# 各阶段分配剩余时间的权重，以及值得开始该阶段的最短时间
+STAGE_WEIGHTS = {"intent": 1.0, "answer": 4.0, "predictor": 1.0}
+MIN_STAGE_SECONDS = {"intent": 1.0, "answer": 2.0, "predictor": 1.5}
+STAGE_ORDER = ("intent", "answer", "predictor")
+
+# 回答预算低于该值时限制输出长度，按预估输出速度换算max_tokens
+SHORT_ANSWER_SECONDS = float(os.getenv('OJ_SHORT_ANSWER_SECONDS', '10'))
+TOKENS_PER_SECOND = float(os.getenv('OJ_BUDGET_TOKENS_PER_SECOND', '20'))
+MIN_ANSWER_TOKENS = 64
+
+DEGRADATIONS = registry.counter(
+    "oj_agent_deadline_degradations_total", "时间预算不足时的降级次数", ["stage", "decision"])
+
+
+def new_deadline(seconds: Optional[float] = None) -> float:
+    """在入口处根据调用方给出的时间预算（秒）计算截止时间"""
+    if not seconds or seconds <= 0:
+        seconds = DEFAULT_BUDGET_SECONDS
+    return time.monotonic() + min(seconds, MAX_BUDGET_SECONDS)
+
+
+def remaining() -> Optional[float]:
+    """当前请求剩余的时间，未设置截止时间时返回None"""
+    deadline = request_context.get_deadline()
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.0)
+
+
+def stage_budget(stage: str) -> Optional[float]:
+    """当前阶段可用的时间：剩余时间按本阶段及之后各阶段的权重分配
+
+    每个阶段开始时按实际剩余时间重新计算，前面阶段节省下来的时间自动留给后面的阶段；
+    剩余时间允许时至少分配该阶段的最短时间。
+    """
+    left = remaining()
+    if left is None:
+        return None
+    stages = STAGE_ORDER[STAGE_ORDER.index(stage):]
+    share = left * STAGE_WEIGHTS[stage] / sum(STAGE_WEIGHTS[s] for s in stages)
+    return max(share, min(MIN_STAGE_SECONDS[stage], left))
+
+
+def can_run(stage: str) -> bool:
+    """剩余时间是否足够开始该阶段"""
+    budget = stage_budget(stage)
+    return budget is None or budget >= MIN_STAGE_SECONDS[stage]
+
+
+def answer_max_tokens(budget: Optional[float]) -> Optional[int]:
+    """回答预算较短时限制输出长度，返回None表示不限制"""
+    if budget is None or budget >= SHORT_ANSWER_SECONDS:
+        return None
+    return max(int(budget * TOKENS_PER_SECOND), MIN_ANSWER_TOKENS)
+
+
+def degrade(stage: str, decision: str) -> Dict[str, Any]:
+    """记录一次降级决定，返回告知客户端的degraded事件"""
+    DEGRADATIONS.inc(stage=stage, decision=decision)
+    left = remaining()
+    logger.info(f"时间预算不足，降级 - 阶段: {stage}, 决定: {decision}, 剩余: {left}")
+    return {
+        "type": "degraded",
+        "data": {
+            "stage": stage,
+            "decision": decision,
+            "remaining_seconds": None if left is None else round(left, 3)
+        }
+    }
+
+
+class BudgetedStream:
+    def __init__(self, stream: AsyncIterator, seconds: Optional[float]):
+        """在限定时间内读取异步流，超时后停止迭代并将expired置为True
+
+        超时时正在等待的读取会被取消，取消会传入底层生成器并关闭上游流。
+        """
+        self.stream = stream
+        self.until = None if seconds is None else time.monotonic() + seconds
+        self.expired = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.until is None:
+            return await self.stream.__anext__()
+        timeout = self.until - time.monotonic()
+        if timeout <= 0:
+            self.expired = True
+            raise StopAsyncIteration
+        try:
+            return await asyncio.wait_for(self.stream.__anext__(), timeout)
+        except asyncio.TimeoutError:
+            self.expired = True
+            raise StopAsyncIteration
@@ -0,0 +1,79 @@
+import time
+import asyncio
+import pytest
+import deadlines
+import request_context
+
+
+def _within(seconds):
+    """绑定一个剩余seconds秒的截止时间"""
+    return request_context.bind(deadline=time.monotonic() + seconds)
+
+
+def test_no_deadline():
+    assert deadlines.remaining() is None
+    assert deadlines.stage_budget("answer") is None
+    assert deadlines.can_run("predictor")
+
+
+def test_budget_split_by_weights():
+    with _within(60):
+        # intent : answer : predictor = 1 : 4 : 1
+        assert deadlines.stage_budget("intent") == pytest.approx(10, abs=0.05)
+        assert deadlines.stage_budget("answer") == pytest.approx(60 * 4 / 5, abs=0.05)
+        assert deadlines.stage_budget("predictor") == pytest.approx(60, abs=0.05)
+
+
+def test_budget_has_stage_minimum():
+    with _within(3):
+        # 按权重只分到0.5秒，但至少分配intent的最短时间
+        assert deadlines.stage_budget("intent") == pytest.approx(deadlines.MIN_STAGE_SECONDS["intent"], abs=0.05)
+        assert deadlines.can_run("intent")
+    with _within(0.5):
+        # 剩余时间不足最短时间时只能分到剩余时间，不值得开始
+        assert deadlines.stage_budget("answer") == pytest.approx(0.5, abs=0.05)
+        assert not deadlines.can_run("answer")
+
+
+def test_expired_deadline():
+    with request_context.bind(deadline=time.monotonic() - 1):
+        assert deadlines.remaining() == 0.0
+        assert deadlines.stage_budget("intent") == 0.0
+        assert not deadlines.can_run("intent")
+
+
+def test_new_deadline_caps_budget():
+    now = time.monotonic()
+    assert deadlines.new_deadline(None) - now == pytest.approx(deadlines.DEFAULT_BUDGET_SECONDS, abs=0.05)
+    assert deadlines.new_deadline(-5) - now == pytest.approx(deadlines.DEFAULT_BUDGET_SECONDS, abs=0.05)
+    assert deadlines.new_deadline(10 ** 6) - now == pytest.approx(deadlines.MAX_BUDGET_SECONDS, abs=0.05)
+
+
+def test_answer_max_tokens():
+    assert deadlines.answer_max_tokens(None) is None
+    assert deadlines.answer_max_tokens(deadlines.SHORT_ANSWER_SECONDS) is None
+    assert deadlines.answer_max_tokens(5) == max(int(5 * deadlines.TOKENS_PER_SECOND), deadlines.MIN_ANSWER_TOKENS)
+    assert deadlines.answer_max_tokens(0.1) == deadlines.MIN_ANSWER_TOKENS
+
+
+def test_degrade_event():
+    with _within(5):
+        event = deadlines.degrade("predictor", "skipped")
+    assert event["type"] == "degraded"
+    assert event["data"]["stage"] == "predictor" and event["data"]["decision"] == "skipped"
+    assert 0 < event["data"]["remaining_seconds"] <= 5
+
+
+def test_budgeted_stream_expires():
+    async def slow():
+        for i in range(10):
+            yield i
+            await asyncio.sleep(0.05)
+
+    async def collect(seconds):
+        stream = deadlines.BudgetedStream(slow(), seconds)
+        return [item async for item in stream], stream.expired
+
+    items, expired = asyncio.run(collect(0.12))
+    assert expired and 1 <= len(items) < 10
+    assert asyncio.run(collect(None)) == (list(range(10)), False)
@@ -0,0 +1,385 @@
+import os
+import time
+import uuid
+import asyncio
+import bisect
+import logging
+import itertools
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional
+from metrics import registry, observe_queue_wait
+from usage_ledger import usage_ledger
+import request_context
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# 被拒绝时告知学生的提示
+REJECTION_MESSAGES = {
+    "rate": "提问太频繁了，请先消化一下上一个回答，稍后再问。",
+    "tokens": "你在短时间内的用量已达上限，请稍后再问。"
+}
+
+SCHEDULER_REJECTIONS = registry.counter(
+    "oj_agent_scheduler_rejections_total", "超出单用户配额被拒绝的请求数", ["reason"])
+UPSTREAM_ACTIVE = registry.gauge(
+    "oj_agent_upstream_active_calls", "正在进行的上游模型调用数")
+UPSTREAM_WAITING = registry.gauge(
+    "oj_agent_upstream_waiting_calls", "等待上游并发名额的调用数")
+
+# 系统在后台发起的调用（预取）统一按这个主体排队
+BACKGROUND_KEY = "background"
+
+# 监听排队位置的事件流，由服务端生成，不使用客户端提供的请求ID
+_listener_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("queue_listener", default=None)
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """解析"用户=权重,用户=权重"形式的权重配置"""
+    weights = {}
+    for item in (spec or "").split(","):
+        key, _, value = item.partition("=")
+        try:
+            if key.strip() and float(value) > 0:
+                weights[key.strip()] = float(value)
+        except ValueError:
+            logger.warning(f"忽略无效的权重配置: {item}")
+    return weights
+
+
+def current_key() -> str:
+    """调度和配额的主体：已登录用户按用户ID，否则按会话ID"""
+    user_id = request_context.get_user_id()
+    if user_id != request_context.DEFAULT_USER_ID:
+        return user_id
+    return request_context.get_session_id()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        """令牌桶：每秒补充rate个令牌，最多积累capacity个
+
+        余额允许为负（按实际用量事后扣除），欠额补回之前不再放行。
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount: float) -> float:
+        """余额足够时取出amount个令牌并返回0，否则返回还需等待的秒数"""
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def charge(self, amount: float):
+        """事后扣除amount个令牌"""
+        self._refill()
+        self.tokens -= amount
+
+
+class _Ticket:
+    __slots__ = ("key", "start", "finish", "seq", "listener_id", "enqueued", "granted",
+                 "position", "event", "loop", "future")
+
+    def __init__(self, key: str, start: float, finish: float, seq: int, listener_id: Optional[str]):
+        self.key = key
+        self.start = start
+        self.finish = finish
+        self.seq = seq
+        self.listener_id = listener_id
+        self.enqueued = time.perf_counter()
+        self.granted = False
+        self.position = 0
+        self.event: Optional[threading.Event] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.future: Optional[asyncio.Future] = None
+
+    def __lt__(self, other: "_Ticket") -> bool:
+        return (self.finish, self.seq) < (other.finish, other.seq)
+
+
+class FairScheduler:
+    def __init__(self, max_concurrency: int = 8, requests_per_minute: float = 30, request_burst: float = 10,
+                 tokens_per_minute: float = 20000, token_burst: float = 60000,
+                 weights: Optional[Dict[str, float]] = None, max_users: int = 10000,
+                 background_weight: float = 0.25):
+        """单用户配额与上游调用的加权公平排队
+
+        请求入口按用户检查两个令牌桶：请求数（每分钟requests_per_minute个，突发request_burst个）
+        和token用量（每分钟tokens_per_minute个，突发token_burst个，按用量记录事后扣除），
+        速率设置为0时不检查。
+        上游调用最多同时进行max_concurrency个（0表示不限制），超出时按加权公平排队
+        （起始时间公平排队）：每个用户的调用依次获得虚拟完成时间，权重越大间隔越小，
+        先放行虚拟完成时间最早的调用，频繁调用的用户不会挤占其他用户。
+        后台调用（预取）不占用学生的份额，统一按一个权重为background_weight的主体排队，
+        排在同时到达的学生调用之后。
+        """
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.request_burst = request_burst
+        self.tokens_per_minute = tokens_per_minute
+        self.token_burst = token_burst
+        self.weights = weights or {}
+        self.max_users = max_users
+        self.background_weight = background_weight
+        self._request_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._token_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._waiting: List[_Ticket] = []
+        self._active = 0
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+        self._listeners: Dict[str, Callable[[int], None]] = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def _bucket(self, buckets: "OrderedDict[str, TokenBucket]", key: str,
+                per_minute: float, burst: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(per_minute / 60, max(burst, 1))
+            if len(buckets) > self.max_users:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+    def admit(self) -> Optional[Dict[str, Any]]:
+        """检查当前用户的配额，超出时返回rejected事件，否则返回None"""
+        key = current_key()
+        with self._lock:
+            reason, wait = None, 0.0
+            if self.tokens_per_minute > 0:
+                wait = self._bucket(self._token_buckets, key, self.tokens_per_minute, self.token_burst).take(0)
+                reason = "tokens" if wait else None
+            if reason is None and self.requests_per_minute > 0:
+                wait = self._bucket(self._request_buckets, key, self.requests_per_minute, self.request_burst).take(1)
+                reason = "rate" if wait else None
+        if reason is None:
+            return None
+        SCHEDULER_REJECTIONS.inc(reason=reason)
+        logger.info(f"超出配额，拒绝请求 - 主体: {key}, 原因: {reason}, 需等待: {wait:.1f}秒")
+        return {
+            "type": "rejected",
+            "data": {
+                "reason": reason,
+                "retry_after_seconds": round(wait, 1),
+                "message": REJECTION_MESSAGES[reason]
+            }
+        }
+
+    def charge(self, record: Dict[str, Any]):
+        """用量记录回调：按实际token用量扣除用户的token配额
+
+        预取和题目预计算由系统发起，不计入学生的配额。
+        """
+        if self.tokens_per_minute <= 0 or record["cache"] == "prefetch" or record["role"] == "precompute":
+            return
+        key = record["user_id"]
+        if key == request_context.DEFAULT_USER_ID:
+            key = record["session_id"]
+        with self._lock:
+            self._bucket(self._token_buckets, key, self.tokens_per_minute,
+                         self.token_burst).charge(record["total_tokens"])
+
+    def oldest_wait(self) -> float:
+        """排队最久的上游调用已等待的秒数，没有排队时为0"""
+        with self._lock:
+            if not self._waiting:
+                return 0.0
+            return time.perf_counter() - min(ticket.enqueued for ticket in self._waiting)
+
+    def _enqueue(self, cost: float, event: Optional[threading.Event] = None,
+                 future: Optional[asyncio.Future] = None, background: bool = False) -> _Ticket:
+        """登记一次上游调用，有空闲名额且无人排队时直接放行，否则放行时通过event或future唤醒"""
+        key = BACKGROUND_KEY if background else current_key()
+        weight = self.background_weight if background else self.weights.get(key, 1.0)
+        with self._lock:
+            start = max(self._virtual_time, self._last_finish.get(key, 0.0))
+            finish = start + cost / weight
+            self._last_finish[key] = finish
+            ticket = _Ticket(key, start, finish, next(self._seq), _listener_id.get())
+            ticket.event = event
+            if future is not None:
+                ticket.loop, ticket.future = future.get_loop(), future
+            if self._active < self.max_concurrency and not self._waiting:
+                self._grant(ticket)
+                return ticket
+            bisect.insort(self._waiting, ticket)
+            UPSTREAM_WAITING.inc()
+            notify = self._positions()
+        self._notify(notify)
+        return ticket
+
+    def _grant(self, ticket: _Ticket):
+        # 调用方持有锁
+        ticket.granted = True
+        self._active += 1
+        self._virtual_time = max(self._virtual_time, ticket.start)
+        UPSTREAM_ACTIVE.inc()
+        observe_queue_wait('upstream', time.perf_counter() - ticket.enqueued)
+
+    def _positions(self) -> List[tuple]:
+        """排队位置有变化且有请求监听的调用（调用方持有锁）"""
+        changes = []
+        for position, ticket in enumerate(self._waiting, 1):
+            if ticket.position != position:
+                ticket.position = position
+                listener = self._listeners.get(ticket.listener_id)
+                if listener is not None:
+                    changes.append((listener, position))
+        return changes
+
+    @staticmethod
+    def _notify(changes: List[tuple]):
+        for listener, position in changes:
+            try:
+                listener(position)
+            except RuntimeError:
+                # 请求所在的事件循环已关闭
+                pass
+
+    @staticmethod
+    def _wake(ticket: _Ticket):
+        if ticket.event is not None:
+            ticket.event.set()
+        elif ticket.loop is not None:
+            ticket.loop.call_soon_threadsafe(
+                lambda: ticket.future.done() or ticket.future.set_result(None))
+
+    def _release(self, ticket: Optional[_Ticket] = None):
+        """归还名额，或撤销尚未放行的排队，然后按虚拟完成时间放行排队的调用"""
+        woken = []
+        with self._lock:
+            if ticket is not None and not ticket.granted:
+                self._waiting.remove(ticket)
+                UPSTREAM_WAITING.dec()
+            else:
+                self._active -= 1
+                UPSTREAM_ACTIVE.dec()
+            while self._waiting and self._active < self.max_concurrency:
+                waiter = self._waiting.pop(0)
+                UPSTREAM_WAITING.dec()
+                self._grant(waiter)
+                woken.append(waiter)
+            if not self._waiting and not self._active:
+                # 空闲时没有需要平衡的历史
+                self._last_finish.clear()
+            notify = self._positions()
+        for waiter in woken:
+            self._wake(waiter)
+        self._notify(notify)
+
+    @contextmanager
+    def slot(self, cost: float = 1.0):
+        """同步上游调用的并发名额，在线程中阻塞等待
+
+        在事件循环线程中调用会阻塞事件循环，而名额要由循环中的异步调用归还，因此直接报错；
+        异步代码应使用async_slot，或把同步调用放到线程池中执行。
+        """
+        if self.max_concurrency <= 0:
+            yield
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError("不能在事件循环线程中等待同步上游名额，请使用async_slot或在线程池中调用")
+        event = threading.Event()
+        ticket = self._enqueue(cost, event=event)
+        if not ticket.granted:
+            event.wait()
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def async_slot(self, cost: float = 1.0, background: bool = False):
+        """异步上游调用的并发名额，等待期间不占用线程；background为True时按后台调用的低权重排队"""
+        if self.max_concurrency <= 0:
+            yield
+            return
+        future = asyncio.get_running_loop().create_future()
+        ticket = self._enqueue(cost, future=future, background=background)
+        if not ticket.granted:
+            try:
+                await future
+            except asyncio.CancelledError:
+                # 已放行时归还名额，否则撤销排队
+                self._release(ticket)
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def with_queue_events(self, events: AsyncIterator[Dict[str, Any]]) -> AsyncGenerator[Dict[str, Any], None]:
+        """转发请求的事件流，本请求的上游调用排队期间插入queued事件（含排队位置）
+
+        监听按服务端生成的ID登记，读取事件流的任务在带有该ID的上下文中运行，
+        其中发起的上游调用（包括复制上下文后在线程池中的调用）都会通知本请求。
+        """
+        if self.max_concurrency <= 0:
+            async for event in events:
+                yield event
+            return
+        loop = asyncio.get_running_loop()
+        updates: asyncio.Queue = asyncio.Queue()
+        listener_id = uuid.uuid4().hex
+        context = contextvars.copy_context()
+        context.run(_listener_id.set, listener_id)
+        self._listeners[listener_id] = lambda position: loop.call_soon_threadsafe(updates.put_nowait, position)
+
+        async def next_event():
+            return await events.__anext__()
+
+        step = getter = None
+        try:
+            while True:
+                step = step or loop.create_task(next_event(), context=context)
+                getter = getter or asyncio.ensure_future(updates.get())
+                done, _ = await asyncio.wait((step, getter), return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    position, getter = getter.result(), None
+                    yield {"type": "queued", "data": {"position": position}}
+                if step in done:
+                    task, step = step, None
+                    try:
+                        event = task.result()
+                    except StopAsyncIteration:
+                        break
+                    yield event
+        finally:
+            self._listeners.pop(listener_id, None)
+            for task in (step, getter):
+                if task is not None and not task.done():
+                    task.cancel()
+            # 等待被取消的读取结束，之后才能关闭底层事件流
+            if step is not None:
+                await asyncio.gather(step, return_exceptions=True)
+
+# 创建全局调度器实例，并按每条用量记录扣除用户的token配额
+fair_scheduler = FairScheduler(
+    max_concurrency=int(os.getenv('OJ_UPSTREAM_CONCURRENCY', '8')),
+    requests_per_minute=float(os.getenv('OJ_USER_REQUESTS_PER_MINUTE', '30')),
+    request_burst=float(os.getenv('OJ_USER_REQUEST_BURST', '10')),
+    tokens_per_minute=float(os.getenv('OJ_USER_TOKENS_PER_MINUTE', '20000')),
+    token_burst=float(os.getenv('OJ_USER_TOKEN_BURST', '60000')),
+    weights=parse_weights(os.getenv('OJ_USER_WEIGHTS', '')),
+    background_weight=float(os.getenv('OJ_PREFETCH_WEIGHT', '0.25'))
+)
+usage_ledger.add_sink(fair_scheduler.charge)
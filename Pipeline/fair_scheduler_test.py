@@ -0,0 +1,192 @@
+import time
+import asyncio
+import threading
+import pytest
+import request_context
+from fair_scheduler import FairScheduler, parse_weights
+
+
+def _scheduler(**kwargs):
+    options = {"max_concurrency": 1, "requests_per_minute": 0, "tokens_per_minute": 0}
+    options.update(kwargs)
+    return FairScheduler(**options)
+
+
+async def _run_calls(scheduler, calls, started_gap=0.005):
+    """calls为[(用户, 调用数, 是否后台)]，按顺序分批提交，返回获得名额的顺序"""
+    order = []
+
+    async def call(user, i, background):
+        with request_context.bind(user_id=user):
+            async with scheduler.async_slot(background=background):
+                order.append(f"{user}{i}")
+                await asyncio.sleep(0.005)
+
+    tasks = []
+    for user, count, background in calls:
+        tasks += [asyncio.create_task(call(user, i, background)) for i in range(count)]
+        await asyncio.sleep(started_gap)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_heavy_user_does_not_starve_light_user():
+    scheduler = _scheduler()
+    order = asyncio.run(_run_calls(scheduler, [("heavy", 8, False), ("light", 2, False)]))
+    # 轻度用户晚到，但不必等重度用户的8个调用全部完成
+    assert order.index("light1") < order.index("heavy4")
+    assert scheduler._active == 0 and not scheduler._waiting
+
+
+def test_weights_give_larger_share():
+    scheduler = _scheduler(weights={"teacher": 3.0})
+    order = asyncio.run(_run_calls(scheduler, [("first", 1, False), ("student", 4, False), ("teacher", 4, False)],
+                                   started_gap=0))
+    # 同时排队时，权重3的用户在学生的第二个调用之前完成3个调用
+    assert order.index("teacher2") < order.index("student2")
+
+
+def test_background_calls_yield_to_students():
+    scheduler = _scheduler()
+    order = asyncio.run(_run_calls(scheduler, [("first", 1, False), ("prefetch", 2, True), ("student", 2, False)],
+                                   started_gap=0))
+    assert order[1:3] == ["student0", "student1"]
+
+
+def test_sync_slots_are_fair_across_threads():
+    scheduler = _scheduler()
+    order = []
+
+    def call(user, i):
+        with request_context.bind(user_id=user):
+            with scheduler.slot():
+                order.append(f"{user}{i}")
+                time.sleep(0.005)
+
+    threads = [threading.Thread(target=call, args=("heavy", i)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.003)
+    late = [threading.Thread(target=call, args=("light", i)) for i in range(2)]
+    for thread in late:
+        thread.start()
+    for thread in threads + late:
+        thread.join()
+    assert order.index("light1") < order.index("heavy4")
+    assert scheduler._active == 0 and not scheduler._waiting
+
+
+def test_sync_slot_refuses_event_loop_thread():
+    scheduler = _scheduler()
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            with scheduler.slot():
+                pass
+
+    asyncio.run(main())
+    assert scheduler._active == 0 and not scheduler._waiting
+
+
+def test_cancelled_waiter_leaves_queue():
+    scheduler = _scheduler()
+
+    async def main():
+        async def hold():
+            async with scheduler.async_slot():
+                await asyncio.sleep(0.02)
+
+        async def wait():
+            async with scheduler.async_slot():
+                pass
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(wait())
+        await asyncio.sleep(0.005)
+        assert len(scheduler._waiting) == 1
+        waiter.cancel()
+        await asyncio.gather(holder, waiter, return_exceptions=True)
+
+    asyncio.run(main())
+    assert scheduler._active == 0 and not scheduler._waiting
+
+
+def test_unlimited_concurrency():
+    scheduler = _scheduler(max_concurrency=0)
+    with scheduler.slot():
+        assert scheduler._active == 0
+
+
+def test_request_quota():
+    scheduler = _scheduler(requests_per_minute=60, request_burst=2)
+    with request_context.bind(user_id="u1"):
+        assert scheduler.admit() is None
+        assert scheduler.admit() is None
+        rejected = scheduler.admit()
+    assert rejected["type"] == "rejected" and rejected["data"]["reason"] == "rate"
+    assert 0 < rejected["data"]["retry_after_seconds"] <= 1
+    with request_context.bind(user_id="u2"):
+        assert scheduler.admit() is None
+
+
+def _usage(user_id, tokens, cache="miss", role="executor"):
+    return {"user_id": user_id, "session_id": "s", "total_tokens": tokens, "cache": cache, "role": role}
+
+
+def test_token_quota_charges_actual_usage():
+    scheduler = _scheduler(tokens_per_minute=600, token_burst=1000)
+    with request_context.bind(user_id="u1"):
+        assert scheduler.admit() is None
+        scheduler.charge(_usage("u1", 1500))
+        rejected = scheduler.admit()
+        assert rejected["data"]["reason"] == "tokens"
+        # 欠额500个令牌，每秒补充10个
+        assert rejected["data"]["retry_after_seconds"] == pytest.approx(50, abs=1)
+
+
+def test_prefetch_and_precompute_are_not_charged():
+    scheduler = _scheduler(tokens_per_minute=600, token_burst=1000)
+    scheduler.charge(_usage("u1", 5000, cache="prefetch"))
+    scheduler.charge(_usage("u1", 5000, role="precompute"))
+    with request_context.bind(user_id="u1"):
+        assert scheduler.admit() is None
+
+
+def test_bucket_count_is_bounded():
+    scheduler = _scheduler(requests_per_minute=60, max_users=3)
+    for i in range(10):
+        with request_context.bind(user_id=f"u{i}"):
+            scheduler.admit()
+    assert list(scheduler._request_buckets) == ["u7", "u8", "u9"]
+
+
+def test_queue_events_use_server_side_listener_ids():
+    scheduler = _scheduler()
+
+    async def pipeline(hold: float):
+        async with scheduler.async_slot():
+            await asyncio.sleep(hold)
+        yield {"type": "content", "data": "done"}
+
+    async def request(hold: float):
+        # 两个请求使用相同的客户端请求ID，排队事件不会串到另一个请求
+        with request_context.bind(request_id="same-id"):
+            return [event async for event in scheduler.with_queue_events(pipeline(hold))]
+
+    async def main():
+        first = asyncio.create_task(request(0.03))
+        await asyncio.sleep(0.005)
+        second = asyncio.create_task(request(0))
+        return await first, await second
+
+    first, second = asyncio.run(main())
+    assert [e["type"] for e in first] == ["content"]
+    assert [e["type"] for e in second] == ["queued", "content"]
+    assert second[0]["data"] == {"position": 1}
+    assert scheduler._listeners == {}
+
+
+def test_parse_weights():
+    assert parse_weights("alice=2, bob=0.5,bad=x,zero=0,") == {"alice": 2.0, "bob": 0.5}
+    assert parse_weights("") == {}
@@ -0,0 +1,203 @@
+import gzip
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import logging
+import threading
+from typing import Any, AsyncGenerator, Dict, List, Optional
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# 计算指纹时忽略的请求字段（不影响模型输出）
+VOLATILE_FIELDS = ("user", "stream_options")
+
+
+def fingerprint(path: str, body: Dict[str, Any]) -> str:
+    """计算请求指纹：路径 + 去除易变字段后的规范化JSON"""
+    stable = {k: v for k, v in body.items() if k not in VOLATILE_FIELDS}
+    canonical = json.dumps(stable, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{path.strip('/')}\n{canonical}".encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    def __init__(self, path: str):
+        """gzip压缩的JSONL录制文件，每行一条交互记录
+
+        流式响应保存为 [相对请求开始的毫秒数, SSE数据行] 列表，
+        同一指纹录制多次时按顺序轮流回放。
+        """
+        self.path = path
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursor: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries.setdefault(entry["fingerprint"], []).append(entry)
+            logger.info(f"已加载 {sum(len(v) for v in self._entries.values())} 条录制记录: {self.path}")
+        except FileNotFoundError:
+            logger.info(f"录制文件不存在，将新建: {self.path}")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(v) for v in self._entries.values())
+
+    def append(self, entry: Dict[str, Any]):
+        """追加一条记录（gzip多成员格式，可直接追加写入）"""
+        with self._lock:
+            self._entries.setdefault(entry["fingerprint"], []).append(entry)
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """按指纹查找记录"""
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                return None
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = index + 1
+            return entries[index % len(entries)]
+
+
+class RecorderConfig:
+    def __init__(self):
+        """录制/回放服务的参数"""
+        self.mode = "replay"        # record 或 replay
+        self.upstream = None        # 上游地址，例如 https://api-inference.modelscope.cn/v1
+        self.speed = 0.0            # 回放时间压缩倍数，0表示不等待，1表示原始节奏
+        self.cassette: Optional[Cassette] = None
+
+# 创建全局配置实例
+config = RecorderConfig()
+app = FastAPI(title="LLM录制回放服务")
+
+
+async def _sleep_until(start: float, offset_ms: float):
+    """按回放速度等待到指定的时间点"""
+    if config.speed <= 0:
+        return
+    delay = start + offset_ms / 1000.0 / config.speed - time.perf_counter()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+async def _replay_stream(entry: Dict[str, Any]) -> AsyncGenerator[str, None]:
+    start = time.perf_counter()
+    for offset_ms, line in entry["chunks"]:
+        await _sleep_until(start, offset_ms)
+        yield line + "\n\n"
+
+
+async def _replay(entry: Dict[str, Any]) -> Response:
+    """回放一条录制记录"""
+    if entry["stream"]:
+        return StreamingResponse(_replay_stream(entry), status_code=entry["status"],
+                                 media_type="text/event-stream")
+    await _sleep_until(time.perf_counter(), entry.get("elapsed_ms", 0))
+    return JSONResponse(status_code=entry["status"], content=entry["body"])
+
+
+def _upstream_headers(request: Request) -> Dict[str, str]:
+    headers = {"Content-Type": "application/json"}
+    if "authorization" in request.headers:
+        headers["Authorization"] = request.headers["authorization"]
+    return headers
+
+
+async def _record(path: str, body: Dict[str, Any], key: str, request: Request) -> Response:
+    """转发到上游并录制响应（不保存认证信息）"""
+    url = f"{config.upstream.rstrip('/')}/{path}"
+    headers = _upstream_headers(request)
+    start = time.perf_counter()
+
+    if not body.get("stream"):
+        async with httpx.AsyncClient(timeout=300) as client:
+            upstream = await client.post(url, json=body, headers=headers)
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+        if upstream.headers.get("content-type", "").split(";")[0] != "application/json":
+            return Response(status_code=upstream.status_code, content=upstream.content,
+                            media_type=upstream.headers.get("content-type"))
+        content = upstream.json()
+        if upstream.status_code == 200:
+            config.cassette.append({"fingerprint": key, "path": path, "stream": False,
+                                    "status": upstream.status_code, "elapsed_ms": elapsed_ms,
+                                    "body": content})
+        return JSONResponse(status_code=upstream.status_code, content=content)
+
+    client = httpx.AsyncClient(timeout=300)
+    upstream_request = client.build_request("POST", url, json=body, headers=headers)
+    upstream = await client.send(upstream_request, stream=True)
+
+    async def relay() -> AsyncGenerator[str, None]:
+        chunks = []
+        try:
+            async for line in upstream.aiter_lines():
+                if not line.strip():
+                    continue
+                chunks.append([round((time.perf_counter() - start) * 1000, 1), line])
+                yield line + "\n\n"
+            if upstream.status_code == 200:
+                config.cassette.append({"fingerprint": key, "path": path, "stream": True,
+                                        "status": upstream.status_code, "chunks": chunks})
+        finally:
+            await upstream.aclose()
+            await client.aclose()
+
+    return StreamingResponse(relay(), status_code=upstream.status_code, media_type="text/event-stream")
+
+
+@app.post("/v1/{path:path}")
+async def proxy(path: str, request: Request) -> Response:
+    """录制或回放任意POST请求（主要是chat/completions）"""
+    body = await request.json()
+    key = fingerprint(path, body)
+
+    if config.mode == "record":
+        return await _record(path, body, key, request)
+
+    entry = config.cassette.lookup(key)
+    if entry is not None:
+        return await _replay(entry)
+    logger.warning(f"回放未命中: {path} {key[:12]}")
+    return JSONResponse(status_code=404, content={
+        "error": {"message": f"no recording for fingerprint {key}", "type": "replay_miss"}
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM请求录制/回放服务")
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("--cassette", required=True, help="录制文件路径（.jsonl.gz）")
+    parser.add_argument("--upstream", default="https://api-inference.modelscope.cn/v1", help="录制模式下的上游地址")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="回放速度倍数：1为原始节奏，10为压缩10倍，0为不等待")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8200)
+    args = parser.parse_args()
+
+    config.mode = args.mode
+    config.upstream = args.upstream
+    config.speed = args.speed
+    config.cassette = Cassette(args.cassette)
+
+    logger.info(f"{args.mode}模式启动: http://{args.host}:{args.port}/v1")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, Optional
+from metrics import registry, ACTIVE_REQUESTS
+from fair_scheduler import fair_scheduler
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# 负载等级：正常、跳过问题预测、缩短回答、流程图只用缓存、拒绝新请求
+LEVEL_NAMES = ("normal", "skip_predictor", "short_answer", "cache_only_diagram", "shed")
+SKIP_PREDICTOR, SHORT_ANSWER, CACHE_ONLY_DIAGRAM, SHED = 1, 2, 3, 4
+# 进入各等级的负载压力
+LEVEL_THRESHOLDS = (0.6, 0.8, 1.0, 1.5)
+
+# 视为满负荷的进行中请求数，以及视为满负荷的上游排队时间（秒）
+LOAD_CAPACITY = int(os.getenv('OJ_LOAD_CAPACITY', '32'))
+LOAD_TARGET_QUEUE_SECONDS = float(os.getenv('OJ_LOAD_TARGET_QUEUE_SECONDS', '2'))
+# 压力下降后，至少保持当前等级多久才降低一级（秒）
+LOAD_DOWN_HOLD_SECONDS = float(os.getenv('OJ_LOAD_DOWN_HOLD_SECONDS', '5'))
+# 缩短回答时的输出上限
+LOAD_MAX_TOKENS = int(os.getenv('OJ_LOAD_MAX_TOKENS', '512'))
+# 拒绝请求时建议的重试间隔（秒）
+LOAD_RETRY_SECONDS = float(os.getenv('OJ_LOAD_RETRY_SECONDS', '10'))
+
+SHED_MESSAGE = "当前提问的同学太多，请稍等片刻再问。"
+
+LOAD_LEVEL = registry.gauge(
+    "oj_agent_load_level", "当前负载降级等级（0正常，4拒绝新请求）")
+LOAD_DEGRADATIONS = registry.counter(
+    "oj_agent_load_degradations_total", "负载过高时的降级次数", ["stage", "decision"])
+
+
+class LoadController:
+    def __init__(self, capacity: int = LOAD_CAPACITY, target_queue_seconds: float = LOAD_TARGET_QUEUE_SECONDS,
+                 down_hold_seconds: float = LOAD_DOWN_HOLD_SECONDS):
+        """按进行中的请求数和上游排队时间逐级降级
+
+        负载压力取进行中请求数/capacity与最久的上游排队时间/target_queue_seconds中的较大者，
+        超过LEVEL_THRESHOLDS中的阈值时立即升到对应等级；压力下降后每隔down_hold_seconds
+        降低一级，避免在阈值附近来回切换。
+        """
+        self.capacity = max(capacity, 1)
+        self.target_queue_seconds = target_queue_seconds
+        self.down_hold_seconds = down_hold_seconds
+        self._level = 0
+        self._changed_at = 0.0
+        self._lock = threading.Lock()
+
+    def pressure(self) -> float:
+        """当前负载压力，1表示满负荷"""
+        pressure = ACTIVE_REQUESTS.value() / self.capacity
+        if self.target_queue_seconds > 0:
+            pressure = max(pressure, fair_scheduler.oldest_wait() / self.target_queue_seconds)
+        return pressure
+
+    def level(self) -> int:
+        """当前降级等级"""
+        pressure = self.pressure()
+        target = sum(1 for threshold in LEVEL_THRESHOLDS if pressure >= threshold)
+        now = time.monotonic()
+        with self._lock:
+            previous = self._level
+            if target > self._level:
+                self._level, self._changed_at = target, now
+            elif target < self._level and now - self._changed_at >= self.down_hold_seconds:
+                self._level, self._changed_at = self._level - 1, now
+            level = self._level
+        if level != previous:
+            LOAD_LEVEL.set(level)
+            logger.info(f"负载降级等级变化: {LEVEL_NAMES[previous]} -> {LEVEL_NAMES[level]}, 压力: {pressure:.2f}")
+        return level
+
+    def answer_max_tokens(self) -> Optional[int]:
+        """负载较高时的回答长度上限，返回None表示不限制"""
+        return LOAD_MAX_TOKENS if self.level() >= SHORT_ANSWER else None
+
+    @staticmethod
+    def describe(level: int) -> Dict[str, Any]:
+        """返回告知客户端当前负载等级的load事件"""
+        return {"type": "load", "data": {"level": level, "name": LEVEL_NAMES[level]}}
+
+    def degrade(self, stage: str, decision: str) -> Dict[str, Any]:
+        """记录一次负载降级，返回告知客户端的degraded事件"""
+        LOAD_DEGRADATIONS.inc(stage=stage, decision=decision)
+        return {
+            "type": "degraded",
+            "data": {
+                "stage": stage,
+                "decision": decision,
+                "load_level": self._level
+            }
+        }
+
+    def shed(self) -> Dict[str, Any]:
+        """拒绝新请求，返回带重试建议的rejected事件"""
+        LOAD_DEGRADATIONS.inc(stage="request", decision="shed")
+        return {
+            "type": "rejected",
+            "data": {
+                "reason": "overload",
+                "retry_after_seconds": LOAD_RETRY_SECONDS,
+                "message": SHED_MESSAGE
+            }
+        }
+
+# 创建全局负载控制器实例
+load_controller = LoadController()
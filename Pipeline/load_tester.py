@@ -0,0 +1,194 @@
+import json
+import time
+import random
+import argparse
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+import requests
+from pipeline_cases import ALL_TEST_CASES
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# 默认请求混合比例（按测试用例名称），大致对应线上问题分布
+DEFAULT_MIX = {
+    "代码分析测试": 4,
+    "概念解释测试": 3,
+    "可视化解释测试": 2,
+    "流程图生成测试": 1,
+    "复杂流程图测试": 1,
+    "不安全请求测试": 1
+}
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    """计算分位数（线性插值）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    pos = (len(ordered) - 1) * q
+    lower = int(pos)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (pos - lower)
+
+
+def run_one(url: str, case: Dict[str, Any], timeout: float, session_id: str) -> Dict[str, Any]:
+    """发送一个流式请求并记录时间点"""
+    result = {
+        "case": case["name"],
+        "action": "unknown",
+        "ok": False,
+        "ttft": None,
+        "total": None,
+        "events": 0,
+        "error": None
+    }
+    start = time.perf_counter()
+    try:
+        response = requests.post(
+            f"{url}/api/analyze/stream",
+            json={
+                "query": case["query"],
+                "problem_content": case["problem_content"],
+                "editor_code": case["editor_code"],
+                "session_id": session_id
+            },
+            stream=True,
+            timeout=timeout
+        )
+        if response.status_code != 200:
+            result["error"] = f"HTTP {response.status_code}"
+            return result
+
+        for line in response.iter_lines():
+            if not line or not line.startswith(b"data: "):
+                continue
+            event = json.loads(line[6:].decode("utf-8"))
+            result["events"] += 1
+            if event["type"] == "intent":
+                result["action"] = event["data"].get("action", "unknown")
+            elif event["type"] == "content" and result["ttft"] is None:
+                result["ttft"] = time.perf_counter() - start
+            elif event["type"] == "error":
+                result["error"] = str(event["data"])[:200]
+
+        result["ok"] = result["error"] is None
+    except Exception as e:
+        result["error"] = type(e).__name__
+    finally:
+        result["total"] = time.perf_counter() - start
+    return result
+
+
+def build_workload(mix: Dict[str, float], total: int, seed: Optional[int] = None) -> List[Dict[str, Any]]:
+    """按混合比例生成请求序列"""
+    cases = {case["name"]: case for case in ALL_TEST_CASES}
+    names = [name for name in mix if name in cases and mix[name] > 0]
+    if not names:
+        raise ValueError("混合比例中没有有效的测试用例")
+    rng = random.Random(seed)
+    weights = [mix[name] for name in names]
+    return [cases[name] for name in rng.choices(names, weights=weights, k=total)]
+
+
+def run_load(url: str, workload: List[Dict[str, Any]], concurrency: int,
+             timeout: float = 120.0) -> Dict[str, Any]:
+    """以固定并发回放请求序列，返回原始结果和墙钟时间"""
+    results: List[Dict[str, Any]] = []
+    lock = threading.Lock()
+
+    def worker(index: int, case: Dict[str, Any]):
+        result = run_one(url, case, timeout, session_id=f"load-{index % max(concurrency, 1)}")
+        with lock:
+            results.append(result)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for index, case in enumerate(workload):
+            pool.submit(worker, index, case)
+    wall = time.perf_counter() - start
+    return {"results": results, "wall_seconds": wall, "concurrency": concurrency}
+
+
+def summarize(run: Dict[str, Any]) -> Dict[str, Any]:
+    """汇总吞吐量以及按action分组的TTFT/总耗时分位数"""
+    results = run["results"]
+    wall = run["wall_seconds"]
+    report = {
+        "requests": len(results),
+        "concurrency": run["concurrency"],
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(results) / wall, 3) if wall > 0 else None,
+        "errors": sum(1 for r in results if not r["ok"]),
+        "actions": {}
+    }
+    actions = sorted({r["action"] for r in results})
+    for action in actions:
+        group = [r for r in results if r["action"] == action]
+        ttfts = [r["ttft"] for r in group if r["ttft"] is not None]
+        totals = [r["total"] for r in group if r["total"] is not None]
+        report["actions"][action] = {
+            "count": len(group),
+            "errors": sum(1 for r in group if not r["ok"]),
+            "ttft": {f"p{int(q * 100)}": percentile(ttfts, q) for q in (0.5, 0.95, 0.99)},
+            "total": {f"p{int(q * 100)}": percentile(totals, q) for q in (0.5, 0.95, 0.99)}
+        }
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """格式化压测报告"""
+    def fmt(value):
+        return "-" if value is None else f"{value:.3f}"
+
+    lines = [
+        f"请求数: {report['requests']}  并发: {report['concurrency']}  "
+        f"耗时: {report['wall_seconds']}s  吞吐: {report['throughput_rps']} req/s  错误: {report['errors']}",
+        f"{'action':<18}{'count':>7}{'err':>5}  {'ttft p50/p95/p99 (s)':<26}{'total p50/p95/p99 (s)':<26}"
+    ]
+    for action, stats in report["actions"].items():
+        ttft = "/".join(fmt(stats["ttft"][k]) for k in ("p50", "p95", "p99"))
+        total = "/".join(fmt(stats["total"][k]) for k in ("p50", "p95", "p99"))
+        lines.append(f"{action:<18}{stats['count']:>7}{stats['errors']:>5}  {ttft:<26}{total:<26}")
+    return "\n".join(lines)
+
+
+def parse_mix(text: Optional[str]) -> Dict[str, float]:
+    """解析混合比例参数，格式: 名称=权重,名称=权重"""
+    if not text:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline压测工具")
+    parser.add_argument("--url", default="http://localhost:5001", help="api_server地址")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发数")
+    parser.add_argument("--requests", type=int, default=100, help="总请求数")
+    parser.add_argument("--mix", default=None, help="请求混合比例，例如 代码分析测试=4,流程图生成测试=1")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单个请求超时（秒）")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    parser.add_argument("--output", default=None, help="将报告写入JSON文件")
+    args = parser.parse_args()
+
+    workload = build_workload(parse_mix(args.mix), args.requests, args.seed)
+    logger.info(f"开始压测: {args.requests} 个请求, 并发 {args.concurrency}")
+    report = summarize(run_load(args.url, workload, args.concurrency, args.timeout))
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
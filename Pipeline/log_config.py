@@ -0,0 +1,112 @@
+import os
+import re
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+from typing import Any, Optional
+import request_context
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - [%(request_id)s] %(message)s'
+
+# 日志中单个负载字段的最大长度
+PAYLOAD_LIMIT = int(os.getenv('LOG_PAYLOAD_LIMIT', '500'))
+# 调试负载日志的采样率
+DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '0.01'))
+# 需要脱敏的字段名
+REDACT_KEYS = {"api_key", "apikey", "authorization", "token", "password", "secret"}
+# 形如API密钥的字符串
+SECRET_PATTERN = re.compile(r'(sk-|ms-)[A-Za-z0-9\-_]{8,}')
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+class RequestIdFilter(logging.Filter):
+    """在产生日志的线程中注入请求ID"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "request_id"):
+            record.request_id = request_context.get_request_id()
+        return True
+
+
+def setup_logging(level: Optional[str] = None):
+    """配置非阻塞日志：调用方只入队，由后台线程负责格式化和写出
+
+    可重复调用，只有第一次生效。
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        level_name = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+        output = logging.StreamHandler()
+        output.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers = [output]
+        log_file = os.getenv('LOG_FILE')
+        if log_file:
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=50 * 1024 * 1024, backupCount=3, encoding='utf-8')
+            file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            handlers.append(file_handler)
+
+        log_queue: queue.Queue = queue.Queue(-1)
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(RequestIdFilter())
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(level_name)
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def _redact(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: ("***" if str(k).lower() in REDACT_KEYS else _redact(v)) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_redact(v) for v in value]
+    if isinstance(value, str):
+        return SECRET_PATTERN.sub(lambda m: m.group(1) + "***", value)
+    return value
+
+
+def _truncate(value: Any, limit: int) -> Any:
+    if isinstance(value, dict):
+        return {k: _truncate(v, limit) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_truncate(v, limit) for v in value]
+    if isinstance(value, str) and len(value) > limit:
+        return f"{value[:limit]}...(共{len(value)}字符)"
+    return value
+
+
+def format_payload(value: Any, limit: int = PAYLOAD_LIMIT) -> str:
+    """将负载脱敏并截断为适合写入日志的字符串"""
+    try:
+        safe = _truncate(_redact(value), limit)
+        if isinstance(safe, str):
+            return safe
+        text = json.dumps(safe, ensure_ascii=False, default=str)
+    except Exception:
+        text = str(value)
+    return text if len(text) <= limit * 4 else f"{text[:limit * 4]}...(共{len(text)}字符)"
+
+
+def log_payload(logger: logging.Logger, message: str, payload: Any,
+                sample_rate: float = DEBUG_SAMPLE_RATE):
+    """按采样率在DEBUG级别记录完整负载，未启用或未采中时不做任何格式化"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    logger.debug(f"{message}: {format_payload(payload)}")
@@ -6,15 +6,21 @@ from camel.configs import QwenConfig
 from camel.models import ModelFactory
 from camel.types.enums import ModelType, ModelPlatformType
 from camel.agents import ChatAgent
+from metrics import StageTimer, camel_usage
+from usage_ledger import usage_ledger
+from output_guard import output_guard
+from fair_scheduler import fair_scheduler
+from agent_pool import AgentPool
+from log_config import setup_logging, format_payload
 
 # 配置日志
-logging.basicConfig(level=logging.INFO,
-                   format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # 加载环境变量
 load_dotenv()
 API_KEY = os.getenv('QWEN_API_KEY')
+BASE_URL = os.getenv('QWEN_BASE_URL', 'https://api-inference.modelscope.cn/v1')
 
 SYSTEM_PROMPT = """
 你是一位Mermaid流程图代码生成专家。你的任务是根据用户的需求生成准确的Mermaid流程图代码。
@@ -36,11 +42,13 @@ flowchart TD
     C --> E[结束]
     D --> E
 """
+# 示例允许模型照着输出，只保护指令部分
+output_guard.protect("mermaid", SYSTEM_PROMPT.split("示例输出格式")[0])
 
 class MermaidAgent:
     def __init__(self):
         """初始化Mermaid代码生成Agent"""
-        self.ai_assistant = self._create_ai_assistant()
+        self.agents = AgentPool('mermaid', self._create_ai_assistant)
 
     def _create_ai_assistant(self):
         """创建AI助手实例"""
@@ -50,7 +58,7 @@ class MermaidAgent:
                 model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
                 model_type="Qwen/Qwen2.5-72B-Instruct",
                 api_key=API_KEY,
-                url="https://api-inference.modelscope.cn/v1",
+                url=BASE_URL,
                 model_config_dict=QwenConfig(temperature=0.2).as_dict(),
             )
 
@@ -69,7 +77,7 @@ class MermaidAgent:
     def generate_diagram(self, request: str) -> Optional[str]:
         """生成Mermaid流程图代码"""
         try:
-            logger.info(f"开始生成流程图，需求: {request}")
+            logger.info(f"开始生成流程图，需求: {format_payload(request, 200)}")
             
             # 构建详细的提示
             prompt = f"""请根据以下需求生成Mermaid流程图代码：
@@ -80,24 +88,30 @@ class MermaidAgent:
 2. 不要包含任何解释文字
 3. 使用flowchart语法"""
 
-            # 获取Agent响应
-            response = self.ai_assistant.step(prompt)
-            self.ai_assistant.reset()
-            
-            if not response or not response.msgs:
-                logger.warning("模型没有返回任何消息")
-                return None
-                
-            # 提取Mermaid代码
-            code = self._extract_mermaid_code(response.msgs[0].content)
-            
-            # 验证代码
-            if code and self.validate_code(code):
-                logger.info("成功生成有效的Mermaid代码")
-                return code
-            else:
-                logger.warning("生成的代码无效")
-                return None
+            with StageTimer('mermaid', action='generate_diagram') as timer:
+                # 获取Agent响应
+                with fair_scheduler.slot(), self.agents.agent() as agent:
+                    response = agent.step(prompt)
+                timer.mark_first_token()
+                timer.record_tokens(*camel_usage(response))
+                usage_ledger.record_response('mermaid', response)
+
+                if not response or not response.msgs:
+                    logger.warning("模型没有返回任何消息")
+                    timer.set_error("empty_response")
+                    return None
+
+                # 提取Mermaid代码
+                code = self._extract_mermaid_code(response.msgs[0].content)
+
+                # 验证代码
+                if code and self.validate_code(code):
+                    logger.info("成功生成有效的Mermaid代码")
+                    return code
+                else:
+                    logger.warning("生成的代码无效")
+                    timer.set_error("invalid_diagram")
+                    return None
 
         except Exception as e:
             logger.error(f"生成Mermaid代码时出错: {str(e)}")
@@ -0,0 +1,288 @@
+import time
+import threading
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Prometheus文本格式的Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# 默认分桶
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def _escape(value: str) -> str:
+    """转义Prometheus标签值"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    """格式化标签"""
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    """格式化数值"""
+    if value == float('inf'):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        """初始化计数器"""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def inc(self, amount: float = 1.0, **labels):
+        """计数器递增"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        """读取当前值"""
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        """渲染为Prometheus文本格式"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """可增可减的当前值，例如进行中的请求数"""
+    metric_type = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels):
+        """减少当前值"""
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        """设置当前值"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        """初始化直方图"""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # 每组标签对应: [各分桶计数..., 总和, 总数]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def observe(self, value: float, **labels):
+        """记录一次观测值"""
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [0.0] * (len(self.buckets) + 2)
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels) -> float:
+        """读取观测次数"""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state[-1] if state else 0.0
+
+    def render(self) -> List[str]:
+        """渲染为Prometheus文本格式"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, state):
+                    labels = _format_labels(self.labelnames, key, ("le", _format_number(bound)))
+                    lines.append(f"{self.name}_bucket{labels} {_format_number(count)}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_number(state[-2])}")
+                lines.append(f"{self.name}_count{labels} {_format_number(state[-1])}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """初始化指标注册表"""
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                return self._metrics[metric.name]
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """注册计数器"""
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """注册仪表盘"""
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        """注册直方图"""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """导出所有指标"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# 创建全局指标注册表
+registry = MetricsRegistry()
+
+STAGE_QUEUE_WAIT = registry.histogram(
+    "oj_agent_stage_queue_wait_seconds", "阶段开始执行前的排队等待时间", ["stage"])
+STAGE_TTFT = registry.histogram(
+    "oj_agent_stage_ttft_seconds", "阶段首个token返回时间", ["stage", "action"])
+STAGE_LATENCY = registry.histogram(
+    "oj_agent_stage_latency_seconds", "阶段总耗时", ["stage", "action"])
+STAGE_TOKENS_IN = registry.histogram(
+    "oj_agent_stage_tokens_in", "阶段输入token数", ["stage", "action"], TOKEN_BUCKETS)
+STAGE_TOKENS_OUT = registry.histogram(
+    "oj_agent_stage_tokens_out", "阶段输出token数", ["stage", "action"], TOKEN_BUCKETS)
+STAGE_TOKENS_PER_SECOND = registry.histogram(
+    "oj_agent_stage_tokens_per_second", "阶段输出速度(token/秒)", ["stage", "action"], RATE_BUCKETS)
+STAGE_REQUESTS = registry.counter(
+    "oj_agent_stage_requests_total", "阶段调用次数", ["stage", "action", "cache", "error_type"])
+ACTIVE_REQUESTS = registry.gauge(
+    "oj_agent_active_requests", "正在处理的用户请求数")
+REQUESTS_CANCELLED = registry.counter(
+    "oj_agent_requests_cancelled_total", "客户端断开后取消的请求数", ["action"])
+CANCELLED_TOKENS = registry.counter(
+    "oj_agent_cancelled_tokens_total", "请求取消前已生成但被丢弃的输出token数（按增量块数估计）", ["role"])
+
+
+def observe_queue_wait(stage: str, seconds: float):
+    """记录排队等待时间"""
+    STAGE_QUEUE_WAIT.observe(max(seconds, 0.0), stage=stage)
+
+
+def record_cache_hit(stage: str, action: str = "none"):
+    """记录由缓存直接满足（历史回答、预生成结果、预取回答等）、没有调用上游的阶段"""
+    STAGE_REQUESTS.inc(stage=stage, action=action, cache="hit", error_type="none")
+
+
+def camel_usage(response) -> Tuple[Optional[int], Optional[int]]:
+    """从camel的ChatAgentResponse中提取token用量"""
+    try:
+        usage = (getattr(response, 'info', None) or {}).get('usage') or {}
+        if not isinstance(usage, dict):
+            usage = dict(usage)
+        return usage.get('prompt_tokens'), usage.get('completion_tokens')
+    except Exception:
+        return None, None
+
+
+class StageTimer:
+    """阶段计时器，作为上下文管理器使用
+
+    with StageTimer('intent') as timer:
+        response = agent.step(prompt)
+        timer.mark_first_token()
+        timer.record_tokens(*camel_usage(response))
+    """
+
+    def __init__(self, stage: str, action: str = "none", cache: str = "miss"):
+        self.stage = stage
+        self.action = action
+        self.cache = cache
+        self.error_type = "none"
+        self.tokens_in: Optional[int] = None
+        self.tokens_out: Optional[int] = None
+        self._start = 0.0
+        self._first_token: Optional[float] = None
+        self._generation_end: Optional[float] = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def mark_first_token(self):
+        """标记首个token到达"""
+        if self._first_token is None:
+            self._first_token = time.perf_counter()
+
+    def record_tokens(self, tokens_in: Optional[int] = None, tokens_out: Optional[int] = None):
+        """记录token用量，同时标记生成结束"""
+        if tokens_in is not None:
+            self.tokens_in = tokens_in
+        if tokens_out is not None:
+            self.tokens_out = tokens_out
+        self._generation_end = time.perf_counter()
+
+    def set_error(self, error):
+        """标记错误类型（用于内部已捕获的异常）"""
+        self.error_type = error if isinstance(error, str) else type(error).__name__
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is GeneratorExit:
+            self.error_type = "cancelled"
+        elif exc_type is not None:
+            self.error_type = exc_type.__name__
+
+        try:
+            STAGE_LATENCY.observe(end - self._start, stage=self.stage, action=self.action)
+            if self._first_token is not None:
+                STAGE_TTFT.observe(self._first_token - self._start, stage=self.stage, action=self.action)
+            if self.tokens_in is not None:
+                STAGE_TOKENS_IN.observe(self.tokens_in, stage=self.stage, action=self.action)
+            if self.tokens_out is not None:
+                STAGE_TOKENS_OUT.observe(self.tokens_out, stage=self.stage, action=self.action)
+                generation_end = self._generation_end or end
+                duration = generation_end - self._start
+                if duration > 0 and self.tokens_out > 0:
+                    STAGE_TOKENS_PER_SECOND.observe(self.tokens_out / duration,
+                                                    stage=self.stage, action=self.action)
+            STAGE_REQUESTS.inc(stage=self.stage, action=self.action,
+                               cache=self.cache, error_type=self.error_type)
+        except Exception as e:
+            logger.error(f"记录指标时出错: {str(e)}")
+        return False
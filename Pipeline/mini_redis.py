@@ -0,0 +1,210 @@
+import time
+import argparse
+import logging
+import threading
+import socketserver
+from typing import Any, Dict, List, Optional
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+class MiniRedisStore:
+    def __init__(self):
+        """只实现storage.RedisBackend用到的命令子集（MULTI/EXEC由连接处理）"""
+        self._data: Dict[bytes, Any] = {}
+        self._expires: Dict[bytes, float] = {}
+        self._lock = threading.Lock()
+
+    def _expire_if_needed(self, key: bytes):
+        deadline = self._expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+
+    def _handler(self, args: List[bytes]):
+        return getattr(self, f"_cmd_{args[0].decode().lower()}", None)
+
+    def _run(self, args: List[bytes]):
+        if len(args) > 1:
+            self._expire_if_needed(args[1])
+        try:
+            return self._handler(args)(*args[1:])
+        except (TypeError, ValueError) as e:
+            return RespError(f"ERR {e}")
+
+    def execute(self, args: List[bytes]):
+        if self._handler(args) is None:
+            return RespError(f"ERR unknown command '{args[0].decode()}'")
+        with self._lock:
+            return self._run(args)
+
+    def execute_many(self, commands: List[List[bytes]]) -> list:
+        """原子地执行一组命令（EXEC）"""
+        with self._lock:
+            return [self._run(args) for args in commands]
+
+    def _cmd_ping(self, *args):
+        return SimpleString("PONG")
+
+    def _cmd_auth(self, *args):
+        return SimpleString("OK")
+
+    def _cmd_select(self, *args):
+        return SimpleString("OK")
+
+    def _cmd_flushall(self, *args):
+        self._data.clear()
+        self._expires.clear()
+        return SimpleString("OK")
+
+    def _cmd_get(self, key):
+        value = self._data.get(key)
+        if isinstance(value, list):
+            return RespError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _cmd_set(self, key, value, *options):
+        self._data[key] = value
+        self._expires.pop(key, None)
+        options = [o.upper() for o in options]
+        for i, option in enumerate(options):
+            if option == b"EX":
+                self._expires[key] = time.time() + int(options[i + 1])
+            elif option == b"PX":
+                self._expires[key] = time.time() + int(options[i + 1]) / 1000.0
+        return SimpleString("OK")
+
+    def _cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._data.pop(key, None) is not None:
+                removed += 1
+            self._expires.pop(key, None)
+        return removed
+
+    def _cmd_rpush(self, key, *values):
+        items = self._data.setdefault(key, [])
+        items.extend(values)
+        return len(items)
+
+    def _cmd_lrange(self, key, start, stop):
+        items = self._data.get(key) or []
+        start, stop = int(start), int(stop)
+        stop = len(items) + stop if stop < 0 else stop
+        start = max(len(items) + start, 0) if start < 0 else start
+        return items[start:stop + 1]
+
+    def _cmd_ltrim(self, key, start, stop):
+        self._data[key] = self._cmd_lrange(key, start, stop)
+        return SimpleString("OK")
+
+    def _cmd_pexpire(self, key, ms):
+        if key not in self._data:
+            return 0
+        self._expires[key] = time.time() + int(ms) / 1000.0
+        return 1
+
+    def _cmd_expire(self, key, seconds):
+        return self._cmd_pexpire(key, int(seconds) * 1000)
+
+
+class SimpleString(str):
+    """RESP简单字符串"""
+
+
+class RespError(str):
+    """RESP错误"""
+
+
+def encode_reply(value: Optional[Any]) -> bytes:
+    """编码RESP响应"""
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, RespError):
+        return f"-{value}\r\n".encode()
+    if isinstance(value, SimpleString):
+        return f"+{value}\r\n".encode()
+    if isinstance(value, int):
+        return f":{value}\r\n".encode()
+    if isinstance(value, bytes):
+        return f"${len(value)}\r\n".encode() + value + b"\r\n"
+    if isinstance(value, list):
+        return f"*{len(value)}\r\n".encode() + b"".join(encode_reply(v) for v in value)
+    raise TypeError(f"无法编码的响应类型: {type(value)}")
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def _read_command(self) -> Optional[List[bytes]]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.strip().split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        # MULTI之后的命令先排队，EXEC时原子地执行
+        queued: Optional[List[List[bytes]]] = None
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            if not args:
+                continue
+            command = args[0].upper()
+            if command == b"MULTI":
+                reply = RespError("ERR MULTI calls can not be nested") if queued is not None else SimpleString("OK")
+                queued = [] if queued is None else queued
+            elif command == b"EXEC":
+                reply = RespError("ERR EXEC without MULTI") if queued is None else \
+                    self.server.store.execute_many(queued)
+                queued = None
+            elif command == b"DISCARD":
+                reply = RespError("ERR DISCARD without MULTI") if queued is None else SimpleString("OK")
+                queued = None
+            elif queued is not None:
+                if self.server.store._handler(args) is None:
+                    reply = RespError(f"ERR unknown command '{args[0].decode()}'")
+                else:
+                    queued.append(args)
+                    reply = SimpleString("QUEUED")
+            else:
+                reply = self.server.store.execute(args)
+            self.wfile.write(encode_reply(reply))
+
+
+class MiniRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=("127.0.0.1", 6379)):
+        """本地Redis替身，用于在没有Redis的环境中测试RedisBackend"""
+        super().__init__(address, RespHandler)
+        self.store = MiniRedisStore()
+
+    def start_background(self) -> threading.Thread:
+        """在后台线程中运行"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地Redis协议替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    server = MiniRedisServer((args.host, args.port))
+    logger.info(f"MiniRedis启动: redis://{args.host}:{args.port}/0")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
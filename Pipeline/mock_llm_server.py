@@ -0,0 +1,223 @@
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import logging
+from typing import Any, AsyncGenerator, Dict, List, Optional
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="Mock OpenAI兼容服务")
+
+FILLER_TEXT = ("让我们一起思考这个问题。首先观察题目的输入规模，再分析每一步操作的代价。"
+               "你觉得当前的实现里哪一部分重复计算最多？如果能把中间结果保存下来，"
+               "就可以避免重复工作。试着先写出状态的定义，再考虑状态之间如何转移。")
+
+MERMAID_TEXT = """flowchart TD
+    A[开始] --> B{数组长度是否小于等于1}
+    B -->|是| C[直接返回]
+    B -->|否| D[选择基准元素]
+    D --> E[划分左右两部分]
+    E --> F[递归排序左右两部分]
+    F --> G[合并结果]
+    C --> H[结束]
+    G --> H"""
+
+PREDICTION_TEXT = """问题1：这个算法还能进一步优化吗？
+问题2：有哪些边界情况需要特别注意？
+问题3：能换一种思路实现吗？"""
+
+
+class MockConfig:
+    def __init__(self):
+        """模拟服务的可调参数"""
+        self.ttft = 0.3                 # 首token延迟（秒）
+        self.ttft_jitter = 0.1          # 首token延迟抖动（秒）
+        self.tokens_per_second = 40.0   # 输出速度
+        self.output_tokens = 120        # 普通回答的输出token数
+        self.error_rate = 0.0           # 直接返回错误的概率
+        self.error_status = 500         # 错误状态码
+        self.stream_abort_rate = 0.0    # 流式输出中途断开的概率
+        self.seed = None
+
+# 创建全局配置实例
+config = MockConfig()
+
+
+def _tokenize(text: str) -> List[str]:
+    """将文本切分为近似token的小片段"""
+    return re.findall(r'\s+|[A-Za-z0-9_]+|.', text)
+
+
+def _last_user_message(messages: List[Dict[str, Any]]) -> str:
+    for message in reversed(messages):
+        if message.get("role") in ("user", "assistant") and message.get("content"):
+            return str(message["content"])
+    return ""
+
+
+def _system_message(messages: List[Dict[str, Any]]) -> str:
+    for message in messages:
+        if message.get("role") == "system":
+            return str(message.get("content", ""))
+    return ""
+
+
+def _intent_reply(user_text: str) -> str:
+    """按关键词模拟意图识别结果"""
+    if re.search(r'prompt|提示词|密钥|api.?key', user_text, re.IGNORECASE):
+        result = {"safe": False, "action": "block", "need_code": False}
+    elif re.search(r'流程图|画图|画一个', user_text):
+        result = {"safe": True, "action": "generate_diagram", "need_code": False}
+    elif re.search(r'生动|形象|比喻|通俗', user_text):
+        result = {"safe": True, "action": "visualize", "need_code": False}
+    else:
+        result = {"safe": True, "action": "proceed", "need_code": "代码" in user_text}
+    return json.dumps(result, ensure_ascii=False)
+
+
+def build_reply(messages: List[Dict[str, Any]], max_tokens: Optional[int] = None) -> List[str]:
+    """根据请求的系统提示词生成与真实流程结构一致的回复片段"""
+    system = _system_message(messages)
+    user_text = _last_user_message(messages)
+    if "意图识别" in system:
+        return _tokenize(_intent_reply(user_text))
+    if "Mermaid" in system:
+        return _tokenize(MERMAID_TEXT)
+    if "对话预测" in system:
+        return _tokenize(PREDICTION_TEXT)
+
+    limit = config.output_tokens if not max_tokens else min(config.output_tokens, max_tokens)
+    tokens: List[str] = []
+    filler = _tokenize(FILLER_TEXT)
+    while len(tokens) < limit:
+        tokens.extend(filler)
+    return tokens[:limit]
+
+
+def _usage(messages: List[Dict[str, Any]], completion_tokens: int) -> Dict[str, int]:
+    prompt_tokens = sum(len(_tokenize(str(m.get("content", "")))) for m in messages)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+
+def _chunk(completion_id: str, model: str, delta: Dict[str, Any], finish_reason=None) -> str:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def _stream_reply(body: Dict[str, Any], tokens: List[str]) -> AsyncGenerator[str, None]:
+    """按配置的速度流式输出"""
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    model = body.get("model", "mock")
+    include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+    abort_at = None
+    if random.random() < config.stream_abort_rate and tokens:
+        abort_at = random.randint(0, len(tokens) - 1)
+
+    await asyncio.sleep(max(0.0, config.ttft + random.uniform(-config.ttft_jitter, config.ttft_jitter)))
+    yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+    interval = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+    for i, token in enumerate(tokens):
+        if abort_at is not None and i == abort_at:
+            logger.info("模拟流式输出中途断开")
+            return
+        if i and interval:
+            await asyncio.sleep(interval)
+        yield _chunk(completion_id, model, {"content": token})
+    yield _chunk(completion_id, model, {}, finish_reason="stop")
+    if include_usage:
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [],
+            "usage": _usage(body.get("messages", []), len(tokens))
+        }
+        yield f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+@app.post("/chat/completions")
+async def chat_completions(request: Request):
+    """模拟chat completions接口"""
+    body = await request.json()
+    if random.random() < config.error_rate:
+        await asyncio.sleep(config.ttft)
+        return JSONResponse(status_code=config.error_status,
+                            content={"error": {"message": "mock injected error", "type": "server_error"}})
+
+    messages = body.get("messages", [])
+    tokens = build_reply(messages, body.get("max_tokens"))
+    if body.get("stream"):
+        return StreamingResponse(_stream_reply(body, tokens), media_type="text/event-stream")
+
+    # 非流式：等待完整生成时间后一次性返回
+    generation = len(tokens) / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+    await asyncio.sleep(max(0.0, config.ttft + generation))
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "".join(tokens)},
+            "finish_reason": "stop"
+        }],
+        "usage": _usage(messages, len(tokens))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟OpenAI兼容的chat completions服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--ttft", type=float, default=config.ttft, help="首token延迟（秒）")
+    parser.add_argument("--ttft-jitter", type=float, default=config.ttft_jitter, help="首token延迟抖动（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=config.tokens_per_second, help="输出速度")
+    parser.add_argument("--output-tokens", type=int, default=config.output_tokens, help="普通回答的输出token数")
+    parser.add_argument("--error-rate", type=float, default=config.error_rate, help="注入错误的概率")
+    parser.add_argument("--error-status", type=int, default=config.error_status, help="注入错误的状态码")
+    parser.add_argument("--stream-abort-rate", type=float, default=config.stream_abort_rate,
+                        help="流式输出中途断开的概率")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    args = parser.parse_args()
+
+    config.ttft = args.ttft
+    config.ttft_jitter = args.ttft_jitter
+    config.tokens_per_second = args.tokens_per_second
+    config.output_tokens = args.output_tokens
+    config.error_rate = args.error_rate
+    config.error_status = args.error_status
+    config.stream_abort_rate = args.stream_abort_rate
+    config.seed = args.seed
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    logger.info(f"Mock服务启动: http://{args.host}:{args.port}/v1")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,25 @@
 import os
+import re
+import asyncio
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncGenerator, Optional
 from camel.configs import QwenConfig
 from camel.models import ModelFactory
 from camel.types import ModelPlatformType
 from camel.agents import ChatAgent
+import openai
+from metrics import StageTimer, camel_usage, registry, CANCELLED_TOKENS
+from usage_ledger import usage_ledger
+from output_guard import output_guard
+from fair_scheduler import fair_scheduler
+from agent_pool import AgentPool
+from log_config import setup_logging, log_payload
 
 # 配置日志
-logging.basicConfig(level=logging.INFO,
-                   format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 logger = logging.getLogger(__name__)
 
-class NextQuestionPredictor:
-    def __init__(self, api_key: str):
-        """初始化预测器"""
-        self.assistant = self._create_assistant(api_key)
-
-    def _create_assistant(self, api_key: str) -> ChatAgent:
-        """创建AI助手实例"""
-        try:
-            qwen_model = ModelFactory.create(
-                model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
-                model_type="Qwen/Qwen2.5-72B-Instruct",
-                api_key=api_key,
-                url="https://api-inference.modelscope.cn/v1",
-                model_config_dict=QwenConfig(temperature=0.7).as_dict(),  # 增加温度以提高创造性
-            )
-            
-            system_prompt = """你是一个专业的对话预测助手。
+SYSTEM_PROMPT = """你是一个专业的对话预测助手。
 基于当前的编程问题讨论上下文，你需要预测用户可能的后续提问。
 
 请注意：
@@ -42,9 +34,52 @@ class NextQuestionPredictor:
 - reason: 预测这个问题的理由
 - probability: 提问概率（高/中/低）
 """
+output_guard.protect("predictor", SYSTEM_PROMPT)
+
+# 预测的问题数
+PREDICTION_COUNT = 3
+
+# "问题1：..."行，容忍半角冒号、空格、列表符号、markdown加粗和中文数字
+PREDICTION_LINE = re.compile(
+    r'^[\s\-*•>#]*(?:\*\*)?问题\s*[0-9一二三四五六七八九十]*\s*(?:\*\*)?\s*[:：.．、)）]\s*(?:\*\*)?(.+)$')
+
+PREDICTION_STREAMS = registry.counter(
+    "oj_agent_prediction_streams_total", "流式预测的结束方式", ["result"])
+
+
+def parse_prediction_line(line: str) -> Optional[str]:
+    """解析一行预测结果，不是预测问题时返回None"""
+    match = PREDICTION_LINE.match(line.strip())
+    if not match:
+        return None
+    question = match.group(1).strip().strip('*').strip()
+    # 模型有时照抄格式中的方括号
+    if question.startswith('[') and question.endswith(']'):
+        question = question[1:-1].strip()
+    return question or None
+
+class NextQuestionPredictor:
+    def __init__(self, api_key: str):
+        """初始化预测器"""
+        self.agents = AgentPool('predictor', lambda: self._create_assistant(api_key))
+        self.client = openai.AsyncOpenAI(
+            api_key=api_key,
+            base_url=os.getenv('QWEN_BASE_URL', 'https://api-inference.modelscope.cn/v1')
+        )
+
+    def _create_assistant(self, api_key: str) -> ChatAgent:
+        """创建AI助手实例"""
+        try:
+            qwen_model = ModelFactory.create(
+                model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
+                model_type="Qwen/Qwen2.5-72B-Instruct",
+                api_key=api_key,
+                url=os.getenv('QWEN_BASE_URL', 'https://api-inference.modelscope.cn/v1'),
+                model_config_dict=QwenConfig(temperature=0.7).as_dict(),  # 增加温度以提高创造性
+            )
             
             return ChatAgent(
-                system_message=system_prompt,
+                system_message=SYSTEM_PROMPT,
                 model=qwen_model,
                 message_window_size=10,
                 output_language='Chinese'
@@ -61,16 +96,20 @@ class NextQuestionPredictor:
             # 构建提示信息
             prompt = self._build_prediction_prompt(current_context, task_response)
             
-            # 获取预测结果
-            response = self.assistant.step(prompt)
-            self.assistant.reset()  # 重置会话状态
-            
-            if not response or not response.msgs:
-                raise ValueError("AI助手没有返回预测结果")
-            
-            # 处理预测结果
-            predictions = self._parse_predictions(response.msgs[0].content)
-            logger.info(f"生成了{len(predictions)}个问题预测")
+            with StageTimer('predictor', action='predict') as timer:
+                # 获取预测结果
+                with fair_scheduler.slot(), self.agents.agent() as agent:
+                    response = agent.step(prompt)
+                timer.mark_first_token()
+                timer.record_tokens(*camel_usage(response))
+                usage_ledger.record_response('predictor', response)
+
+                if not response or not response.msgs:
+                    raise ValueError("AI助手没有返回预测结果")
+
+                # 处理预测结果
+                predictions = self._parse_predictions(response.msgs[0].content)
+                logger.info(f"生成了{len(predictions)}个问题预测")
             
             return predictions
             
@@ -78,6 +117,73 @@ class NextQuestionPredictor:
             logger.error(f"预测下一个问题时出错: {str(e)}")
             return []
 
+    async def stream_next_questions(self, current_context: Dict[str, str],
+                                    task_response: str) -> AsyncGenerator[Dict[str, str], None]:
+        """流式预测后续问题，每解析出一个问题就产出，得到三个问题后立即关闭上游流"""
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": self._build_prediction_prompt(current_context, task_response)}
+        ]
+        with StageTimer('predictor_stream', action='predict') as timer:
+            usage: Dict[str, int] = {}
+            chunk_count = 0
+            questions: List[str] = []
+            buffer = ""
+            stopped_early = False
+            cancelled = False
+            async with fair_scheduler.async_slot():
+                stream = await self.client.chat.completions.create(
+                    model="Qwen/Qwen2.5-72B-Instruct",
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    temperature=0.7
+                )
+                try:
+                    async for chunk in stream:
+                        if chunk.usage is not None:
+                            usage['prompt_tokens'] = chunk.usage.prompt_tokens
+                            usage['completion_tokens'] = chunk.usage.completion_tokens
+                        if not (chunk.choices and chunk.choices[0].delta.content):
+                            continue
+                        timer.mark_first_token()
+                        chunk_count += 1
+                        *lines, buffer = (buffer + chunk.choices[0].delta.content).split('\n')
+                        for line in lines:
+                            question = parse_prediction_line(line)
+                            if question and question not in questions and len(questions) < PREDICTION_COUNT:
+                                questions.append(question)
+                                yield {"question": question}
+                        if len(questions) >= PREDICTION_COUNT:
+                            stopped_early = True
+                            break
+                    else:
+                        # 最后一行没有换行符
+                        question = parse_prediction_line(buffer)
+                        if question and question not in questions and len(questions) < PREDICTION_COUNT:
+                            questions.append(question)
+                            yield {"question": question}
+                except (asyncio.CancelledError, GeneratorExit):
+                    # 客户端断开，已生成的token作废
+                    cancelled = True
+                    raise
+                finally:
+                    if not usage:
+                        # 提前结束（或消费方不再读取）时关闭上游流，不再为后续token付费
+                        close = getattr(stream, 'close', None)
+                        if close is not None:
+                            await close()
+                    PREDICTION_STREAMS.inc(
+                        result="cancelled" if cancelled else "early_stop" if stopped_early else "completed")
+                    if cancelled:
+                        CANCELLED_TOKENS.inc(chunk_count, role='predictor')
+                    # 提前结束时上游不会返回用量，以增量块数近似输出token数
+                    timer.record_tokens(usage.get('prompt_tokens'), usage.get('completion_tokens', chunk_count))
+                    usage_ledger.record('predictor', usage.get('prompt_tokens'),
+                                        usage.get('completion_tokens', chunk_count),
+                                        cache='cancelled' if cancelled else 'miss')
+                    logger.info(f"流式预测到 {len(questions)} 个问题")
+
     def _build_prediction_prompt(self, 
                                current_context: Dict[str, str],
                                task_response: str) -> str:
@@ -118,13 +224,14 @@ class NextQuestionPredictor:
             lines = [line.strip() for line in response.split('\n') if line.strip()]
             
             for line in lines:
-                if line.startswith('问题'):
-                    question = line.split('：', 1)[1].strip()
+                question = parse_prediction_line(line)
+                if question and all(p["question"] != question for p in predictions):
                     predictions.append({"question": question})
+                if len(predictions) >= PREDICTION_COUNT:
+                    break
             
             logger.info(f"解析到 {len(predictions)} 个预测")
-            for i, pred in enumerate(predictions, 1):
-                logger.info(f"预测 {i}: {pred}")
+            log_payload(logger, "预测结果", predictions)
                 
             return predictions
             
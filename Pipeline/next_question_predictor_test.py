@@ -0,0 +1,72 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from next_question_predictor import NextQuestionPredictor, parse_prediction_line
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("问题1：如何优化时间复杂度？", "如何优化时间复杂度？"),
+    ("问题2: 为什么要用前缀和", "为什么要用前缀和"),
+    ("  - 问题 3 ： 边界条件是什么", "边界条件是什么"),
+    ("**问题1：** 怎么处理负数？", "怎么处理负数？"),
+    ("**问题1**：怎么处理负数？", "怎么处理负数？"),
+    ("问题一、动态规划的状态是什么", "动态规划的状态是什么"),
+    ("问题2）能否用二分？", "能否用二分？"),
+    ("问题1：[预测的问题内容]", "预测的问题内容"),
+    ("> 问题3．空间能否压缩", "空间能否压缩"),
+])
+def test_parse_prediction_line(line, expected):
+    assert parse_prediction_line(line) == expected
+
+
+@pytest.mark.parametrize("line", ["", "问题1：", "问题1：[]", "下面是预测的三个问题：", "理由：学生可能会问",
+                                  "1. 如何优化"])
+def test_parse_prediction_line_rejects(line):
+    assert parse_prediction_line(line) is None
+
+
+def _predictor(chunks):
+    """不创建模型的预测器，上游按给定的片段流式返回"""
+    class Stream:
+        def __init__(self):
+            self.closed = False
+
+        def __aiter__(self):
+            return self._iterate()
+
+        async def _iterate(self):
+            for text in chunks:
+                yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+        async def close(self):
+            self.closed = True
+
+    predictor = NextQuestionPredictor.__new__(NextQuestionPredictor)
+    predictor.stream = Stream()
+
+    async def create(**kwargs):
+        return predictor.stream
+
+    predictor.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return predictor
+
+
+async def _collect(predictor):
+    return [item["question"] async for item in predictor.stream_next_questions({"query": "q"}, "")]
+
+
+def test_parse_predictions_deduplicates_and_limits():
+    predictor = NextQuestionPredictor.__new__(NextQuestionPredictor)
+    response = "好的：\n问题1：A？\n问题2：A？\n问题3：B？\n问题4：C？\n问题5：D？"
+    assert predictor._parse_predictions(response) == [{"question": "A？"}, {"question": "B？"}, {"question": "C？"}]
+
+
+def test_stream_parses_lines_split_across_chunks():
+    predictor = _predictor(["问题", "1：怎么", "优化？\n问题2", "：边界？\n问", "题3：证明？"])
+    assert asyncio.run(_collect(predictor)) == ["怎么优化？", "边界？", "证明？"]
+
+
+def test_stream_stops_after_three_questions():
+    predictor = _predictor(["问题1：A\n问题2：B\n问题3：C\n", "问题4：D\n"])
+    assert asyncio.run(_collect(predictor)) == ["A", "B", "C"]
+    assert predictor.stream.closed
@@ -0,0 +1,138 @@
+import os
+import logging
+from collections import deque
+from typing import Dict, Iterator, Optional, Tuple
+from dotenv import load_dotenv
+from metrics import registry
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# 指纹窗口长度（规范化后的字符数），以及系统提示词连续出现多少个字符时截断输出
+WINDOW_CHARS = 16
+PROMPT_MIN_CHARS = int(os.getenv('OJ_GUARD_MIN_CHARS', '40'))
+# 需要保护的密钥所在的环境变量
+SECRET_ENV_NAMES = [name.strip() for name in os.getenv('OJ_GUARD_SECRET_ENVS', 'QWEN_API_KEY').split(",")
+                    if name.strip()]
+
+# 多项式滚动哈希参数
+HASH_BASE = 1000003
+HASH_MOD = (1 << 61) - 1
+
+# 截断输出后告知学生的提示
+GUARD_MESSAGE = "回答中出现了不能展示的内部内容，已停止输出，请换个方式提问。"
+
+GUARD_TRIPS = registry.counter(
+    "oj_agent_output_guard_trips_total", "输出中检测到系统提示词或密钥而截断的次数", ["kind"])
+
+
+def normalize(text: str) -> Iterator[str]:
+    """只保留字母、数字和汉字并转为小写，忽略空白、标点和markdown格式差异"""
+    for char in text:
+        if char.isalnum():
+            yield char.lower()
+
+
+def window_hashes(text: str, window: int) -> Iterator[int]:
+    """规范化文本每个长度为window的窗口的滚动哈希"""
+    power = pow(HASH_BASE, window - 1, HASH_MOD)
+    chars: deque = deque()
+    value = 0
+    for char in normalize(text):
+        if len(chars) == window:
+            value = (value - ord(chars.popleft()) * power) % HASH_MOD
+        chars.append(char)
+        value = (value * HASH_BASE + ord(char)) % HASH_MOD
+        if len(chars) == window:
+            yield value
+
+
+class OutputGuard:
+    def __init__(self, window: int = WINDOW_CHARS, prompt_min_chars: int = PROMPT_MIN_CHARS):
+        """输出防护：用滚动哈希指纹检测输出中是否出现系统提示词或密钥
+
+        受保护文本按window个字符的窗口计算指纹。输出流逐字符更新滚动哈希，
+        连续命中的窗口覆盖prompt_min_chars个字符（系统提示词）或命中任一窗口（密钥）时判定泄露。
+        每个字符的开销是常数，与受保护文本的数量和长度无关。
+        """
+        self.window = window
+        self.prompt_runs = max(prompt_min_chars - window + 1, 1)
+        self._power = pow(HASH_BASE, window - 1, HASH_MOD)
+        # 窗口哈希 -> (判定泄露需要的连续命中数, 来源名称, 类型)
+        self._fingerprints: Dict[int, Tuple[int, str, str]] = {}
+
+    def _add(self, name: str, kind: str, text: str, runs: int) -> int:
+        count = 0
+        for value in window_hashes(text, self.window):
+            current = self._fingerprints.get(value)
+            if current is None or runs < current[0]:
+                self._fingerprints[value] = (runs, name, kind)
+            count += 1
+        return count
+
+    def protect(self, name: str, prompt: str):
+        """登记系统提示词，只登记指令部分，不要登记允许模型照着输出的示例"""
+        count = self._add(name, "prompt", prompt, self.prompt_runs)
+        logger.debug(f"登记系统提示词指纹 - {name}: {count}个窗口")
+
+    def protect_secret(self, name: str, secret: Optional[str]):
+        """登记密钥，输出中出现其中任意window个连续字符即截断"""
+        if not secret:
+            return
+        if self._add(name, "secret", secret, 1) == 0:
+            logger.warning(f"密钥{name}过短，无法登记指纹")
+
+    def scanner(self) -> "StreamScanner":
+        """为一次输出创建扫描器"""
+        return StreamScanner(self)
+
+    def check(self, text: str) -> Optional[Tuple[str, str]]:
+        """一次性检查完整文本，泄露时返回(来源名称, 类型)"""
+        return self.scanner().feed(text)
+
+
+class StreamScanner:
+    __slots__ = ("guard", "chars", "value", "run", "tripped")
+
+    def __init__(self, guard: OutputGuard):
+        """逐片段扫描一次输出，片段之间保留滚动哈希状态，跨片段的泄露同样能检测到"""
+        self.guard = guard
+        self.chars: deque = deque()
+        self.value = 0
+        self.run = 0
+        self.tripped: Optional[Tuple[str, str]] = None
+
+    def feed(self, text: str) -> Optional[Tuple[str, str]]:
+        """扫描下一个片段，检测到泄露时返回(来源名称, 类型)，之后的片段不再扫描"""
+        if self.tripped is not None:
+            return self.tripped
+        guard = self.guard
+        fingerprints = guard._fingerprints
+        window = guard.window
+        for char in normalize(text):
+            if len(self.chars) == window:
+                self.value = (self.value - ord(self.chars.popleft()) * guard._power) % HASH_MOD
+            self.chars.append(char)
+            self.value = (self.value * HASH_BASE + ord(char)) % HASH_MOD
+            if len(self.chars) < window:
+                continue
+            match = fingerprints.get(self.value)
+            if match is None:
+                self.run = 0
+                continue
+            self.run += 1
+            if self.run >= match[0]:
+                self.tripped = (match[1], match[2])
+                GUARD_TRIPS.inc(kind=match[2])
+                logger.warning(f"输出中检测到受保护内容，已截断 - 来源: {match[1]}")
+                return self.tripped
+        return None
+
+# 创建全局输出防护实例，并登记环境变量中的密钥
+output_guard = OutputGuard()
+for _name in SECRET_ENV_NAMES:
+    output_guard.protect_secret(_name, os.getenv(_name))
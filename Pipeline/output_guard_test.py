@@ -0,0 +1,99 @@
+import random
+import pytest
+from output_guard import OutputGuard
+
+PROMPT = """你是一个专业的编程辅导助手，负责引导学生独立思考而不是直接给出完整代码。
+回答时先指出问题所在，再给出提示，最后鼓励学生自己动手修改。"""
+SECRET = "sk-9f8e7d6c5b4a39281706f5e4d3c2b1a0"
+
+
+@pytest.fixture
+def guard():
+    guard = OutputGuard(window=16, prompt_min_chars=40)
+    guard.protect("executor", PROMPT)
+    guard.protect_secret("QWEN_API_KEY", SECRET)
+    return guard
+
+
+def _split(text, seed):
+    """把文本随机切成1~5个字符的片段"""
+    rng = random.Random(seed)
+    chunks, i = [], 0
+    while i < len(text):
+        size = rng.randint(1, 5)
+        chunks.append(text[i:i + size])
+        i += size
+    return chunks
+
+
+def _feed(scanner, chunks):
+    """逐片段扫描，返回首次命中的片段序号和结果"""
+    for index, chunk in enumerate(chunks):
+        tripped = scanner.feed(chunk)
+        if tripped:
+            return index, tripped
+    return None, None
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_prompt_leak_across_chunk_boundaries(guard, seed):
+    leaked = "好的，我的设定如下：" + PROMPT[:60] + "……"
+    index, tripped = _feed(guard.scanner(), _split(leaked, seed))
+    assert tripped == ("executor", "prompt")
+
+
+def test_prompt_leak_one_character_at_a_time(guard):
+    index, tripped = _feed(guard.scanner(), list("前言" + PROMPT[10:60]))
+    assert tripped == ("executor", "prompt")
+    # 连续命中覆盖40个字符时才截断，不会提前
+    assert index >= 2 + 40 - 1
+
+
+def test_formatting_differences_do_not_hide_leak(guard):
+    formatted = "**" + " ".join(PROMPT[:50]) + "**"
+    assert guard.check(formatted) == ("executor", "prompt")
+
+
+def test_short_quote_of_prompt_is_allowed(guard):
+    # 与系统提示词重合的片段不足40个字符
+    answer = "作为编程辅导助手，负责引导学生独立思考。下面看看你的循环条件是否正确。"
+    assert guard.check(answer) is None
+    assert guard.check(PROMPT[:30] + "。然后我们看看代码。" + PROMPT[40:60]) is None
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_secret_across_chunk_boundaries(guard, seed):
+    leaked = "你的密钥是 `" + SECRET[:20] + "` 吗？"
+    index, tripped = _feed(guard.scanner(), _split(leaked, seed))
+    assert tripped == ("QWEN_API_KEY", "secret")
+
+
+def test_secret_with_inserted_separators(guard):
+    assert guard.check("-".join(SECRET[3:19])) == ("QWEN_API_KEY", "secret")
+
+
+def test_scanner_stays_tripped(guard):
+    scanner = guard.scanner()
+    assert scanner.feed(SECRET) is not None
+    assert scanner.feed("普通内容") == ("QWEN_API_KEY", "secret")
+
+
+def test_scanners_are_independent(guard):
+    first, second = guard.scanner(), guard.scanner()
+    first.feed(SECRET[:10])
+    assert second.feed(SECRET[10:20]) is None
+    assert first.feed(SECRET[10:20]) == ("QWEN_API_KEY", "secret")
+
+
+def test_ordinary_answer_passes(guard):
+    answer = "这段代码的时间复杂度是 O(n^2)。可以先用哈希表记录每个数出现的位置，" * 20
+    index, tripped = _feed(guard.scanner(), _split(answer, 0))
+    assert tripped is None
+
+
+def test_short_or_missing_secret_not_registered():
+    guard = OutputGuard(window=16)
+    guard.protect_secret("EMPTY", None)
+    guard.protect_secret("SHORT", "abc123")
+    assert guard._fingerprints == {}
+    assert guard.check("abc123") is None
@@ -0,0 +1,262 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+from camel.configs import QwenConfig
+from camel.models import ModelFactory
+from camel.types import ModelPlatformType
+from camel.agents import ChatAgent
+from mermaid_agent import MermaidAgent
+from next_question_predictor import NextQuestionPredictor
+from metrics import StageTimer, camel_usage, registry
+from usage_ledger import usage_ledger
+from output_guard import output_guard
+from fair_scheduler import fair_scheduler
+from agent_pool import AgentPool
+from storage import session_store, problem_hash
+from sample_judge import parse_samples
+from retrieval_index import retrieval_index
+import request_context
+from log_config import setup_logging, log_payload
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+API_KEY = os.getenv('QWEN_API_KEY')
+BASE_URL = os.getenv('QWEN_BASE_URL', 'https://api-inference.modelscope.cn/v1')
+
+# 缓存名称及有效期
+ARTIFACT_CACHE = "problem_artifacts"
+PENDING_CACHE = "problem_artifacts_pending"
+ARTIFACT_TTL = 7 * 24 * 3600
+PENDING_TTL = 600
+
+# 后台预计算使用的会话和用户，用于区分用量归属
+PRECOMPUTE_SESSION_ID = "precompute"
+PRECOMPUTE_USER_ID = "system"
+
+SUMMARY_PROMPT = """你是一位编程竞赛教练。请阅读题目并以JSON格式返回题目要点，格式如下：
+{
+    "summary": "用两三句话概括题意",
+    "constraints": ["关键约束条件，如数据范围、时间限制"],
+    "approach": ["标准解题思路的步骤1", "步骤2"]
+}
+
+注意：
+1. 只输出JSON，不要包含其他内容
+2. approach只给出思路要点，不要给出完整代码
+"""
+output_guard.protect("precompute", SUMMARY_PROMPT)
+
+# 含有数据范围、时间/内存限制的行
+CONSTRAINT_LINE = re.compile(r'(≤|<=|10\^|10\*\*|\d+e\d|数据范围|时间限制|内存限制)')
+
+# 流程图和预测问题的生成需求
+DIAGRAM_REQUEST = """请为以下编程题目的标准解题思路生成流程图：
+题意：{summary}
+思路：
+{approach}"""
+STARTER_QUERY = "（学生刚打开这道题，尚未提问）"
+
+PRECOMPUTE_JOBS = registry.counter(
+    "oj_agent_precompute_jobs_total", "题目级预计算任务数", ["result"])
+ARTIFACT_LOOKUPS = registry.counter(
+    "oj_agent_artifact_lookups_total", "题目级预计算结果的查询次数", ["artifact", "result"])
+
+
+def extract_constraints(problem_content: str, limit: int = 10) -> List[str]:
+    """提取含有数据范围、时间/内存限制的行"""
+    constraints = []
+    for line in (problem_content or "").splitlines():
+        line = line.strip(" -*•\t")
+        # 只保留带数字的行，跳过单独的"数据范围"等标题
+        if CONSTRAINT_LINE.search(line) and re.search(r'\d', line) and line not in constraints:
+            constraints.append(line)
+    return constraints[:limit]
+
+
+class ProblemPrecomputer:
+    def __init__(self, max_workers: int = 2):
+        """题目级预计算
+
+        首次见到一道题目时，在后台线程中生成题意概括、关键约束、样例、解题思路、
+        默认流程图和初始预测问题，按题目哈希写入共享缓存，之后同一题目的请求直接复用。
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="precompute")
+        self._inflight = set()
+        self._lock = threading.Lock()
+        # 每个后台线程一个概括助手，第一次使用时创建
+        self.agents = AgentPool('precompute', self._create_assistant, size=max_workers, prewarm=0)
+        # 流程图代理和预测器在第一次使用时创建，两个后台线程共用
+        self._mermaid_agent = None
+        self._predictor = None
+        self._agents_lock = threading.Lock()
+
+    def _create_assistant(self) -> ChatAgent:
+        """创建题目概括助手"""
+        qwen_model = ModelFactory.create(
+            model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
+            model_type="Qwen/Qwen2.5-72B-Instruct",
+            api_key=API_KEY,
+            url=BASE_URL,
+            model_config_dict=QwenConfig(temperature=0.2).as_dict(),
+        )
+        return ChatAgent(
+            system_message=SUMMARY_PROMPT,
+            model=qwen_model,
+            message_window_size=10,
+            output_language='Chinese'
+        )
+
+    def _mermaid(self) -> MermaidAgent:
+        with self._agents_lock:
+            if self._mermaid_agent is None:
+                self._mermaid_agent = MermaidAgent()
+            return self._mermaid_agent
+
+    def _next_predictor(self) -> NextQuestionPredictor:
+        with self._agents_lock:
+            if self._predictor is None:
+                self._predictor = NextQuestionPredictor(API_KEY)
+            return self._predictor
+
+    def submit(self, problem_content: str) -> Optional[str]:
+        """登记题目，首次见到时提交后台预计算任务，返回题目哈希"""
+        if not (problem_content or "").strip():
+            return None
+        digest = problem_hash(problem_content)
+        with self._lock:
+            if digest in self._inflight:
+                return digest
+            self._inflight.add(digest)
+        try:
+            # 共享缓存中已有结果或其他进程正在计算时跳过
+            if session_store.cache_get(ARTIFACT_CACHE, digest) is not None or \
+                    session_store.cache_get(PENDING_CACHE, digest) is not None:
+                PRECOMPUTE_JOBS.inc(result="skipped")
+                self._done(digest)
+                return digest
+            session_store.cache_set(PENDING_CACHE, digest, time.time(), ttl=PENDING_TTL)
+        except Exception as e:
+            logger.error(f"检查题目预计算状态时出错: {str(e)}")
+            self._done(digest)
+            return digest
+
+        logger.info(f"提交题目预计算任务: {digest}")
+        self._executor.submit(self._run, digest, problem_content)
+        return digest
+
+    def _done(self, digest: str):
+        with self._lock:
+            self._inflight.discard(digest)
+
+    def _run(self, digest: str, problem_content: str):
+        try:
+            with request_context.bind(session_id=PRECOMPUTE_SESSION_ID, user_id=PRECOMPUTE_USER_ID):
+                artifacts = self.compute(problem_content)
+            session_store.cache_set(ARTIFACT_CACHE, digest, artifacts, ttl=ARTIFACT_TTL)
+            retrieval_index.add(problem_content, "editorial", self.editorial_text(artifacts))
+            PRECOMPUTE_JOBS.inc(result="computed")
+            logger.info(f"题目预计算完成: {digest}, 耗时: {artifacts['elapsed_seconds']}秒")
+            log_payload(logger, "题目预计算结果", artifacts)
+        except Exception as e:
+            PRECOMPUTE_JOBS.inc(result="failed")
+            logger.error(f"题目预计算出错: {str(e)}")
+        finally:
+            try:
+                session_store.cache_delete(PENDING_CACHE, digest)
+            except Exception as e:
+                logger.error(f"清理预计算标记时出错: {str(e)}")
+            self._done(digest)
+
+    def compute(self, problem_content: str) -> Dict[str, Any]:
+        """同步计算一道题目的全部预计算结果，单项失败时该项为空"""
+        started = time.perf_counter()
+        artifacts = {
+            "problem_hash": problem_hash(problem_content),
+            "samples": parse_samples(problem_content),
+            "constraints": extract_constraints(problem_content),
+            "summary": "",
+            "approach": [],
+            "diagram": None,
+            "predicted_questions": []
+        }
+
+        outline = self._summarize(problem_content)
+        artifacts["summary"] = outline.get("summary", "")
+        artifacts["approach"] = list(outline.get("approach") or [])
+        if not artifacts["constraints"]:
+            artifacts["constraints"] = list(outline.get("constraints") or [])
+
+        approach_text = "\n".join(f"{i}. {step}" for i, step in enumerate(artifacts["approach"], 1))
+        if artifacts["summary"] or approach_text:
+            try:
+                artifacts["diagram"] = self._mermaid().generate_diagram(
+                    DIAGRAM_REQUEST.format(summary=artifacts["summary"], approach=approach_text))
+            except Exception as e:
+                logger.error(f"预生成流程图时出错: {str(e)}")
+
+        try:
+            artifacts["predicted_questions"] = self._next_predictor().predict_next_questions(
+                current_context={'problem_content': problem_content, 'editor_code': '', 'query': STARTER_QUERY},
+                task_response=approach_text
+            )
+        except Exception as e:
+            logger.error(f"预生成预测问题时出错: {str(e)}")
+
+        artifacts["created_at"] = time.time()
+        artifacts["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+        return artifacts
+
+    @staticmethod
+    def editorial_text(artifacts: Dict[str, Any]) -> str:
+        """将题意概括和解题思路整理为题解文本，写入检索索引"""
+        approach = "\n".join(f"{i}. {step}" for i, step in enumerate(artifacts.get("approach") or [], 1))
+        return f"{artifacts.get('summary', '')}\n{approach}".strip()
+
+    def _summarize(self, problem_content: str) -> Dict[str, Any]:
+        """调用模型生成题意概括、约束和解题思路"""
+        try:
+            with StageTimer('precompute', action='summary') as timer:
+                with fair_scheduler.slot(), self.agents.agent() as agent:
+                    response = agent.step(f"题目内容:\n{problem_content}")
+                timer.mark_first_token()
+                timer.record_tokens(*camel_usage(response))
+                usage_ledger.record_response('precompute', response)
+
+                if not response or not response.msgs:
+                    raise ValueError("模型没有返回任何消息")
+
+                json_output = response.msgs[0].content.strip().replace("```json", "").replace("```", "").strip()
+                result = json.loads(json_output)
+            return result if isinstance(result, dict) else {}
+        except Exception as e:
+            logger.error(f"生成题目概括时出错: {str(e)}")
+            return {}
+
+    def get(self, problem_content: str) -> Optional[Dict[str, Any]]:
+        """读取题目的预计算结果，尚未完成时返回None"""
+        if not (problem_content or "").strip():
+            return None
+        try:
+            return session_store.cache_get(ARTIFACT_CACHE, problem_hash(problem_content))
+        except Exception as e:
+            logger.error(f"读取题目预计算结果时出错: {str(e)}")
+            return None
+
+    def lookup(self, problem_content: str, artifact: str) -> Optional[Any]:
+        """读取单项预计算结果并记录命中情况"""
+        artifacts = self.get(problem_content)
+        value = artifacts.get(artifact) if artifacts else None
+        ARTIFACT_LOOKUPS.inc(artifact=artifact, result="hit" if value else "miss")
+        return value or None
+
+# 创建全局预计算实例
+problem_precomputer = ProblemPrecomputer(int(os.getenv('OJ_PRECOMPUTE_WORKERS', '2')))
@@ -1,7 +1,11 @@
 import os
 import json
+import time
+import asyncio
 import logging
-from typing import Optional, Dict, Any
+import contextvars
+from contextlib import aclosing
+from typing import Optional, Dict, Any, AsyncGenerator
 from dotenv import load_dotenv
 from camel.configs import QwenConfig
 from camel.models import ModelFactory
@@ -11,14 +15,29 @@ from camel.messages import BaseMessage
 from task_executor import task_executor
 from mermaid_agent import MermaidAgent
 from visualization_agent import VisualizationAgent
+from metrics import StageTimer, camel_usage, record_cache_hit, observe_queue_wait, ACTIVE_REQUESTS, REQUESTS_CANCELLED
+from usage_ledger import usage_ledger
+from output_guard import output_guard, GUARD_MESSAGE
+from fair_scheduler import fair_scheduler
+from load_controller import load_controller, SHED, CACHE_ONLY_DIAGRAM
+from agent_pool import AgentPool
+from storage import session_store
+from conversation_store import conversation_store
+from problem_artifacts import problem_precomputer
+from answer_prefetcher import answer_prefetcher
+from retrieval_index import retrieval_index
+from code_versions import code_versions
+import deadlines
+import request_context
+from log_config import setup_logging, format_payload, log_payload
 
 # 配置日志
-logging.basicConfig(level=logging.INFO,
-                   format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 API_KEY = os.getenv('QWEN_API_KEY')
+BASE_URL = os.getenv('QWEN_BASE_URL', 'https://api-inference.modelscope.cn/v1')
 
 SYSTEM_PROMPT = """
 你是一个在线编程助手的意图识别模块。你的任务是分析用户的输入，判断是否安全，并确定正确的处理动作。
@@ -53,10 +72,31 @@ SYSTEM_PROMPT = """
 3. 当请求不安全时，action必须设置为"block"
 4. 其他安全的编程相关请求，action设置为"proceed"
 """
+output_guard.protect("intent", SYSTEM_PROMPT)
+
+# 会话记忆中每轮回答保留的最大字符数
+TURN_ANSWER_LIMIT = 2000
+
+# 问题中出现这些词时，流程图请求视为针对当前题目，可复用预生成的流程图
+PROBLEM_DIAGRAM_HINTS = ("这道题", "这题", "本题", "该题", "题目", "解题思路")
+
+# 意图识别超时且没有可复用的历史回答时的回答
+INTENT_TIMEOUT_ANSWER = "当前请求较多，暂时无法完成分析，请稍后再试。"
+
+# 负载过高只复用缓存流程图、且没有可复用的流程图时的回答
+DIAGRAM_BUSY_ANSWER = "当前请求较多，暂时只能提供已有的流程图，请稍后再试。"
+
+# 意图动作在界面上的展示名称
+INTENT_DESCRIPTIONS = {
+    "proceed": "常规问答",
+    "generate_diagram": "生成流程图",
+    "visualize": "生动解释",
+    "block": "拦截请求"
+}
 
 class RecognitionServer:
     def __init__(self):
-        self.ai_assistant = self._create_ai_assistant()
+        self.agents = AgentPool('intent', self._create_ai_assistant)
         self.mermaid_agent = MermaidAgent()
         self.visualization_agent = VisualizationAgent()
 
@@ -68,7 +108,7 @@ class RecognitionServer:
                 model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
                 model_type="Qwen/Qwen2.5-72B-Instruct",
                 api_key=API_KEY,
-                url="https://api-inference.modelscope.cn/v1",
+                url=BASE_URL,
                 model_config_dict=QwenConfig(temperature=0.2).as_dict(),
             )
 
@@ -87,31 +127,36 @@ class RecognitionServer:
     def _analyze_intent(self, user_input: str) -> dict:
         """分析用户输入的意图"""
         try:
-            logger.info(f"分析用户输入: {user_input}")
-            response = self.ai_assistant.step(user_input)
-            self.ai_assistant.reset()
-            
-            if not response or not response.msgs:
-                logger.warning("模型没有返回任何消息")
-                raise ValueError("模型没有返回任何消息")
-                
-            json_output = response.msgs[0].content.strip().replace("```json", "").replace("```", "").strip()
-            logger.info(f"模型原始输出: {json_output}")
-            
-            result = json.loads(json_output)
-            result["query"] = user_input
-            
-            # 验证必需字段
-            required_fields = ["safe", "action", "need_code"]
-            for field in required_fields:
-                if field not in result:
-                    raise ValueError(f"缺少必需字段: {field}")
-            
-            # 验证action类型
-            valid_actions = ["proceed", "generate_diagram", "visualize", "block"]
-            if result["action"] not in valid_actions:
-                raise ValueError(f"无效的action类型: {result['action']}")
-                
+            logger.info(f"分析用户输入: {format_payload(user_input, 200)}")
+            with StageTimer('intent') as timer:
+                with fair_scheduler.slot(), self.agents.agent() as agent:
+                    response = agent.step(user_input)
+                timer.mark_first_token()
+                timer.record_tokens(*camel_usage(response))
+                usage_ledger.record_response('intent', response)
+
+                if not response or not response.msgs:
+                    logger.warning("模型没有返回任何消息")
+                    raise ValueError("模型没有返回任何消息")
+
+                json_output = response.msgs[0].content.strip().replace("```json", "").replace("```", "").strip()
+                logger.info(f"模型原始输出: {format_payload(json_output, 200)}")
+
+                result = json.loads(json_output)
+                result["query"] = user_input
+
+                # 验证必需字段
+                required_fields = ["safe", "action", "need_code"]
+                for field in required_fields:
+                    if field not in result:
+                        raise ValueError(f"缺少必需字段: {field}")
+
+                # 验证action类型
+                valid_actions = ["proceed", "generate_diagram", "visualize", "block"]
+                if result["action"] not in valid_actions:
+                    raise ValueError(f"无效的action类型: {result['action']}")
+                timer.action = result["action"]
+
             return result
             
         except json.JSONDecodeError as e:
@@ -133,22 +178,60 @@ class RecognitionServer:
 
     def process_request(self, query: str, problem_content: str = "", editor_code: str = "") -> Dict[str, Any]:
         """处理用户请求"""
+        level = load_controller.level()
+        if level >= SHED:
+            # 负载过高时只复用同一题目下的历史回答，没有历史回答时拒绝
+            document = retrieval_index.match(problem_content, query)
+            if document is not None:
+                record_cache_hit('executor', 'proceed')
+                return {
+                    'safe': True,
+                    'action': 'proceed',
+                    'task_success': True,
+                    'task_response': document['text'],
+                    'load_level': level,
+                    'degraded': [load_controller.degrade('request', 'history_answer')['data']]
+                }
+            rejection = load_controller.shed()
+        else:
+            rejection = fair_scheduler.admit()
+        if rejection is not None:
+            return {
+                'safe': True,
+                'action': 'rejected',
+                'task_success': False,
+                'task_response': rejection['data']['message'],
+                'rejected': rejection['data'],
+                'load_level': level
+            }
+        ACTIVE_REQUESTS.inc()
         try:
             logger.info("收到新的请求")
+            started = time.perf_counter()
+            request_id = self._history_request_id()
+            if conversation_store is not None:
+                conversation_store.record_turn(request_id, query, problem_content)
             
             # 更新任务执行器的内容
             task_executor.set_problem_content(problem_content)
 
             # 分析意图
             intent_result = self._analyze_intent(query)
+            if conversation_store is not None:
+                conversation_store.record_intent(request_id, intent_result)
             
             response = {
                 'safe': intent_result.get('safe', False),
                 'action': intent_result.get('action', 'block'),
                 'need_code': intent_result.get('need_code', False),
-                'query': intent_result.get('query', query)
+                'query': intent_result.get('query', query),
+                'load_level': level
             }
 
+            # 通过意图识别的请求中首次见到的题目，在后台预计算题目级结果
+            if response['safe'] and response['action'] != 'block':
+                problem_precomputer.submit(problem_content)
+
             # 如果需要编辑器代码，则加载编辑器代码
             if intent_result.get('need_code', False):
                 task_executor.set_editor_code(editor_code)
@@ -157,7 +240,11 @@ class RecognitionServer:
             if response['safe']:
                 if response['action'] == 'generate_diagram':
                     # 使用MermaidAgent生成流程图代码
-                    mermaid_code = self.mermaid_agent.generate_diagram(query)
+                    cache_only = load_controller.level() >= CACHE_ONLY_DIAGRAM
+                    mermaid_code = self._generate_diagram(query, problem_content, response['need_code'],
+                                                          cache_only)
+                    if cache_only:
+                        response['degraded'] = [load_controller.degrade('answer', 'cache_only_diagram')['data']]
                     if mermaid_code and self.mermaid_agent.validate_code(mermaid_code):
                         response.update({
                             'mermaid_code': mermaid_code,
@@ -176,7 +263,8 @@ class RecognitionServer:
                     response.update({
                         'task_success': result.get('success', False),
                         'task_response': result.get('response', '生成解释失败，请重试'),
-                        'predicted_questions': result.get('predicted_questions', [])
+                        'predicted_questions': result.get('predicted_questions', []),
+                        'degraded': result.get('degraded', [])
                     })
                 
                 elif response['action'] == 'proceed':
@@ -189,9 +277,10 @@ class RecognitionServer:
                     response.update({
                         'task_success': task_result.get('success'),
                         'task_response': task_result.get('response'),
-                        'predicted_questions': task_result.get('predicted_questions', [])
+                        'predicted_questions': task_result.get('predicted_questions', []),
+                        'degraded': task_result.get('degraded', [])
                     })
-                    logger.info(f"任务执行结果: {task_result}")
+                    log_payload(logger, "任务执行结果", task_result)
                 
                 else:  # block
                     response.update({
@@ -199,7 +288,15 @@ class RecognitionServer:
                         'task_success': False
                     })
 
-            logger.info(f"返回结果: {response}")
+            if response.get('task_response') and output_guard.check(response['task_response']):
+                response.update({'task_response': GUARD_MESSAGE, 'task_success': False, 'predicted_questions': []})
+
+            self._remember_turn(request_id, query, problem_content, response['action'],
+                                response.get('task_response') or '', response.get('predicted_questions'),
+                                bool(response.get('task_success')), started, response['need_code'],
+                                any(item.get('stage') == 'answer' for item in response.get('degraded', [])))
+            logger.info(f"请求处理完成 - action: {response['action']}, 成功: {response.get('task_success')}")
+            log_payload(logger, "返回结果", response)
             return response
             
         except Exception as e:
@@ -210,6 +307,248 @@ class RecognitionServer:
                 'safe': False,
                 'action': 'block'
             }
+        finally:
+            ACTIVE_REQUESTS.dec()
+
+    def _generate_diagram(self, query: str, problem_content: str, need_code: bool,
+                          cache_only: bool = False) -> Optional[str]:
+        """生成流程图，不涉及代码的请求优先复用预生成的题目流程图或同一题目下相同需求的流程图
+
+        cache_only为True时只复用预生成或历史流程图，没有可复用的流程图时返回None。
+        """
+        if not need_code and problem_content.strip():
+            if cache_only or any(hint in query for hint in PROBLEM_DIAGRAM_HINTS):
+                diagram = problem_precomputer.lookup(problem_content, 'diagram')
+                if diagram:
+                    record_cache_hit('mermaid', 'generate_diagram')
+                    logger.info("使用预生成的题目流程图")
+                    return diagram
+            document = retrieval_index.match(problem_content, query, kind="diagram")
+            if document:
+                record_cache_hit('mermaid', 'generate_diagram')
+                logger.info("复用历史流程图")
+                return document['text']
+        if cache_only:
+            return None
+        mermaid_code = self.mermaid_agent.generate_diagram(query)
+        if not need_code and mermaid_code and self.mermaid_agent.validate_code(mermaid_code):
+            retrieval_index.add(problem_content, "diagram", mermaid_code, query)
+        return mermaid_code
+
+    @staticmethod
+    def _history_request_id() -> str:
+        """当前请求ID，未经HTTP入口调用时生成一个"""
+        request_id = request_context.get_request_id()
+        return request_context.new_request_id() if request_id == '-' else request_id
+
+    def _remember_turn(self, request_id: str, query: str, problem_content: str, action: str, answer: str,
+                       predicted_questions: Optional[list], success: bool, started: float,
+                       need_code: bool = False, degraded: bool = False):
+        """将本轮对话写入会话记忆、历史库和题目检索索引（降级的回答不写入索引）"""
+        try:
+            session_store.append_turn(request_context.get_session_id(), {
+                'query': query,
+                'action': action,
+                'answer': answer[:TURN_ANSWER_LIMIT],
+                'timestamp': time.time()
+            })
+        except Exception as e:
+            logger.error(f"写入会话记忆时出错: {str(e)}")
+
+        # 只索引与代码无关的回答，避免把某位学生的代码细节带给其他人
+        reusable = success and not need_code and not degraded and action in ('proceed', 'visualize')
+        if conversation_store is not None:
+            conversation_store.record_answer(request_id, problem_content, action, query, answer,
+                                             predicted_questions, success,
+                                             round((time.perf_counter() - started) * 1000, 1), reusable)
+
+        if reusable:
+            retrieval_index.add(problem_content, "answer", answer, query)
+        # 与代码有关的回答只在本会话中、代码没有实质改动时复用
+        if success and need_code and not degraded and action == 'proceed':
+            code_versions.remember_answer(problem_content, task_executor.editor_code, query, answer)
+
+    async def _run_blocking(self, stage: str, func, *args):
+        """在线程池中执行同步调用，并记录排队等待时间"""
+        submitted = time.perf_counter()
+
+        def job():
+            observe_queue_wait(stage, time.perf_counter() - submitted)
+            return func(*args)
+
+        # 复制上下文，使会话等上下文变量在线程中可见
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, context.run, job)
+
+    async def process_request_stream(self, query: str, problem_content: str = "",
+                                     editor_code: str = "") -> AsyncGenerator[Dict[str, Any], None]:
+        """流式处理用户请求，依次产出intent/content/predicted_question(s)/error事件
+
+        超出单用户配额时只产出一个rejected事件；负载降级时先产出load事件告知当前等级，
+        负载过高时只复用同一题目下的历史回答，没有历史回答时产出rejected事件。
+        """
+        level = load_controller.level()
+        if level >= SHED:
+            document = retrieval_index.match(problem_content, query)
+            if document is None:
+                yield load_controller.shed()
+                return
+            record_cache_hit('executor_stream', 'proceed')
+            yield load_controller.describe(level)
+            yield load_controller.degrade('request', 'history_answer')
+            yield {"type": "content", "data": document['text']}
+            return
+        rejection = fair_scheduler.admit()
+        if rejection is not None:
+            yield rejection
+            return
+        if level > 0:
+            yield load_controller.describe(level)
+        ACTIVE_REQUESTS.inc()
+        action = 'intent'
+        try:
+            logger.info("收到新的流式请求")
+            started = time.perf_counter()
+            request_id = self._history_request_id()
+            if conversation_store is not None:
+                conversation_store.record_turn(request_id, query, problem_content)
+            task_executor.set_problem_content(problem_content)
+
+            # 分析意图，超出阶段预算时不再等待
+            try:
+                intent_result = await asyncio.wait_for(self._run_blocking('intent', self._analyze_intent, query),
+                                                       deadlines.stage_budget('intent'))
+            except asyncio.TimeoutError:
+                # 无法确认请求是否安全，只复用同一题目下已通过审核的历史回答
+                document = retrieval_index.match(problem_content, query)
+                if document:
+                    record_cache_hit('executor_stream', 'proceed')
+                yield deadlines.degrade('intent', 'history_answer' if document else 'busy')
+                answer = document['text'] if document else INTENT_TIMEOUT_ANSWER
+                yield {"type": "content", "data": answer}
+                self._remember_turn(request_id, query, problem_content, 'timeout', answer, [],
+                                    document is not None, started)
+                return
+            if conversation_store is not None:
+                conversation_store.record_intent(request_id, intent_result)
+            safe = intent_result.get('safe', False)
+            action = intent_result.get('action', 'block') if safe else 'block'
+            need_code = intent_result.get('need_code', False)
+
+            yield {
+                "type": "intent",
+                "data": {
+                    "intent": INTENT_DESCRIPTIONS.get(action, action),
+                    "safe": safe,
+                    "action": action,
+                    "need_code": need_code,
+                    "response": "请求被阻止：可能存在安全风险" if action == 'block' else "正在处理请求"
+                }
+            }
+
+            if action != 'block':
+                problem_precomputer.submit(problem_content)
+            if need_code:
+                task_executor.set_editor_code(editor_code)
+
+            answer_parts = []
+            predicted_questions = []
+            success = action != 'block'
+            degraded = False
+            # 逐片段检查输出中是否出现系统提示词或密钥，出现时截断
+            scanner = output_guard.scanner()
+            if action == 'generate_diagram':
+                # 负载过高时只返回预生成或历史流程图，不再调用模型生成
+                cache_only = load_controller.level() >= CACHE_ONLY_DIAGRAM
+                if cache_only:
+                    degraded = True
+                    yield load_controller.degrade('answer', 'cache_only_diagram')
+                try:
+                    mermaid_code = await asyncio.wait_for(
+                        self._run_blocking('mermaid', self._generate_diagram, query, problem_content, need_code,
+                                           cache_only),
+                        deadlines.stage_budget('answer'))
+                except asyncio.TimeoutError:
+                    degraded = True
+                    yield deadlines.degrade('answer', 'cached_diagram')
+                    mermaid_code = problem_precomputer.lookup(problem_content, 'diagram')
+                if cache_only and not mermaid_code:
+                    success = False
+                    yield {"type": "error", "data": DIAGRAM_BUSY_ANSWER}
+                elif mermaid_code and self.mermaid_agent.validate_code(mermaid_code):
+                    if scanner.feed(mermaid_code):
+                        success = False
+                        yield {"type": "error", "data": GUARD_MESSAGE}
+                    else:
+                        answer_parts.append(f"已生成流程图代码：\n```mermaid\n{mermaid_code}\n```")
+                        yield {"type": "content", "data": answer_parts[-1]}
+                else:
+                    success = False
+                    yield {"type": "error", "data": "生成流程图失败，请重试"}
+
+            elif action == 'visualize':
+                try:
+                    result = await asyncio.wait_for(
+                        self._run_blocking('visualize', self.visualization_agent.visualize, query),
+                        deadlines.stage_budget('answer'))
+                except asyncio.TimeoutError:
+                    degraded = True
+                    yield deadlines.degrade('answer', 'cached_answer')
+                    result = {'success': True, 'response': task_executor.fallback_answer(query)}
+                for item in result.get('degraded', []):
+                    yield {"type": "degraded", "data": item}
+                success = result.get('success', False)
+                answer = result.get('response', '生成解释失败，请重试')
+                if scanner.feed(answer):
+                    success = False
+                    yield {"type": "error", "data": GUARD_MESSAGE}
+                else:
+                    answer_parts.append(answer)
+                    predicted_questions = result.get('predicted_questions', [])
+                    yield {"type": "content", "data": answer}
+                    yield {"type": "predicted_questions", "data": predicted_questions}
+
+            elif action == 'proceed':
+                prefetched = await answer_prefetcher.take(query, need_code)
+                async with aclosing(task_executor.execute_task_stream(query=query, need_code=need_code,
+                                                                      prefetched=prefetched)) as events:
+                    async for event in events:
+                        if event["type"] == "content" and scanner.feed(event["data"]):
+                            # 关闭执行器的事件流，上游流随之关闭
+                            success = False
+                            yield {"type": "error", "data": GUARD_MESSAGE}
+                            break
+                        if event["type"] == "content":
+                            answer_parts.append(event["data"])
+                        elif event["type"] == "predicted_questions":
+                            predicted_questions = event["data"]
+                        elif event["type"] == "error":
+                            success = False
+                        elif event["type"] == "degraded" and event["data"].get("stage") == "answer":
+                            # 只有回答本身降级时不写入检索索引，跳过问题预测不影响回答
+                            degraded = True
+                        yield event
+
+            self._remember_turn(request_id, query, problem_content, action, "".join(answer_parts),
+                                predicted_questions, success, started, need_code, degraded)
+
+            # 学生阅读回答期间，在后台预取预测问题的回答
+            if success and predicted_questions:
+                answer_prefetcher.schedule(predicted_questions, need_code)
+
+        except (asyncio.CancelledError, GeneratorExit):
+            # 客户端已断开：上游流随生成器关闭，同时取消本会话尚未完成的预取
+            REQUESTS_CANCELLED.inc(action=action)
+            cancelled = answer_prefetcher.cancel_session(request_context.get_session_id())
+            logger.info(f"客户端断开，已取消请求 - action: {action}, 取消预取任务: {cancelled}")
+            raise
+        except Exception as e:
+            error_msg = f'处理请求时出错: {str(e)}'
+            logger.error(error_msg)
+            yield {"type": "error", "data": error_msg}
+        finally:
+            ACTIVE_REQUESTS.dec()
 
 # 创建全局recognition_server实例
 recognition_server = RecognitionServer()
@@ -0,0 +1,114 @@
+import json
+import time
+import random
+import argparse
+from typing import Dict, List, Tuple
+from render_throttle import RenderThrottle
+
+SAMPLE_ANSWER = ("让我们一起思考这个问题。首先观察题目的输入规模，再分析每一步操作的代价。\n\n"
+                 "```python\ndef solution(m: int, s: str) -> int:\n    dp = [[0] * (m + 1) for _ in range(len(s) + 1)]\n"
+                 "    for i in range(1, len(s) + 1):\n        for j in range(m + 1):\n            dp[i][j] = dp[i - 1][j]\n"
+                 "    return dp[len(s)][m]\n```\n\n"
+                 "你觉得当前的实现里哪一部分重复计算最多？如果能把中间结果保存下来，就可以避免重复工作。\n")
+
+# 重绘代价模型：每次重绘的固定开销，加上按推送字节数计的markdown解析、传输和浏览器重绘开销
+RENDER_BASE_MS = 2.0
+RENDER_MS_PER_KB = 1.0
+
+
+class SimulatedClock:
+    def __init__(self):
+        """模拟时钟，使基准测试不需要真的等待"""
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def synthetic_stream(total_chars: int, chunks_per_second: float, seed: int = 0) -> List[Tuple[float, str]]:
+    """生成 [(到达时间, 片段)]，片段长度1~3个字符，模拟上游的增量输出"""
+    rng = random.Random(seed)
+    text = (SAMPLE_ANSWER * (total_chars // len(SAMPLE_ANSWER) + 1))[:total_chars]
+    events, pos, t = [], 0, 0.0
+    while pos < len(text):
+        size = rng.randint(1, 3)
+        events.append((t, text[pos:pos + size]))
+        pos += size
+        t += 1.0 / chunks_per_second
+    return events
+
+
+def recorded_stream(url: str, query: str) -> List[Tuple[float, str]]:
+    """从运行中的api_server获取一次真实回答的片段及到达时间"""
+    import requests
+    start = time.perf_counter()
+    events = []
+    response = requests.post(f"{url}/api/analyze/stream", json={"query": query}, stream=True, timeout=300)
+    for line in response.iter_lines():
+        if line and line.startswith(b"data: "):
+            event = json.loads(line[6:].decode("utf-8"))
+            if event["type"] == "content":
+                events.append((time.perf_counter() - start, event["data"]))
+    return events
+
+
+def run_strategy(events: List[Tuple[float, str]], throttled: bool, base_ms: float = RENDER_BASE_MS,
+                 ms_per_kb: float = RENDER_MS_PER_KB) -> Dict[str, float]:
+    """回放片段并统计重绘次数、推送字节数、重绘耗时和回答结束后的显示延迟
+
+    重绘耗时按代价模型计算，并推进模拟时钟：重绘期间界面无法处理新片段，
+    到达的片段要等重绘结束后才能追加，重绘越慢显示落后得越多。
+    """
+    clock = SimulatedClock()
+    modeled = {"seconds": 0.0}
+
+    def render(text: str):
+        # 与ui.py相同的markdown拼装，近似一次向浏览器推送的负载
+        payload = f"""
+                            ### 任务执行结果
+                            {text}
+                            """
+        seconds = (base_ms + ms_per_kb * len(payload.encode("utf-8")) / 1024) / 1000
+        modeled["seconds"] += seconds
+        clock.now += seconds
+
+    if throttled:
+        throttle = RenderThrottle(render, clock=clock)
+    else:
+        throttle = RenderThrottle(render, min_interval=0.0, max_pending_chars=1,
+                                  max_bytes_per_second=float("inf"), clock=clock)
+    for arrival, chunk in events:
+        clock.now = max(clock.now, arrival)
+        throttle.append(chunk)
+    throttle.flush()
+    stats = throttle.stats()
+    stats["render_seconds"] = round(modeled["seconds"], 6)
+    stats["lag_seconds"] = round(clock.now - events[-1][0], 6) if events else 0.0
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式回答渲染基准测试")
+    parser.add_argument("--chars", type=int, default=4000, help="合成回答的字符数")
+    parser.add_argument("--chunks-per-second", type=float, default=40.0, help="合成片段到达速度")
+    parser.add_argument("--url", default=None, help="从api_server获取真实回答（可选）")
+    parser.add_argument("--query", default="这段代码的时间复杂度是多少？", help="配合--url使用的问题")
+    parser.add_argument("--render-base-ms", type=float, default=RENDER_BASE_MS, help="每次重绘的固定耗时（毫秒）")
+    parser.add_argument("--render-ms-per-kb", type=float, default=RENDER_MS_PER_KB, help="每KB推送内容的重绘耗时（毫秒）")
+    args = parser.parse_args()
+
+    if args.url:
+        events = recorded_stream(args.url, args.query)
+    else:
+        events = synthetic_stream(args.chars, args.chunks_per_second)
+
+    print(f"片段数: {len(events)}  字符数: {sum(len(c) for _, c in events)}")
+    print(f"{'策略':<10}{'重绘次数':>10}{'推送字节':>14}{'重绘耗时(ms)':>14}{'结束延迟(ms)':>14}")
+    for name, throttled in (("逐片段", False), ("节流", True)):
+        stats = run_strategy(events, throttled, args.render_base_ms, args.render_ms_per_kb)
+        print(f"{name:<10}{stats['renders']:>10}{stats['bytes_pushed']:>14}"
+              f"{stats['render_seconds'] * 1000:>14.2f}{stats['lag_seconds'] * 1000:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import time
+from typing import Callable, Dict
+
+
+class RenderThrottle:
+    def __init__(self, render: Callable[[str], None], min_interval: float = 0.1,
+                 max_pending_chars: int = 400, max_bytes_per_second: int = 64 * 1024,
+                 clock: Callable[[], float] = time.perf_counter):
+        """按时间/大小窗口合并流式片段后再重绘
+
+        每次重绘都会推送完整文本，因此除了最小间隔外，还按已推送的字节数
+        动态拉长下一次重绘的间隔，使总推送量与回答时长成正比而不是与长度的平方成正比。
+        积累了max_pending_chars个字符时可以不等最小间隔提前重绘，但仍受按字节数计算的间隔限制。
+        """
+        self.render = render
+        self.min_interval = min_interval
+        self.max_pending_chars = max_pending_chars
+        self.max_bytes_per_second = max_bytes_per_second
+        self.clock = clock
+        self.text = ""
+        self._pending_chars = 0
+        self._next_render_at = 0.0
+        self._earliest_render_at = 0.0
+        self.renders = 0
+        self.bytes_pushed = 0
+        self.render_seconds = 0.0
+
+    def append(self, chunk: str):
+        """追加一个片段，必要时触发重绘"""
+        if not chunk:
+            return
+        self.text += chunk
+        self._pending_chars += len(chunk)
+        now = self.clock()
+        if now >= self._next_render_at or \
+                (self._pending_chars >= self.max_pending_chars and now >= self._earliest_render_at):
+            self.flush()
+
+    def flush(self):
+        """立即重绘尚未显示的内容"""
+        if not self._pending_chars:
+            return
+        start = time.perf_counter()
+        self.render(self.text)
+        self.render_seconds += time.perf_counter() - start
+
+        pushed = len(self.text.encode('utf-8'))
+        self.renders += 1
+        self.bytes_pushed += pushed
+        self._pending_chars = 0
+        now = self.clock()
+        self._earliest_render_at = now + pushed / self.max_bytes_per_second
+        self._next_render_at = max(self._earliest_render_at, now + self.min_interval)
+
+    def stats(self) -> Dict[str, float]:
+        """返回重绘统计"""
+        return {
+            "chars": len(self.text),
+            "renders": self.renders,
+            "bytes_pushed": self.bytes_pushed,
+            "render_seconds": round(self.render_seconds, 6)
+        }
@@ -0,0 +1,49 @@
+from render_throttle import RenderThrottle
+from render_benchmark import SimulatedClock, run_strategy, synthetic_stream
+
+
+def _replay(events, **kwargs):
+    clock = SimulatedClock()
+    throttle = RenderThrottle(lambda text: None, clock=clock, **kwargs)
+    for arrival, chunk in events:
+        clock.now = arrival
+        throttle.append(chunk)
+    throttle.flush()
+    return throttle
+
+
+def test_bytes_pushed_bounded_by_rate_times_duration():
+    for chars in (16000, 64000):
+        events = synthetic_stream(chars, chunks_per_second=200)
+        throttle = _replay(events, max_bytes_per_second=64 * 1024)
+        final = len(throttle.text.encode("utf-8"))
+        # 每次重绘后按推送字节数等待，总推送量不超过 速率 × 时长 + 最后一次的完整文本
+        assert throttle.bytes_pushed <= 64 * 1024 * events[-1][0] + 2 * final
+
+
+def test_size_trigger_respects_rate_interval():
+    clock = SimulatedClock()
+    renders = []
+    throttle = RenderThrottle(renders.append, min_interval=1.0, max_pending_chars=10,
+                              max_bytes_per_second=100, clock=clock)
+    throttle.append("x" * 50)
+    assert len(renders) == 1
+    # 积累的字符超过max_pending_chars，但距上次重绘不足 50字节 / 100字节每秒
+    clock.now = 0.2
+    throttle.append("y" * 20)
+    assert len(renders) == 1
+    clock.now = 0.5
+    throttle.append("z")
+    assert len(renders) == 2
+    # 没到按字节数计算的间隔，也没到最小间隔，不重绘
+    clock.now = 0.6
+    throttle.append("w" * 5)
+    assert len(renders) == 2
+
+
+def test_throttled_rendering_costs_less_than_per_chunk():
+    events = synthetic_stream(4000, chunks_per_second=200)
+    per_chunk, throttled = run_strategy(events, False), run_strategy(events, True)
+    assert throttled["render_seconds"] < per_chunk["render_seconds"] / 10
+    assert throttled["lag_seconds"] < per_chunk["lag_seconds"]
+    assert throttled["bytes_pushed"] < per_chunk["bytes_pushed"]
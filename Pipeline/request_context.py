@@ -0,0 +1,64 @@
+import uuid
+import contextvars
+from contextlib import contextmanager
+from typing import Optional
+
+DEFAULT_SESSION_ID = "default"
+DEFAULT_USER_ID = "anonymous"
+
+# 当前请求所属的会话与用户
+_session_id: contextvars.ContextVar[str] = contextvars.ContextVar("session_id", default=DEFAULT_SESSION_ID)
+_user_id: contextvars.ContextVar[str] = contextvars.ContextVar("user_id", default=DEFAULT_USER_ID)
+# 当前请求ID，用于日志关联
+_request_id: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+# 当前请求的截止时间（time.monotonic()），None表示不限时
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+
+def new_request_id() -> str:
+    """生成新的请求ID"""
+    return uuid.uuid4().hex[:16]
+
+
+def get_session_id() -> str:
+    """获取当前会话ID"""
+    return _session_id.get()
+
+
+def get_user_id() -> str:
+    """获取当前用户ID"""
+    return _user_id.get()
+
+
+def get_request_id() -> str:
+    """获取当前请求ID"""
+    return _request_id.get()
+
+
+def get_deadline() -> Optional[float]:
+    """获取当前请求的截止时间"""
+    return _deadline.get()
+
+
+@contextmanager
+def bind(session_id: Optional[str] = None, user_id: Optional[str] = None,
+         request_id: Optional[str] = None, deadline: Optional[float] = None):
+    """在当前上下文中绑定会话、用户、请求ID和截止时间"""
+    tokens = []
+    if session_id:
+        tokens.append((_session_id, _session_id.set(session_id)))
+    if user_id:
+        tokens.append((_user_id, _user_id.set(user_id)))
+    if request_id:
+        tokens.append((_request_id, _request_id.set(request_id)))
+    if deadline:
+        tokens.append((_deadline, _deadline.set(deadline)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            try:
+                var.reset(token)
+            except ValueError:
+                # 异步生成器可能在其他上下文中被关闭
+                pass
@@ -0,0 +1,349 @@
+import os
+import re
+import sys
+import hmac
+import json
+import time
+import asyncio
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from metrics import registry
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# 开启按请求剖析的口令，未设置时不剖析，也不开放剖析结果接口
+PROFILE_TOKEN = os.getenv('OJ_PROFILE_TOKEN', '')
+# 剖析结果目录及保留的文件数
+PROFILE_DIR = os.getenv('OJ_PROFILE_DIR', 'profiles')
+PROFILE_MAX_FILES = int(os.getenv('OJ_PROFILE_MAX_FILES', '50'))
+# 采样间隔（毫秒）
+PROFILE_INTERVAL_MS = float(os.getenv('OJ_PROFILE_INTERVAL_MS', '5'))
+# 是否同时记录内存分配，以及tracemalloc记录的栈深度（结果只按分配位置统计，1层开销最小；
+# tracemalloc会明显拖慢分配密集的代码，CPU热点不准时可关闭）
+PROFILE_MEMORY = os.getenv('OJ_PROFILE_MEMORY', '1') == '1'
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv('OJ_PROFILE_TRACEMALLOC_FRAMES', '1'))
+# 调用栈最大深度，以及结果中保留的调用栈和函数数
+MAX_STACK_DEPTH = 64
+MAX_STACKS = 500
+TOP_FUNCTIONS = 50
+TOP_ALLOCATIONS = 30
+MAX_TASKS = 50
+
+# 两次采样之间线程占用的CPU时间少于采样间隔的这个比例时视为等待（事件循环空闲、线程池等待任务、等锁）
+IDLE_CPU_RATIO = 0.1
+# 栈顶是这些函数时同样视为等待（也用于无法读取线程CPU时间的平台）
+IDLE_FUNCTIONS = {"select", "poll", "epoll", "kqueue", "wait", "_wait_for_tstate_lock", "sleep", "accept"}
+# 剖析结果ID：时间戳-请求ID
+PROFILE_ID = re.compile(r'^[0-9]{8}T[0-9]{6}-[0-9A-Za-z_-]{1,64}$')
+
+PROFILES = registry.counter(
+    "oj_agent_profiles_total", "按请求剖析的次数", ["trigger"])
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname if hasattr(code, 'co_qualname') else code.co_name} " \
+           f"({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _thread_cpu(thread_id: int) -> Optional[float]:
+    """线程已占用的CPU时间（秒），平台不支持时返回None"""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread_id))
+    except (AttributeError, OSError):
+        return None
+
+
+def _task_summary(loop: Optional[asyncio.AbstractEventLoop]) -> Optional[Dict[str, Any]]:
+    """事件循环中所有任务的快照：按协程统计数量，并列出前MAX_TASKS个任务当前所在的位置"""
+    if loop is None:
+        return None
+    tasks = list(asyncio.all_tasks(loop))
+    by_coroutine = Counter(getattr(task.get_coro(), "__qualname__", "?") for task in tasks)
+    details = []
+    for task in tasks[:MAX_TASKS]:
+        stack = task.get_stack(limit=1)
+        details.append({
+            "name": task.get_name(),
+            "coroutine": getattr(task.get_coro(), "__qualname__", "?"),
+            "at": f"{os.path.basename(stack[0].f_code.co_filename)}:{stack[0].f_lineno}" if stack else None
+        })
+    return {"count": len(tasks), "by_coroutine": dict(by_coroutine.most_common()), "tasks": details}
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, profiler: "RequestProfiler"):
+        """采样线程：每隔interval读取所有线程的调用栈，计入正在进行的剖析"""
+        super().__init__(name="request-profiler", daemon=True)
+        self.profiler = profiler
+
+    def run(self):
+        own_id = threading.get_ident()
+        interval = self.profiler.interval
+        cpu_times: Dict[int, float] = {}
+        while True:
+            with self.profiler._lock:
+                sessions = list(self.profiler._active)
+                if not sessions:
+                    self.profiler._sampler = None
+                    return
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                cpu, previous = _thread_cpu(thread_id), cpu_times.get(thread_id)
+                if cpu is not None:
+                    cpu_times[thread_id] = cpu
+                idle = frame.f_code.co_name in IDLE_FUNCTIONS or \
+                    (cpu is not None and previous is not None and cpu - previous < interval * IDLE_CPU_RATIO)
+                names_on_stack = []
+                while frame is not None and len(names_on_stack) < MAX_STACK_DEPTH:
+                    names_on_stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stacks.append((idle,
+                               ";".join([names.get(thread_id, str(thread_id))] + names_on_stack[::-1])))
+            for session in sessions:
+                session.add_samples(stacks)
+            time.sleep(interval)
+
+
+class _Session:
+    __slots__ = ("profile_id", "name", "request_id", "trigger", "started_at", "started", "stacks",
+                 "idle_samples", "tasks_start", "tasks_end", "duration_ms", "traced", "lock")
+
+    def __init__(self, name: str, request_id: str, trigger: str):
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.profile_id = time.strftime("%Y%m%dT%H%M%S", time.localtime(self.started_at)) + "-" + \
+            re.sub(r'[^0-9A-Za-z_-]', '_', request_id)[:64]
+        self.name = name
+        self.request_id = request_id
+        self.trigger = trigger
+        self.stacks: Counter = Counter()
+        self.idle_samples = 0
+        self.tasks_start = None
+        self.tasks_end = None
+        self.duration_ms = 0.0
+        # 是否由剖析开启了tracemalloc
+        self.traced = False
+        self.lock = threading.Lock()
+
+    def add_samples(self, stacks: List[Tuple[bool, str]]):
+        with self.lock:
+            for idle, stack in stacks:
+                if idle:
+                    self.idle_samples += 1
+                else:
+                    self.stacks[stack] += 1
+
+
+class RequestProfiler:
+    def __init__(self, token: str = PROFILE_TOKEN, directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES,
+                 interval_ms: float = PROFILE_INTERVAL_MS, memory: bool = PROFILE_MEMORY):
+        """按请求的剖析：采样所有线程的调用栈，记录事件循环任务快照和请求期间的内存分配
+
+        请求带有与token相同的X-Profile-Token请求头，或管理员预约了剖析次数时才剖析；未剖析的请求
+        只做一次判断，没有其他开销。采样覆盖整个进程（包括线程池中的同步调用和同时在处理的其他请求），
+        反映真实负载下的CPU热点。结果写入directory，只保留最近max_files个。
+        """
+        self.token = token
+        self.directory = directory
+        self.max_files = max_files
+        self.interval = max(interval_ms, 1.0) / 1000
+        self.memory = memory
+        self._armed: Dict[Optional[str], int] = {}
+        self._active: List[_Session] = []
+        self._sampler: Optional[_Sampler] = None
+        self._tracing = 0
+        self._lock = threading.Lock()
+        # 汇总和写文件放在单独的线程中，不阻塞事件循环
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="request-profiler-writer")
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token)
+
+    def authorized(self, token: Optional[str]) -> bool:
+        """口令是否正确"""
+        return self.enabled and isinstance(token, str) and \
+            hmac.compare_digest(token.encode("utf-8"), self.token.encode("utf-8"))
+
+    def arm(self, count: int, name: Optional[str] = None) -> Dict[Optional[str], int]:
+        """预约剖析接下来的count个请求，name为analyze/stream/ws时只剖析该类请求"""
+        with self._lock:
+            if count > 0:
+                self._armed[name] = count
+            else:
+                self._armed.pop(name, None)
+            return dict(self._armed)
+
+    def _trigger(self, name: str, token: Optional[str]) -> Optional[str]:
+        if not self.enabled:
+            return None
+        if token:
+            return "header" if self.authorized(token) else None
+        if not self._armed:
+            return None
+        with self._lock:
+            for key in (name, None):
+                if self._armed.get(key, 0) > 0:
+                    self._armed[key] -= 1
+                    if self._armed[key] == 0:
+                        del self._armed[key]
+                    return "armed"
+        return None
+
+    def profile(self, name: str, request_id: str, token: Optional[str] = None):
+        """需要剖析时返回剖析本请求的上下文管理器，否则返回空的上下文管理器"""
+        trigger = self._trigger(name, token)
+        if trigger is None:
+            return nullcontext()
+        return self._profile(name, request_id, trigger)
+
+    @contextmanager
+    def _profile(self, name: str, request_id: str, trigger: str):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        session = _Session(name, request_id, trigger)
+        session.tasks_start = _task_summary(loop)
+        with self._lock:
+            # 进程启动时已开启的tracemalloc沿用，不由剖析关闭
+            if self.memory and (self._tracing or not tracemalloc.is_tracing()):
+                if self._tracing == 0:
+                    tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+                self._tracing += 1
+                session.traced = True
+            self._active.append(session)
+            if self._sampler is None:
+                self._sampler = _Sampler(self)
+                self._sampler.start()
+        PROFILES.inc(trigger=trigger)
+        logger.info(f"开始剖析请求 - {name}, 剖析ID: {session.profile_id}")
+        try:
+            yield session
+        finally:
+            session.duration_ms = round((time.perf_counter() - session.started) * 1000, 1)
+            session.tasks_end = _task_summary(loop)
+            with self._lock:
+                self._active.remove(session)
+            self._writer.submit(self._finish, session)
+
+    def _finish(self, session: _Session):
+        """汇总一次剖析并写入文件"""
+        try:
+            memory = None
+            if self.memory and tracemalloc.is_tracing():
+                # 不统计剖析本身的分配
+                snapshot = tracemalloc.take_snapshot().filter_traces((
+                    tracemalloc.Filter(False, __file__),
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, threading.__file__)
+                ))
+                current, peak = tracemalloc.get_traced_memory()
+                top = snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+                memory = {
+                    "current_bytes": current,
+                    "peak_bytes": peak,
+                    "top": [{"location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                             "size_bytes": stat.size, "count": stat.count} for stat in top]
+                }
+            if session.traced:
+                with self._lock:
+                    self._tracing -= 1
+                    if self._tracing == 0:
+                        tracemalloc.stop()
+            self._write(session, memory)
+        except Exception as e:
+            logger.error(f"写入剖析结果时出错: {str(e)}")
+
+    @staticmethod
+    def _summarize(stacks: Counter) -> Dict[str, List[Dict[str, Any]]]:
+        """按函数统计采样数：self为位于栈顶的次数，total为出现在栈中的次数"""
+        total_samples = sum(stacks.values()) or 1
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")[1:]
+            if frames:
+                self_counts[frames[-1]] += count
+            for frame in set(frames):
+                total_counts[frame] += count
+        return {
+            kind: [{"function": function, "samples": count, "percent": round(count * 100 / total_samples, 1)}
+                   for function, count in counts.most_common(TOP_FUNCTIONS)]
+            for kind, counts in (("top_self", self_counts), ("top_total", total_counts))
+        }
+
+    def _write(self, session: _Session, memory: Optional[Dict[str, Any]]):
+        with session.lock:
+            stacks = Counter(session.stacks)
+            idle_samples = session.idle_samples
+        result = {
+            "id": session.profile_id,
+            "name": session.name,
+            "request_id": session.request_id,
+            "trigger": session.trigger,
+            "started_at": session.started_at,
+            "duration_ms": session.duration_ms,
+            "interval_ms": round(self.interval * 1000, 1),
+            "samples": sum(stacks.values()),
+            "idle_samples": idle_samples,
+            **self._summarize(stacks),
+            "stacks": [{"stack": stack, "samples": count} for stack, count in stacks.most_common(MAX_STACKS)],
+            "tasks": {"start": session.tasks_start, "end": session.tasks_end},
+            "memory": memory
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{session.profile_id}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        logger.info(f"剖析结果已写入: {path}, 采样: {result['samples']}, 耗时: {session.duration_ms}ms")
+        # 只保留最近的max_files个结果
+        for profile in self.list()[self.max_files:]:
+            try:
+                os.remove(os.path.join(self.directory, f"{profile['id']}.json"))
+            except OSError:
+                pass
+
+    def list(self) -> List[Dict[str, Any]]:
+        """列出剖析结果，最新的在前"""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for filename in os.listdir(self.directory):
+            profile_id, ext = os.path.splitext(filename)
+            if ext != ".json" or not PROFILE_ID.match(profile_id):
+                continue
+            stat = os.stat(os.path.join(self.directory, filename))
+            profiles.append({"id": profile_id, "size_bytes": stat.st_size, "modified_at": stat.st_mtime})
+        profiles.sort(key=lambda p: (p["modified_at"], p["id"]), reverse=True)
+        return profiles
+
+    def load(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        """读取一个剖析结果，不存在时返回None"""
+        if not PROFILE_ID.match(profile_id):
+            return None
+        path = os.path.join(self.directory, f"{profile_id}.json")
+        if not os.path.isfile(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def collapsed(result: Dict[str, Any]) -> str:
+        """折叠栈格式（每行“栈;帧 采样数”），可直接用flamegraph.pl或speedscope查看"""
+        return "".join(f"{item['stack']} {item['samples']}\n" for item in result.get("stacks", []))
+
+# 创建全局请求剖析实例
+request_profiler = RequestProfiler()
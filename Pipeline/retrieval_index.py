@@ -0,0 +1,260 @@
+import os
+import re
+import json
+import math
+import time
+import heapq
+import logging
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+from metrics import registry
+from storage import problem_hash
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# 文档类型：历史回答、流程图、题解（预计算的思路或教师提供的题解）
+DOCUMENT_KINDS = ("answer", "diagram", "editorial")
+
+# 中文按相邻两字切分，英文和数字按单词切分
+TOKEN_PATTERN = re.compile(r'[\u4e00-\u9fff]+|[a-z0-9_]+')
+
+# BM25参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 加入模型上下文的片段长度
+SNIPPET_CHARS = 200
+
+RETRIEVAL_DOCUMENTS = registry.counter(
+    "oj_agent_retrieval_documents_total", "写入检索索引的文档数", ["kind"])
+RETRIEVAL_LOOKUPS = registry.counter(
+    "oj_agent_retrieval_lookups_total", "检索索引的查询结果", ["purpose", "result"])
+
+
+def tokenize(text: str) -> List[str]:
+    """中文按相邻两字切分（单字词保留单字），英文和数字按小写单词切分"""
+    tokens = []
+    for run in TOKEN_PATTERN.findall((text or "").lower()):
+        if '\u4e00' <= run[0] <= '\u9fff' and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def question_similarity(a: str, b: str) -> float:
+    """两个问题的词集合Jaccard相似度"""
+    tokens_a, tokens_b = set(tokenize(a)), set(tokenize(b))
+    if not tokens_a or not tokens_b:
+        return 0.0
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+
+
+class ProblemIndex:
+    def __init__(self, path: Optional[str] = None):
+        """一道题目的BM25倒排索引
+
+        文档以JSON行追加写入path，倒排表只保存在内存中，加载时按文档重建；
+        其他进程追加的文档在下次查询时从上次读到的位置继续读入。
+        """
+        self.path = path
+        self.documents: List[Dict[str, Any]] = []
+        self.postings: Dict[str, List[tuple]] = {}
+        self.lengths: List[int] = []
+        self.total_length = 0
+        self._texts = set()
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def _index(self, document: Dict[str, Any]) -> bool:
+        """将文档加入内存索引，重复文档返回False"""
+        key = (document['kind'], document['text'])
+        if key in self._texts:
+            return False
+        self._texts.add(key)
+        doc_id = len(self.documents)
+        tokens = tokenize(f"{document.get('question', '')}\n{document['text']}")
+        for term, tf in Counter(tokens).items():
+            self.postings.setdefault(term, []).append((doc_id, tf))
+        self.documents.append(document)
+        self.lengths.append(len(tokens))
+        self.total_length += len(tokens)
+        return True
+
+    def _refresh(self):
+        """读入文件中尚未加载的文档（本进程或其他进程追加的）"""
+        if not self.path:
+            return
+        try:
+            if os.path.getsize(self.path) <= self._offset:
+                return
+        except OSError:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # 只处理完整的行，写了一半的行留到下次
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                self._index(json.loads(line))
+            except (ValueError, KeyError):
+                logger.warning(f"跳过损坏的索引行: {self.path}")
+        self._offset += end
+
+    def add(self, kind: str, text: str, question: str = "") -> bool:
+        """追加一篇文档，内容重复时忽略"""
+        document = {'kind': kind, 'text': text, 'question': question, 'created_at': round(time.time(), 3)}
+        with self._lock:
+            self._refresh()
+            if not self._index(document):
+                return False
+            if self.path:
+                line = (json.dumps(document, ensure_ascii=False) + "\n").encode("utf-8")
+                # 索引目录在第一次写入时创建
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, 'ab') as f:
+                    f.write(line)
+                self._offset += len(line)
+        return True
+
+    def search(self, query: str, k: int = 3, kinds: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """BM25检索，返回得分最高的k篇文档及其得分和查询词覆盖率"""
+        terms = set(tokenize(query))
+        kinds = set(kinds) if kinds else None
+        with self._lock:
+            self._refresh()
+            count = len(self.documents)
+            if not terms or not count:
+                return []
+            average = self.total_length / count or 1
+            scores: Dict[int, float] = {}
+            matched: Dict[int, int] = {}
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc_id] / average)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+                    matched[doc_id] = matched.get(doc_id, 0) + 1
+            if kinds:
+                scores = {d: s for d, s in scores.items() if self.documents[d]['kind'] in kinds}
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [dict(self.documents[doc_id], score=round(score, 4),
+                         coverage=round(matched[doc_id] / len(terms), 3))
+                    for doc_id, score in top]
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+
+class RetrievalIndex:
+    def __init__(self, directory: Optional[str] = None, max_problems: int = 256,
+                 min_coverage: float = 0.3, direct_similarity: float = 0.85):
+        """按题目哈希划分的历史回答检索
+
+        每道题目一个索引文件（directory/<题目哈希>.jsonl），directory为空时只保存在内存中。
+        内存中最多保留max_problems道题目的索引。查询词覆盖率不低于min_coverage的文档
+        作为片段加入模型上下文；历史问题与当前问题的相似度不低于direct_similarity时直接复用回答。
+        """
+        self.directory = directory
+        self.max_problems = max_problems
+        self.min_coverage = min_coverage
+        self.direct_similarity = direct_similarity
+        self._indexes: "OrderedDict[str, ProblemIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loaders = []
+
+    def add_loader(self, loader):
+        """登记历史文档来源loader(题目哈希)，返回[{'kind', 'text', 'question'}]；
+        题目的索引首次创建且没有索引文件时用它预热"""
+        self._loaders.append(loader)
+
+    def _warm(self, digest: str, index: ProblemIndex):
+        for loader in self._loaders:
+            try:
+                documents = loader(digest)
+            except Exception as e:
+                logger.error(f"读取预热文档时出错: {str(e)}")
+                continue
+            added = sum(index.add(d['kind'], d['text'].strip(), d.get('question', ''))
+                        for d in documents if d.get('kind') in DOCUMENT_KINDS and (d.get('text') or '').strip())
+            if added:
+                RETRIEVAL_DOCUMENTS.inc(added, kind="warm")
+                logger.info(f"已用历史回答预热检索索引: {digest}, 文档: {added}")
+
+    def _get(self, problem_content: str) -> Optional[ProblemIndex]:
+        if not (problem_content or "").strip():
+            return None
+        digest = problem_hash(problem_content)
+        fresh = False
+        with self._lock:
+            index = self._indexes.get(digest)
+            if index is None:
+                path = os.path.join(self.directory, f"{digest}.jsonl") if self.directory else None
+                index = self._indexes[digest] = ProblemIndex(path)
+                fresh = path is None or not os.path.exists(path)
+                if len(self._indexes) > self.max_problems:
+                    self._indexes.popitem(last=False)
+            else:
+                self._indexes.move_to_end(digest)
+        if fresh and self._loaders:
+            self._warm(digest, index)
+        return index
+
+    def add(self, problem_content: str, kind: str, text: str, question: str = "") -> bool:
+        """为题目追加一篇文档"""
+        index = self._get(problem_content)
+        if index is None or not (text or "").strip():
+            return False
+        try:
+            added = index.add(kind, text.strip(), question)
+            if added:
+                RETRIEVAL_DOCUMENTS.inc(kind=kind)
+            return added
+        except Exception as e:
+            logger.error(f"写入检索索引时出错: {str(e)}")
+            return False
+
+    def search(self, problem_content: str, query: str, k: int = 3,
+               kinds: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """在题目的索引中检索"""
+        index = self._get(problem_content)
+        if index is None:
+            return []
+        try:
+            return index.search(query, k, kinds)
+        except Exception as e:
+            logger.error(f"检索索引时出错: {str(e)}")
+            return []
+
+    def match(self, problem_content: str, query: str, kind: str = "answer") -> Optional[Dict[str, Any]]:
+        """查找同一题目下几乎相同的历史问题，返回其文档"""
+        for document in self.search(problem_content, query, k=3, kinds=(kind,)):
+            if question_similarity(query, document.get('question', '')) >= self.direct_similarity:
+                RETRIEVAL_LOOKUPS.inc(purpose=kind, result="direct")
+                return document
+        RETRIEVAL_LOOKUPS.inc(purpose=kind, result="miss")
+        return None
+
+    def snippets(self, problem_content: str, query: str, k: int = 2) -> List[str]:
+        """与问题相关的历史回答和题解片段"""
+        snippets = [document['text'][:SNIPPET_CHARS]
+                    for document in self.search(problem_content, query, k, kinds=("answer", "editorial"))
+                    if document['coverage'] >= self.min_coverage]
+        RETRIEVAL_LOOKUPS.inc(purpose="snippets", result="hit" if snippets else "miss")
+        return snippets
+
+# 创建全局检索索引实例
+retrieval_index = RetrievalIndex(
+    directory=os.getenv('OJ_RETRIEVAL_DIR', 'oj_agent_index') or None,
+    max_problems=int(os.getenv('OJ_RETRIEVAL_MAX_PROBLEMS', '256')),
+    min_coverage=float(os.getenv('OJ_RETRIEVAL_MIN_COVERAGE', '0.3')),
+    direct_similarity=float(os.getenv('OJ_RETRIEVAL_DIRECT_SIMILARITY', '0.85'))
+)
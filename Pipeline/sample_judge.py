@@ -0,0 +1,409 @@
+import io
+import os
+import re
+import ast
+import json
+import time
+import types
+import signal
+import hashlib
+import logging
+import builtins
+import tempfile
+import threading
+import contextlib
+import multiprocessing
+from typing import Any, Dict, List, Optional, Tuple
+from metrics import registry
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# 样例标题，例如"输入样例#1："、"样例输入 1"、"Sample Input 1"
+SAMPLE_INPUT_HEADER = re.compile(r'^(?:输入样例|样例输入|sample\s*input)\s*#?\s*\d*\s*[:：]?\s*(.*)$', re.IGNORECASE)
+SAMPLE_OUTPUT_HEADER = re.compile(r'^(?:输出样例|样例输出|sample\s*output)\s*#?\s*\d*\s*[:：]?\s*(.*)$', re.IGNORECASE)
+# 力扣风格的示例，例如"输入：nums = [2,7,11,15], target = 9"
+INLINE_INPUT = re.compile(r'^输入\s*[:：]\s*(.+)$')
+INLINE_OUTPUT = re.compile(r'^输出\s*[:：]\s*(.+)$')
+# 结束一段样例的标题
+SECTION_HEADER = re.compile(r'^(?:示例|样例解释|解释|说明|提示|数据范围|输入格式|输出格式|题目|限制)')
+
+# 评测结果
+VERDICT_NAMES = {
+    "AC": "通过",
+    "WA": "答案错误",
+    "RE": "运行错误",
+    "TLE": "超时",
+    "MLE": "内存超限",
+    "CE": "编译错误"
+}
+
+# 用户代码允许导入的模块（sys由_restricted_sys代替，只暴露标准输入输出和递归深度）
+ALLOWED_MODULES = {
+    "math", "cmath", "collections", "heapq", "bisect", "itertools", "functools", "operator",
+    "string", "re", "random", "copy", "decimal", "fractions", "statistics",
+    "dataclasses", "enum", "array"
+}
+# 从用户代码中移除的内置函数
+BLOCKED_BUILTINS = ("open", "exec", "eval", "compile", "breakpoint", "exit", "quit", "help", "globals", "vars")
+# 用户代码可设置的最大递归深度
+MAX_RECURSION_LIMIT = 100000
+# 评测进程切换到的无特权用户（服务以root运行时生效）
+JUDGE_USER = "nobody"
+# unshare(2)的标志
+CLONE_NEWUSER = 0x10000000
+CLONE_NEWNET = 0x40000000
+# 评测报告中每个输入、输出、错误信息保留的字符数
+REPORT_VALUE_CHARS = 80
+
+# 在沙箱进程中执行时使用的模块名，使 if __name__ == '__main__' 中的自测代码不被执行
+SOLUTION_MODULE = "oj_solution"
+DEFAULT_FUNCTION = "solution"
+
+# 评测进程中断网或切换用户失败的原因，由_init_worker设置；不为None时评测进程拒绝运行代码
+_isolation_error: Optional[str] = None
+
+JUDGE_CASES = registry.counter(
+    "oj_agent_judge_cases_total", "本地样例评测的用例数", ["verdict"])
+JUDGE_LATENCY = registry.histogram(
+    "oj_agent_judge_latency_seconds", "一次本地样例评测的总耗时")
+
+
+def parse_samples(problem_content: str) -> List[Dict[str, str]]:
+    """从题目内容中解析样例输入输出，返回 [{"input": ..., "output": ...}]"""
+    samples = []
+    current: Optional[Dict[str, List[str]]] = None
+    field = None
+
+    def close():
+        if current and current["input"] and current["output"]:
+            samples.append({"input": "\n".join(current["input"]).strip(),
+                            "output": "\n".join(current["output"]).strip()})
+
+    for raw in (problem_content or "").splitlines():
+        line = raw.strip()
+        input_match = SAMPLE_INPUT_HEADER.match(line) or INLINE_INPUT.match(line)
+        output_match = SAMPLE_OUTPUT_HEADER.match(line) or INLINE_OUTPUT.match(line)
+        if input_match:
+            close()
+            current, field = {"input": [], "output": []}, "input"
+            rest = input_match.group(1).strip()
+        elif output_match and current is not None:
+            field = "output"
+            rest = output_match.group(1).strip()
+        elif current is None:
+            continue
+        elif SECTION_HEADER.match(line) or (not line and field == "output" and current["output"]):
+            close()
+            current, field = None, None
+            continue
+        else:
+            rest = raw.rstrip()
+        if rest.strip("`"):
+            current[field].append(rest)
+    close()
+    return samples
+
+
+def code_digest(code: str) -> str:
+    """代码内容的哈希（缩进有意义，不做空白归一化）"""
+    return hashlib.sha256((code or "").encode("utf-8")).hexdigest()[:16]
+
+
+def parse_call_args(text: str) -> Optional[Tuple[list, dict]]:
+    """把样例输入解析为函数参数，例如 'm = 3,s = "UCU"' -> ([], {'m': 3, 's': 'UCU'})"""
+    try:
+        call = ast.parse(f"f({text})", mode="eval").body
+        args = [ast.literal_eval(arg) for arg in call.args]
+        kwargs = {kw.arg: ast.literal_eval(kw.value) for kw in call.keywords if kw.arg}
+        return args, kwargs
+    except (SyntaxError, ValueError, TypeError):
+        return None
+
+
+def detect_function(code: str) -> Optional[str]:
+    """找到要评测的函数：优先solution，否则取唯一的顶层函数"""
+    tree = ast.parse(code)
+    functions = [node.name for node in tree.body if isinstance(node, ast.FunctionDef)]
+    if DEFAULT_FUNCTION in functions:
+        return DEFAULT_FUNCTION
+    return functions[0] if len(functions) == 1 else None
+
+
+def _same_value(actual: Any, expected_text: str) -> bool:
+    """比较函数返回值与期望输出"""
+    try:
+        expected = ast.literal_eval(expected_text)
+    except (SyntaxError, ValueError):
+        expected = expected_text
+    if actual == expected:
+        return True
+    # 期望输出不是Python字面量时（如 true、1 2 3），按文本比较
+    return " ".join(str(actual).split()).lower() == " ".join(str(expected_text).split()).lower()
+
+
+class IsolationError(Exception):
+    """评测进程无法断网或切换到无特权用户，不能安全地运行代码"""
+
+
+class _TimeLimitExceeded(BaseException):
+    """继承BaseException，避免被用户代码中的 except Exception 吞掉"""
+
+
+def _restricted_sys(stdin: io.StringIO, stdout: io.StringIO) -> types.ModuleType:
+    """用户代码导入的sys：只有标准输入输出、maxsize和递归深度"""
+    import sys
+    module = types.ModuleType("sys")
+    module.stdin, module.stdout, module.maxsize = stdin, stdout, sys.maxsize
+    module.getrecursionlimit = sys.getrecursionlimit
+    module.setrecursionlimit = lambda limit: sys.setrecursionlimit(min(int(limit), MAX_RECURSION_LIMIT))
+    return module
+
+
+def _sandbox_builtins(allow_input: bool, stdin: io.StringIO, stdout: io.StringIO) -> Dict[str, Any]:
+    restricted_sys = _restricted_sys(stdin, stdout)
+
+    def safe_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if not level and name == "sys":
+            return restricted_sys
+        if level or name.split(".")[0] not in ALLOWED_MODULES:
+            raise ImportError(f"评测环境不允许导入模块: {name}")
+        return __import__(name, globals, locals, fromlist, level)
+
+    safe = {name: getattr(builtins, name) for name in dir(builtins) if name not in BLOCKED_BUILTINS}
+    safe["__import__"] = safe_import
+    if not allow_input:
+        safe.pop("input", None)
+    return safe
+
+
+def _isolate_network():
+    """把评测进程移入新的网络命名空间（只有未启用的回环接口）；不是root时先创建用户命名空间"""
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    flags = CLONE_NEWNET if os.geteuid() == 0 else CLONE_NEWUSER | CLONE_NEWNET
+    if libc.unshare(flags) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def _drop_privileges(user: str) -> bool:
+    """服务以root运行时切换到无特权用户，切换后/proc/self/environ等文件对评测进程不可读"""
+    if os.geteuid() != 0:
+        return False
+    import pwd
+    entry = pwd.getpwnam(user)
+    os.setgroups([])
+    os.setgid(entry.pw_gid)
+    os.setuid(entry.pw_uid)
+    return True
+
+
+def _init_worker(memory_mb: int, user: str = JUDGE_USER):
+    """评测进程初始化：清空环境变量、断开网络、切换到无特权用户，限制资源，并切换到临时目录
+
+    断网或切换用户失败（非Linux、服务未以root运行等）时记录原因，之后该进程拒绝运行任何代码：
+    模块白名单和内置函数限制可以被绕过，不能单独作为安全边界。
+    """
+    global _isolation_error
+    import resource
+    os.environ.clear()
+    try:
+        _isolate_network()
+        if not _drop_privileges(user):
+            _isolation_error = "服务未以root运行，评测进程无法切换到无特权用户"
+    except (AttributeError, KeyError, OSError) as e:
+        _isolation_error = f"评测进程无法断网或切换到用户{user}: {e}"
+    os.chdir(tempfile.mkdtemp(prefix="oj_judge_"))
+    limit = memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (0, 0))
+    resource.setrlimit(resource.RLIMIT_NPROC, (0, 0))
+    signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+
+
+def _on_alarm(signum, frame):
+    raise _TimeLimitExceeded()
+
+
+def _run_case(code: str, function: Optional[str], case: Dict[str, str], time_limit: float) -> Dict[str, Any]:
+    """在评测进程中运行一个样例，返回 {"verdict", "actual", "time_ms", "error"}；进程未能隔离时抛出IsolationError"""
+    if _isolation_error is not None:
+        raise IsolationError(_isolation_error)
+    result = {"verdict": "AC", "actual": "", "time_ms": 0.0, "error": ""}
+    signal.signal(signal.SIGALRM, _on_alarm)
+    stdin = io.StringIO("" if function else case["input"] + "\n")
+    stdout = io.StringIO()
+    started = time.perf_counter()
+    try:
+        compiled = compile(code, "<solution>", "exec")
+        namespace = {"__name__": SOLUTION_MODULE if function else "__main__",
+                     "__builtins__": _sandbox_builtins(function is None, stdin, stdout)}
+        signal.setitimer(signal.ITIMER_REAL, time_limit)
+        if function:
+            exec(compiled, namespace)
+            args, kwargs = parse_call_args(case["input"])
+            started = time.perf_counter()
+            actual = namespace[function](*args, **kwargs)
+            result["time_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            result["actual"] = repr(actual)[:200]
+            if not _same_value(actual, case["output"]):
+                result["verdict"] = "WA"
+        else:
+            with contextlib.redirect_stdout(stdout):
+                import sys
+                original_stdin, sys.stdin = sys.stdin, stdin
+                try:
+                    exec(compiled, namespace)
+                finally:
+                    sys.stdin = original_stdin
+            result["time_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            result["actual"] = stdout.getvalue()[:200]
+            if stdout.getvalue().split() != case["output"].split():
+                result["verdict"] = "WA"
+    except _TimeLimitExceeded:
+        result.update(verdict="TLE", time_ms=round(time_limit * 1000, 2))
+    except SyntaxError as e:
+        result.update(verdict="CE", error=f"第{e.lineno}行: {e.msg}")
+    except MemoryError:
+        result.update(verdict="MLE")
+    except BaseException as e:
+        result.update(verdict="RE", error=f"{type(e).__name__}: {str(e)[:200]}")
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    return result
+
+
+class SampleJudge:
+    def __init__(self, processes: int = 2, time_limit: float = 2.0, memory_mb: int = 256,
+                 max_samples: int = 10, user: str = JUDGE_USER):
+        """本地样例评测
+
+        在独立的评测进程池中并行运行编辑区代码，每个样例有单独的时间限制。
+        评测进程清空环境变量、位于没有网络的命名空间、以user（服务以root运行时）的身份运行，
+        并限制内存、禁止写文件和创建进程；这些进程级的限制是安全边界。
+        模块白名单和移除的内置函数只用于尽早给出明确的错误，无法单独阻止恶意代码。
+        评测进程无法断网或降权时不运行代码，本实例此后不再评测，judge返回None。
+        """
+        self.processes = processes
+        self.time_limit = time_limit
+        self.memory_mb = memory_mb
+        self.max_samples = max_samples
+        self.user = user
+        self._pool = None
+        self._lock = threading.Lock()
+        # 评测进程无法隔离的原因，设置后不再评测
+        self.unavailable: Optional[str] = None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                methods = multiprocessing.get_all_start_methods()
+                # forkserver从干净的进程派生评测进程，避免复制服务进程中的线程和连接
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                self._pool = context.Pool(self.processes, initializer=_init_worker,
+                                          initargs=(self.memory_mb, self.user), maxtasksperchild=100)
+            return self._pool
+
+    def _reset_pool(self):
+        """评测进程卡死时终止整个进程池，下次评测时重建"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.terminate()
+
+    def judge(self, editor_code: str, problem_content: str = "",
+              samples: Optional[List[Dict[str, str]]] = None) -> Optional[Dict[str, Any]]:
+        """评测代码，没有样例、代码为空或评测进程无法隔离时返回None"""
+        samples = (samples if samples is not None else parse_samples(problem_content))[:self.max_samples]
+        if not samples or not (editor_code or "").strip() or self.unavailable:
+            return None
+
+        started = time.perf_counter()
+        report = {"function": None, "passed": 0, "total": len(samples), "cases": []}
+        try:
+            function = detect_function(editor_code)
+        except SyntaxError as e:
+            for i, case in enumerate(samples, 1):
+                report["cases"].append({"index": i, "input": case["input"], "expected": case["output"],
+                                        "verdict": "CE", "actual": "", "time_ms": 0.0,
+                                        "error": f"第{e.lineno}行: {e.msg}"})
+            JUDGE_CASES.inc(len(samples), verdict="CE")
+            return report
+
+        # 样例输入能解析为函数参数时调用函数，否则作为标准输入运行整个程序
+        if function and not all(parse_call_args(case["input"]) for case in samples):
+            function = None
+        report["function"] = function
+
+        pool = self._get_pool()
+        pending = [pool.apply_async(_run_case, (editor_code, function, case, self.time_limit)) for case in samples]
+        # 样例多于进程数时需要排队，按轮数放宽整体等待时间
+        rounds = -(-len(samples) // self.processes)
+        deadline = time.monotonic() + self.time_limit * rounds + 2.0
+        stuck = False
+        for i, (case, future) in enumerate(zip(samples, pending), 1):
+            try:
+                outcome = future.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except IsolationError as e:
+                self._disable(str(e))
+                return None
+            except multiprocessing.TimeoutError:
+                # 进程被资源限制杀死或卡在无法中断的调用中
+                stuck = True
+                outcome = {"verdict": "TLE", "actual": "", "time_ms": round(self.time_limit * 1000, 2),
+                           "error": "评测进程无响应"}
+            except Exception as e:
+                outcome = {"verdict": "RE", "actual": "", "time_ms": 0.0, "error": str(e)[:200]}
+            report["cases"].append({"index": i, "input": case["input"], "expected": case["output"], **outcome})
+            JUDGE_CASES.inc(verdict=outcome["verdict"])
+        if stuck:
+            self._reset_pool()
+
+        report["passed"] = sum(1 for case in report["cases"] if case["verdict"] == "AC")
+        report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        JUDGE_LATENCY.observe(time.perf_counter() - started)
+        return report
+
+    def _disable(self, reason: str):
+        """评测进程无法隔离：停止评测并关闭进程池"""
+        if self.unavailable is None:
+            logger.error(f"本地样例评测已停用: {reason}")
+        self.unavailable = reason
+        self._reset_pool()
+
+    def close(self):
+        self._reset_pool()
+
+
+def quote_value(text: str, limit: int = REPORT_VALUE_CHARS) -> str:
+    """把样例数据、程序输出或错误信息截断并转义为单行的引号字符串，程序输出无法伪装成回答或上下文中的指令"""
+    text = str(text)
+    if len(text) > limit:
+        text = text[:limit] + "…"
+    return json.dumps(text, ensure_ascii=False)
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """把评测结果整理为简短的文字，用于回答或模型上下文"""
+    lines = [f"本地样例测试：{report['passed']}/{report['total']} 通过"]
+    for case in report["cases"]:
+        verdict = VERDICT_NAMES.get(case["verdict"], case["verdict"])
+        line = f"- 样例{case['index']}：{verdict}（{case['time_ms']} ms）"
+        if case["verdict"] == "WA":
+            line += (f"，输入 {quote_value(case['input'])}，期望 {quote_value(case['expected'])}，"
+                     f"实际 {quote_value(case['actual'].strip())}")
+        elif case["error"]:
+            line += f"，{quote_value(case['error'])}"
+        lines.append(line)
+    return "\n".join(lines)
+
+# 创建全局评测实例
+sample_judge = SampleJudge(processes=int(os.getenv('OJ_JUDGE_PROCESSES', '2')),
+                           time_limit=float(os.getenv('OJ_JUDGE_TIME_LIMIT', '2.0')),
+                           memory_mb=int(os.getenv('OJ_JUDGE_MEMORY_MB', '256')),
+                           user=os.getenv('OJ_JUDGE_USER', JUDGE_USER))
@@ -0,0 +1,359 @@
+import os
+import json
+import time
+import hashlib
+import socket
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse, unquote
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# 默认的存储地址：memory:// | sqlite:///path/to/state.db | redis://[:password@]host:port/db
+DEFAULT_STORAGE_URL = "memory://"
+
+
+class StorageBackend:
+    """键值存储接口，值为可JSON序列化的对象，按namespace隔离"""
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str):
+        raise NotImplementedError
+
+    def append(self, namespace: str, key: str, value: Any, max_len: Optional[int] = None,
+               ttl: Optional[float] = None):
+        """向列表追加元素，只保留最近max_len个"""
+        raise NotImplementedError
+
+    def get_list(self, namespace: str, key: str) -> List[Any]:
+        raise NotImplementedError
+
+
+class InMemoryBackend(StorageBackend):
+    def __init__(self):
+        """进程内存储，仅适用于单进程部署"""
+        self._data: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(namespace: str, key: str) -> str:
+        return f"{namespace}:{key}"
+
+    def _live(self, full_key: str):
+        item = self._data.get(full_key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[full_key]
+            return None
+        return item
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._live(self._key(namespace, key))
+            return None if item is None else item[0]
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._data[self._key(namespace, key)] = (value, time.time() + ttl if ttl else None)
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._data.pop(self._key(namespace, key), None)
+
+    def append(self, namespace: str, key: str, value: Any, max_len: Optional[int] = None,
+               ttl: Optional[float] = None):
+        full_key = self._key(namespace, key)
+        with self._lock:
+            item = self._live(full_key)
+            values = list(item[0]) if item else []
+            values.append(value)
+            if max_len:
+                values = values[-max_len:]
+            self._data[full_key] = (values, time.time() + ttl if ttl else None)
+
+    def get_list(self, namespace: str, key: str) -> List[Any]:
+        return list(self.get(namespace, key) or [])
+
+
+class SQLiteBackend(StorageBackend):
+    def __init__(self, path: str):
+        """SQLite存储（WAL模式），适用于同一主机上的多进程部署"""
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("""CREATE TABLE IF NOT EXISTS kv (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            expires_at REAL,
+            PRIMARY KEY (namespace, key))""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_kv_expires ON kv(expires_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _maybe_purge(self, conn: sqlite3.Connection):
+        """每1000次写入清理一次过期数据"""
+        with self._writes_lock:
+            self._writes += 1
+            purge = self._writes % 1000 == 0
+        if purge:
+            conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        row = self._conn().execute(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                     (namespace, key, json.dumps(value, ensure_ascii=False), time.time() + ttl if ttl else None))
+        self._maybe_purge(conn)
+
+    def delete(self, namespace: str, key: str):
+        self._conn().execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def append(self, namespace: str, key: str, value: Any, max_len: Optional[int] = None,
+               ttl: Optional[float] = None):
+        conn = self._conn()
+        # BEGIN IMMEDIATE保证多进程下读-改-写的原子性
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            values = self.get_list(namespace, key)
+            values.append(value)
+            if max_len:
+                values = values[-max_len:]
+            conn.execute("INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                         (namespace, key, json.dumps(values, ensure_ascii=False),
+                          time.time() + ttl if ttl else None))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_list(self, namespace: str, key: str) -> List[Any]:
+        return list(self.get(namespace, key) or [])
+
+
+class RedisError(Exception):
+    """Redis服务端返回的错误"""
+
+
+class RedisBackend(StorageBackend):
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0,
+                 password: Optional[str] = None, timeout: float = 5.0):
+        """基于RESP协议的Redis存储，适用于多节点部署（不依赖redis客户端库）"""
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._local.sock = sock
+        self._local.reader = sock.makefile("rb")
+        if self.password:
+            self._send("AUTH", self.password)
+        if self.db:
+            self._send("SELECT", self.db)
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        self._local.sock = None
+
+    @staticmethod
+    def _encode(*args) -> bytes:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        return b"".join(parts)
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError("Redis连接已关闭")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode("utf-8")
+        if prefix == b"-":
+            raise RedisError(payload.decode("utf-8"))
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._local.reader.read(length + 2)
+            return data[:-2]
+        if prefix == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError(f"无法解析的响应: {line!r}")
+
+    def _send(self, *args):
+        self._local.sock.sendall(self._encode(*args))
+        return self._read_reply()
+
+    def _send_transaction(self, commands):
+        # MULTI、各命令和EXEC一次发送，依次读取OK、各命令的QUEUED和EXEC的结果
+        self._local.sock.sendall(self._encode("MULTI") + b"".join(self._encode(*c) for c in commands) +
+                                 self._encode("EXEC"))
+        try:
+            for _ in range(len(commands) + 1):
+                self._read_reply()
+            return self._read_reply()
+        except RedisError:
+            # 出错时剩余的响应没有读完，关闭连接避免后续命令读到错位的响应
+            self._close()
+            raise
+
+    def _with_retry(self, send):
+        """连接断开时重连一次"""
+        for attempt in range(2):
+            try:
+                if getattr(self._local, "sock", None) is None:
+                    self._connect()
+                return send()
+            except (ConnectionError, OSError):
+                self._close()
+                if attempt:
+                    raise
+
+    def execute(self, *args):
+        """执行一条命令，连接断开时重连一次"""
+        return self._with_retry(lambda: self._send(*args))
+
+    def transaction(self, *commands):
+        """用MULTI/EXEC原子地执行多条命令（一次往返），返回各命令的结果"""
+        return self._with_retry(lambda: self._send_transaction(commands))
+
+    @staticmethod
+    def _key(namespace: str, key: str) -> str:
+        return f"oj:{namespace}:{key}"
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        data = self.execute("GET", self._key(namespace, key))
+        return None if data is None else json.loads(data)
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        payload = json.dumps(value, ensure_ascii=False)
+        if ttl:
+            self.execute("SET", self._key(namespace, key), payload, "PX", int(ttl * 1000))
+        else:
+            self.execute("SET", self._key(namespace, key), payload)
+
+    def delete(self, namespace: str, key: str):
+        self.execute("DEL", self._key(namespace, key))
+
+    def append(self, namespace: str, key: str, value: Any, max_len: Optional[int] = None,
+               ttl: Optional[float] = None):
+        full_key = self._key(namespace, key)
+        commands = [("RPUSH", full_key, json.dumps(value, ensure_ascii=False))]
+        if max_len:
+            commands.append(("LTRIM", full_key, -max_len, -1))
+        if ttl:
+            commands.append(("PEXPIRE", full_key, int(ttl * 1000)))
+        self.transaction(*commands)
+
+    def get_list(self, namespace: str, key: str) -> List[Any]:
+        items = self.execute("LRANGE", self._key(namespace, key), 0, -1) or []
+        return [json.loads(item) for item in items]
+
+
+def problem_hash(content: str) -> str:
+    """计算题目内容的哈希（忽略空白差异），用作题目级数据的键"""
+    normalized = " ".join((content or "").split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+def create_backend(url: Optional[str] = None) -> StorageBackend:
+    """根据地址创建存储后端，默认读取环境变量OJ_STORAGE_URL"""
+    url = url or os.getenv("OJ_STORAGE_URL", DEFAULT_STORAGE_URL)
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        backend = InMemoryBackend()
+    elif parsed.scheme == "sqlite":
+        path = unquote(parsed.path[1:] if parsed.path.startswith("//") else parsed.path.lstrip("/") or "oj_agent_state.db")
+        if parsed.netloc:
+            path = os.path.join(parsed.netloc, path)
+        backend = SQLiteBackend(path)
+    elif parsed.scheme == "redis":
+        db = int(parsed.path.lstrip("/") or 0)
+        backend = RedisBackend(parsed.hostname or "localhost", parsed.port or 6379, db,
+                               unquote(parsed.password) if parsed.password else None)
+    else:
+        raise ValueError(f"不支持的存储地址: {url}")
+    logger.info(f"使用存储后端: {type(backend).__name__}")
+    return backend
+
+
+class SessionStore:
+    def __init__(self, backend: StorageBackend, session_ttl: float = 24 * 3600, max_turns: int = 20):
+        """会话上下文、对话记忆和缓存的统一入口，使工作进程本身不持有会话状态"""
+        self.backend = backend
+        self.session_ttl = session_ttl
+        self.max_turns = max_turns
+
+    def get_field(self, session_id: str, field: str, default: Any = None) -> Any:
+        """读取会话上下文字段（如problem_content、editor_code）"""
+        value = self.backend.get("session", f"{session_id}:{field}")
+        return default if value is None else value
+
+    def set_field(self, session_id: str, field: str, value: Any):
+        """写入会话上下文字段"""
+        self.backend.set("session", f"{session_id}:{field}", value, ttl=self.session_ttl)
+
+    def append_turn(self, session_id: str, turn: Dict[str, Any]):
+        """记录一轮对话"""
+        self.backend.append("memory", session_id, turn, max_len=self.max_turns, ttl=self.session_ttl)
+
+    def get_turns(self, session_id: str) -> List[Dict[str, Any]]:
+        """读取最近的对话记录"""
+        return self.backend.get_list("memory", session_id)
+
+    def cache_get(self, name: str, key: str) -> Optional[Any]:
+        """读取缓存"""
+        return self.backend.get(f"cache:{name}", key)
+
+    def cache_set(self, name: str, key: str, value: Any, ttl: Optional[float] = None):
+        """写入缓存"""
+        self.backend.set(f"cache:{name}", key, value, ttl=ttl)
+
+    def cache_delete(self, name: str, key: str):
+        """删除缓存"""
+        self.backend.delete(f"cache:{name}", key)
+
+# 创建全局会话存储实例
+session_store = SessionStore(create_backend())
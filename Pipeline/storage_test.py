@@ -0,0 +1,105 @@
+import time
+import threading
+import pytest
+from storage import InMemoryBackend, SQLiteBackend, RedisBackend, SessionStore, create_backend, problem_hash
+from mini_redis import MiniRedisServer
+
+
+@pytest.fixture(scope="module")
+def redis_server():
+    server = MiniRedisServer(("127.0.0.1", 0))
+    server.start_background()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryBackend()
+    if request.param == "sqlite":
+        return SQLiteBackend(str(tmp_path / "state.db"))
+    server = request.getfixturevalue("redis_server")
+    server.store._cmd_flushall()
+    return RedisBackend("127.0.0.1", server.server_address[1])
+
+
+def test_get_set_delete(backend):
+    assert backend.get("n", "k") is None
+    backend.set("n", "k", {"text": "中文", "items": [1, 2]})
+    assert backend.get("n", "k") == {"text": "中文", "items": [1, 2]}
+    assert backend.get("other", "k") is None
+    backend.delete("n", "k")
+    assert backend.get("n", "k") is None
+
+
+def test_ttl_expires(backend):
+    backend.set("n", "short", 1, ttl=0.05)
+    backend.set("n", "long", 2, ttl=60)
+    time.sleep(0.1)
+    assert backend.get("n", "short") is None
+    assert backend.get("n", "long") == 2
+
+
+def test_append_keeps_last_max_len(backend):
+    for i in range(5):
+        backend.append("m", "s", {"i": i}, max_len=3, ttl=60)
+    assert backend.get_list("m", "s") == [{"i": 2}, {"i": 3}, {"i": 4}]
+    assert backend.get_list("m", "missing") == []
+
+
+def test_append_ttl_expires(backend):
+    backend.append("m", "s", 1, ttl=0.05)
+    time.sleep(0.1)
+    assert backend.get_list("m", "s") == []
+
+
+def test_concurrent_appends_are_not_lost(backend):
+    def worker(n):
+        for i in range(20):
+            backend.append("m", "c", [n, i], max_len=1000)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(backend.get_list("m", "c")) == 80
+
+
+def test_redis_transaction(redis_server):
+    backend = RedisBackend("127.0.0.1", redis_server.server_address[1])
+    assert backend.transaction(("RPUSH", "t", "a"), ("RPUSH", "t", "b"), ("LRANGE", "t", 0, -1)) == \
+        [1, 2, [b"a", b"b"]]
+    # 事务之后连接上的响应没有错位
+    assert backend.execute("LRANGE", "t", 0, -1) == [b"a", b"b"]
+
+
+def test_create_backend_urls(tmp_path):
+    assert isinstance(create_backend("memory://"), InMemoryBackend)
+    backend = create_backend(f"sqlite:///{tmp_path / 'x.db'}")
+    assert isinstance(backend, SQLiteBackend)
+    assert (tmp_path / "x.db").exists()
+    with pytest.raises(ValueError):
+        create_backend("ftp://host")
+
+
+def test_session_store_fields_and_turns():
+    store = SessionStore(InMemoryBackend(), max_turns=2)
+    assert store.get_field("s", "problem_content", "") == ""
+    store.set_field("s", "problem_content", "题目")
+    assert store.get_field("s", "problem_content") == "题目"
+    assert store.get_field("other", "problem_content") is None
+    for i in range(3):
+        store.append_turn("s", {"query": i})
+    assert store.get_turns("s") == [{"query": 1}, {"query": 2}]
+    store.cache_set("c", "k", 1)
+    assert store.cache_get("c", "k") == 1
+    store.cache_delete("c", "k")
+    assert store.cache_get("c", "k") is None
+
+
+def test_problem_hash_ignores_whitespace():
+    assert problem_hash("a  b\n c") == problem_hash(" a b c ")
+    assert problem_hash("a b") != problem_hash("ab")
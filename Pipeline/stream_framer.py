@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import zlib
+import asyncio
+import logging
+from contextlib import aclosing
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional
+from metrics import registry, BYTE_BUCKETS, TOKEN_BUCKETS
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# 合并回答片段的时间窗口（秒）和字符数上限
+COALESCE_SECONDS = float(os.getenv('OJ_SSE_COALESCE_SECONDS', '0.1'))
+COALESCE_CHARS = int(os.getenv('OJ_SSE_COALESCE_CHARS', '512'))
+# 客户端支持时以gzip压缩事件流（设置OJ_SSE_GZIP=0时关闭）
+SSE_GZIP = os.getenv('OJ_SSE_GZIP', '1') != '0'
+GZIP_LEVEL = 6
+
+STREAM_BYTES = registry.histogram(
+    "oj_agent_stream_response_bytes", "每个流式响应的字节数（payload为压缩前，wire为实际发送）",
+    ["kind"], BYTE_BUCKETS)
+STREAM_EVENTS = registry.histogram(
+    "oj_agent_stream_response_events", "每个流式响应的回答片段数（deltas）和发送的事件数（events）",
+    ["kind"], TOKEN_BUCKETS)
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """将事件编码为SSE数据帧"""
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """根据Accept-Encoding请求头判断是否压缩事件流"""
+    return SSE_GZIP and "gzip" in (accept_encoding or "").lower()
+
+
+class StreamFramer:
+    def __init__(self, compress: bool = False, window_seconds: float = COALESCE_SECONDS,
+                 max_chars: int = COALESCE_CHARS):
+        """将事件流编码为SSE字节流
+
+        相邻的content事件在window_seconds内或累计max_chars个字符前合并为一个事件，
+        片段原样拼接（包括只含空白的片段）；第一个片段立即发送，不增加首字延迟。
+        compress为True时以gzip压缩，每次发送后同步刷新，客户端可以立即解压已收到的事件。
+        coalesce只合并不编码，供WebSocket会话使用。
+        """
+        self.window_seconds = window_seconds
+        self.max_chars = max_chars
+        self.compressed = compress
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+        self.deltas = 0
+        self.events = 0
+        self.payload_bytes = 0
+        self.wire_bytes = 0
+
+    def _encode(self, event: Dict[str, Any]) -> bytes:
+        data = format_sse(event).encode("utf-8")
+        self.events += 1
+        self.payload_bytes += len(data)
+        if self._compressor is not None:
+            data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.wire_bytes += len(data)
+        return data
+
+    def _finish(self) -> bytes:
+        """gzip流的结尾"""
+        if self._compressor is None:
+            return b""
+        data = self._compressor.flush(zlib.Z_FINISH)
+        self.wire_bytes += len(data)
+        return data
+
+    async def coalesce(self, events: AsyncIterator[Dict[str, Any]]) -> AsyncGenerator[Dict[str, Any], None]:
+        """读取事件并产出合并后的事件，等待下一个事件时到期的合并内容照常产出"""
+        buffer: List[str] = []
+        buffered_chars = 0
+        flush_at: Optional[float] = None
+        step = None
+        try:
+            while True:
+                step = step or asyncio.ensure_future(events.__anext__())
+                timeout = None if flush_at is None else max(flush_at - time.monotonic(), 0.0)
+                done, _ = await asyncio.wait((step,), timeout=timeout)
+                if not done:
+                    # 合并窗口到期
+                    yield {"type": "content", "data": "".join(buffer)}
+                    buffer, buffered_chars, flush_at = [], 0, None
+                    continue
+                task, step = step, None
+                try:
+                    event = task.result()
+                except StopAsyncIteration:
+                    break
+                if event.get("type") == "content" and isinstance(event.get("data"), str):
+                    self.deltas += 1
+                    if self.deltas == 1:
+                        yield event
+                        continue
+                    buffer.append(event["data"])
+                    buffered_chars += len(event["data"])
+                    if buffered_chars < self.max_chars:
+                        flush_at = flush_at or time.monotonic() + self.window_seconds
+                        continue
+                    yield {"type": "content", "data": "".join(buffer)}
+                    buffer, buffered_chars, flush_at = [], 0, None
+                    continue
+                # 其他事件发送前先发出已合并的内容，保持事件顺序
+                if buffer:
+                    yield {"type": "content", "data": "".join(buffer)}
+                    buffer, buffered_chars, flush_at = [], 0, None
+                yield event
+            if buffer:
+                yield {"type": "content", "data": "".join(buffer)}
+        finally:
+            if step is not None and not step.done():
+                step.cancel()
+                # 等待被取消的读取结束，之后才能关闭底层事件流
+                await asyncio.gather(step, return_exceptions=True)
+
+    async def frames(self, events: AsyncIterator[Dict[str, Any]]) -> AsyncGenerator[bytes, None]:
+        """读取事件并产出编码后的SSE字节"""
+        try:
+            async with aclosing(self.coalesce(events)) as coalesced:
+                async for event in coalesced:
+                    yield self._encode(event)
+            yield self._finish()
+        finally:
+            self._record()
+
+    def _record(self):
+        STREAM_BYTES.observe(self.payload_bytes, kind="payload")
+        STREAM_BYTES.observe(self.wire_bytes, kind="wire")
+        STREAM_EVENTS.observe(self.deltas, kind="deltas")
+        STREAM_EVENTS.observe(self.events, kind="events")
+        logger.info(f"流式响应统计 - 回答片段: {self.deltas}, 事件: {self.events}, "
+                    f"字节: {self.payload_bytes} -> {self.wire_bytes}")
+
+    def stats(self) -> Dict[str, int]:
+        """返回本次响应的片段数、事件数和字节数"""
+        return {
+            "deltas": self.deltas,
+            "events": self.events,
+            "payload_bytes": self.payload_bytes,
+            "wire_bytes": self.wire_bytes
+        }
@@ -0,0 +1,117 @@
+import json
+import zlib
+import asyncio
+from stream_framer import StreamFramer, accepts_gzip, format_sse
+
+
+async def _events(items, delay=0.0):
+    """items中的数字表示暂停的秒数，其余为事件"""
+    for item in items:
+        if isinstance(item, (int, float)):
+            await asyncio.sleep(item)
+            continue
+        if delay:
+            await asyncio.sleep(delay)
+        yield item
+
+
+def _content(text):
+    return {"type": "content", "data": text}
+
+
+async def _collect(framer, items):
+    return [event async for event in framer.coalesce(_events(items))]
+
+
+def _texts(events):
+    return [event["data"] for event in events if event["type"] == "content"]
+
+
+def test_first_delta_sent_immediately_then_coalesced():
+    framer = StreamFramer(window_seconds=10, max_chars=1000)
+    events = asyncio.run(_collect(framer, [_content("a"), _content("b"), _content("c"), _content("d")]))
+    assert _texts(events) == ["a", "bcd"]
+    assert framer.deltas == 4
+
+
+def test_whitespace_only_deltas_are_kept():
+    framer = StreamFramer(window_seconds=10, max_chars=1000)
+    chunks = ["def f():", "\n", "    ", "return 1", "\n\n", "  "]
+    events = asyncio.run(_collect(framer, [_content(c) for c in chunks]))
+    assert "".join(_texts(events)) == "".join(chunks)
+    assert _texts(events)[-1].endswith("\n\n  ")
+
+
+def test_other_events_flush_buffer_in_order():
+    framer = StreamFramer(window_seconds=10, max_chars=1000)
+    items = [{"type": "intent", "data": {}}, _content("a"), _content("b"), _content("c"),
+             {"type": "degraded", "data": {}}, _content("d"), {"type": "predicted_questions", "data": []}]
+    events = asyncio.run(_collect(framer, items))
+    assert [(e["type"], e["data"]) for e in events] == [
+        ("intent", {}), ("content", "a"), ("content", "bc"), ("degraded", {}), ("content", "d"),
+        ("predicted_questions", [])]
+
+
+def test_max_chars_flushes_early():
+    framer = StreamFramer(window_seconds=10, max_chars=4)
+    events = asyncio.run(_collect(framer, [_content(c) for c in ["x", "ab", "cd", "e", "fgh", "i"]]))
+    assert _texts(events) == ["x", "abcd", "efgh", "i"]
+
+
+def test_window_expires_while_waiting_for_next_event():
+    framer = StreamFramer(window_seconds=0.02, max_chars=1000)
+    items = [_content("a"), _content("b"), _content("c"), 0.1, _content("d"), _content("e")]
+
+    async def main():
+        received = []
+        async for event in framer.coalesce(_events(items)):
+            received.append((event["data"], asyncio.get_running_loop().time()))
+        return received
+
+    received = asyncio.run(main())
+    assert [text for text, _ in received] == ["a", "bc", "de"]
+    # "bc"在窗口到期时发出，不等到下一个片段
+    assert received[2][1] - received[1][1] >= 0.05
+
+
+def test_non_string_content_passes_through():
+    framer = StreamFramer(window_seconds=10)
+    events = asyncio.run(_collect(framer, [_content("a"), {"type": "content", "data": None}]))
+    assert events[1] == {"type": "content", "data": None}
+
+
+def test_frames_sse_and_gzip():
+    items = [_content("你好"), _content("，"), _content("世界"), {"type": "predicted_questions", "data": []}]
+
+    async def frames(compress):
+        framer = StreamFramer(compress=compress, window_seconds=10)
+        return b"".join([chunk async for chunk in framer.frames(_events(items))]), framer
+
+    plain, framer = asyncio.run(frames(False))
+    expected = "".join(format_sse(e) for e in [_content("你好"), _content("，世界"), items[-1]]).encode("utf-8")
+    assert plain == expected
+    assert framer.stats() == {"deltas": 3, "events": 3, "payload_bytes": len(expected), "wire_bytes": len(expected)}
+
+    compressed, framer = asyncio.run(frames(True))
+    assert zlib.decompress(compressed, 31) == expected
+    assert framer.wire_bytes == len(compressed)
+
+
+def test_gzip_frames_decodable_incrementally():
+    async def main():
+        framer = StreamFramer(compress=True, window_seconds=0)
+        decoder = zlib.decompressobj(31)
+        decoded = []
+        async for chunk in framer.frames(_events([_content("a"), _content("b")])):
+            decoded.append(decoder.decompress(chunk))
+        return decoded
+
+    decoded = asyncio.run(main())
+    first = json.loads(decoded[0].decode("utf-8")[len("data: "):])
+    assert first == _content("a")
+
+
+def test_accepts_gzip():
+    assert accepts_gzip("gzip, deflate, br")
+    assert not accepts_gzip("identity")
+    assert not accepts_gzip(None)
@@ -2,6 +2,8 @@ import os
 import json
 import logging
 import asyncio
+import contextvars
+from contextlib import aclosing
 from typing import Optional, Dict, Any, AsyncGenerator
 from dotenv import load_dotenv
 from camel.configs import QwenConfig
@@ -9,25 +11,62 @@ from camel.models import ModelFactory
 from camel.types import ModelPlatformType
 from camel.agents import ChatAgent
 from next_question_predictor import init_predictor
+from metrics import StageTimer, camel_usage, record_cache_hit, CANCELLED_TOKENS
+from usage_ledger import usage_ledger
+from output_guard import output_guard
+from fair_scheduler import fair_scheduler
+from agent_pool import AgentPool
+from load_controller import load_controller, SKIP_PREDICTOR
+from visualization_agent import DEFAULT_FOLLOW_UPS
+from storage import session_store, problem_hash
+from problem_artifacts import problem_precomputer
+from sample_judge import sample_judge, format_report
+from retrieval_index import retrieval_index
+from code_versions import code_versions, artifact_digest, CODE_ARTIFACT_REUSE
+import deadlines
+from deadlines import BudgetedStream
+from complexity_analyzer import (COMPLEXITY_ANALYSES, analyze_complexity, format_complexity_answer,
+                                 format_complexity_hints, is_complexity_query)
+import request_context
 import openai
+from log_config import setup_logging, format_payload, log_payload
 
 # 配置日志
-logging.basicConfig(level=logging.INFO,
-                   format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 API_KEY = os.getenv('QWEN_API_KEY')
+BASE_URL = os.getenv('QWEN_BASE_URL', 'https://api-inference.modelscope.cn/v1')
+
+# 本地样例评测结果的缓存名称及有效期
+JUDGE_CACHE = "judge"
+JUDGE_TTL = 3600
+
+# 流式预测后续问题（设置OJ_PREDICTOR_STREAMING=0时等待完整预测结果）
+PREDICTOR_STREAMING = os.getenv('OJ_PREDICTOR_STREAMING', '1') != '0'
+
+# 时间不足以生成回答且没有可复用内容时的回答
+FALLBACK_ANSWER = "当前请求较多，暂时无法在限定时间内生成完整回答。你可以先说说自己的思路，或稍后再问一次。"
+TRUNCATED_NOTE = "\n\n（时间有限，回答先到这里，可以继续追问没有展开的部分。）"
+
+# 问题中出现这些词时，直接用本地样例评测结果回答
+JUDGE_HINTS = ("对不对", "对吗", "正确吗", "是否正确", "能过吗", "能不能过", "能通过", "过样例",
+               "有没有错", "哪里错", "跑一下", "测试一下", "测一下")
+
+
+def is_judge_query(query: str) -> bool:
+    """判断问题是否在询问代码能否通过样例"""
+    return any(hint in query for hint in JUDGE_HINTS)
 
 class TaskExecutor:
     def __init__(self):
-        self.problem_content = ""  # 存储题目内容
-        self.editor_code = ""      # 存储编辑区代码
-        self.assistant = self._create_assistant()
+        # 题目内容和编辑区代码按会话保存在共享存储中，执行器本身不持有会话状态
+        self.agents = AgentPool('executor', self._create_assistant)
         self.predictor = None      # 问题预测器
         self.client = openai.AsyncOpenAI(
             api_key=API_KEY,
-            base_url="https://api-inference.modelscope.cn/v1"
+            base_url=BASE_URL
         )
 
     def _create_assistant(self) -> ChatAgent:
@@ -37,7 +76,7 @@ class TaskExecutor:
                 model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
                 model_type="Qwen/Qwen2.5-72B-Instruct",
                 api_key=API_KEY,
-                url="https://api-inference.modelscope.cn/v1",
+                url=BASE_URL,
                 model_config_dict=QwenConfig(temperature=0.2).as_dict(),
             )
             
@@ -104,7 +143,8 @@ class TaskExecutor:
    - 引导学习者进行自我反思
 
 记住：你的目标是培养能够独立思考和解决问题的程序员，而不是简单地提供答案。通过引导式教学，帮助学习者建立起自己的知识体系和问题解决能力。"""
-            
+            output_guard.protect("executor", system_prompt)
+
             return ChatAgent(
                 system_message=system_prompt,
                 model=qwen_model,
@@ -115,42 +155,173 @@ class TaskExecutor:
             logger.error(f"创建AI助手时出错: {str(e)}")
             raise
 
-    async def _stream_chat(self, messages: list) -> AsyncGenerator[str, None]:
-        """使用OpenAI API进行流式对话"""
-        try:
-            stream = await self.client.chat.completions.create(
-                model="Qwen/Qwen2.5-72B-Instruct",
-                messages=messages,
-                stream=True
-            )
+    async def _stream_chat(self, messages: list, usage: Optional[Dict[str, int]] = None,
+                           max_tokens: Optional[int] = None, background: bool = False) -> AsyncGenerator[str, None]:
+        """使用OpenAI API进行流式对话，usage不为空时写入本次调用的token用量，max_tokens限制输出长度
+
+        上游出错时直接抛出，错误信息不会混入回答文本；background为True时按后台调用的低权重排队。
+        调用方提前关闭生成器（客户端断开、请求取消）时关闭上游流，释放上游并发。
+        """
+        async with fair_scheduler.async_slot(background=background):
+            stream = None
+            finished = False
+            try:
+                options = {"max_tokens": max_tokens} if max_tokens else {}
+                stream = await self.client.chat.completions.create(
+                    model="Qwen/Qwen2.5-72B-Instruct",
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **options
+                )
             
-            async for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
+                async for chunk in stream:
+                    # 最后一个块只携带用量信息，choices为空
+                    if chunk.usage is not None and usage is not None:
+                        usage['prompt_tokens'] = chunk.usage.prompt_tokens
+                        usage['completion_tokens'] = chunk.usage.completion_tokens
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+                finished = True
                     
-        except Exception as e:
-            logger.error(f"流式对话出错: {str(e)}")
-            yield f"出错: {str(e)}"
+            except Exception as e:
+                logger.error(f"流式对话出错: {str(e)}")
+                raise
+            finally:
+                close = getattr(stream, 'close', None)
+                if not finished and close is not None:
+                    await close()
+                    logger.info("已关闭上游流")
+
+    @property
+    def problem_content(self) -> str:
+        """当前会话的题目内容"""
+        return session_store.get_field(request_context.get_session_id(), 'problem_content', '')
+
+    @property
+    def editor_code(self) -> str:
+        """当前会话的编辑区代码"""
+        return session_store.get_field(request_context.get_session_id(), 'editor_code', '')
 
     def set_problem_content(self, content: str):
         """设置题目内容"""
-        self.problem_content = content
+        session_store.set_field(request_context.get_session_id(), 'problem_content', content)
         logger.info("已更新题目内容")
 
     def set_editor_code(self, code: str):
-        """设置编辑区代码"""
+        """设置编辑区代码，代码有变化时记录新版本"""
         if code.strip():  # 只有当代码不为空时才设置
-            self.editor_code = code
-            logger.info("已更新编辑区代码")
+            code_versions.update(code)
         else:
             logger.info("编辑区代码为空，跳过更新")
 
-    def _prepare_context(self, need_code: bool) -> str:
+    def _starter_questions(self, need_code: bool) -> Optional[list]:
+        """会话中针对某道题目的第一个问题不涉及代码时，复用预计算的初始预测问题"""
+        if need_code:
+            return None
+        problem_content = self.problem_content
+        session_id = request_context.get_session_id()
+        digest = problem_hash(problem_content)
+        if not problem_content.strip() or session_store.get_field(session_id, 'starter_questions_for') == digest:
+            return None
+        questions = problem_precomputer.lookup(problem_content, 'predicted_questions')
+        if questions:
+            session_store.set_field(session_id, 'starter_questions_for', digest)
+            record_cache_hit('predictor_stream', 'predict')
+            logger.info("使用预计算的预测问题")
+        return questions
+
+    def _judge_report(self, need_code: bool) -> Optional[Dict[str, Any]]:
+        """需要代码时用题目样例在本地评测编辑区代码，结果按题目和评测会执行的代码缓存
+
+        只改动了评测不会执行的函数、空白或注释时复用上一版代码的评测结果。
+        """
+        if not need_code:
+            return None
+        problem_content = self.problem_content
+        editor_code = self.editor_code
+        if not problem_content.strip() or not editor_code.strip():
+            return None
+        key = f"{problem_hash(problem_content)}:{artifact_digest(editor_code)}"
+        try:
+            report = session_store.cache_get(JUDGE_CACHE, key)
+            if report is not None:
+                CODE_ARTIFACT_REUSE.inc(artifact="judge")
+            else:
+                report = sample_judge.judge(editor_code, problem_content)
+                if report is not None:
+                    session_store.cache_set(JUDGE_CACHE, key, report, ttl=JUDGE_TTL)
+                    logger.info(f"本地样例评测完成: {report['passed']}/{report['total']} 通过")
+            return report
+        except Exception as e:
+            logger.error(f"本地样例评测时出错: {str(e)}")
+            return None
+
+    @staticmethod
+    def _judge_answer(report: Dict[str, Any]) -> str:
+        """用本地评测结果直接回答"""
+        answer = format_report(report)
+        if report['passed'] == report['total']:
+            return answer + "\n\n所有样例都通过了！不过样例通常比较小，你可以再想想边界情况和最大数据规模下的运行时间。"
+        return answer + "\n\n有样例没有通过。你可以先拿失败的样例，手动推演一遍代码的执行过程，看看从哪一步开始和预期不一样。"
+
+    def _analyze_complexity(self, need_code: bool) -> Optional[Dict[str, Any]]:
+        """需要代码时静态分析编辑区代码的时间复杂度，代码无法解析时返回None"""
+        if not need_code:
+            return None
+        try:
+            return analyze_complexity(self.editor_code)
+        except Exception as e:
+            logger.error(f"静态分析复杂度时出错: {str(e)}")
+            return None
+
+    def _direct_answer(self, query: str, need_code: bool, judge_report: Optional[Dict[str, Any]] = None,
+                       stage: str = 'executor') -> Optional[str]:
+        """本地评测或静态分析能可靠回答问题时直接给出回答，否则返回None，复用缓存的回答时按stage记录缓存命中"""
+        if judge_report and is_judge_query(query):
+            # 询问代码能否通过样例时，本地评测结果比模型推测更可靠
+            return self._judge_answer(judge_report)
+        if is_complexity_query(query):
+            analysis = self._analyze_complexity(need_code)
+            if analysis and analysis['confidence'] == 'high':
+                COMPLEXITY_ANALYSES.inc(result="direct")
+                logger.info(f"静态分析直接回答复杂度问题: {analysis['time']}")
+                return format_complexity_answer(analysis)
+        if need_code:
+            # 代码没有实质改动时，同一会话中的相同问题复用上次的回答
+            answer = code_versions.cached_answer(self.problem_content, self.editor_code, query)
+            if answer:
+                record_cache_hit(stage, 'proceed')
+                logger.info("代码未实质改动，复用上次的回答")
+                return answer
+        else:
+            # 与代码无关的问题，同一题目下问过几乎相同的问题时复用历史回答
+            document = retrieval_index.match(self.problem_content, query)
+            if document:
+                record_cache_hit(stage, 'proceed')
+                logger.info(f"复用历史回答: {format_payload(document['question'], 100)}")
+                return document['text']
+        return None
+
+    def _prepare_context(self, need_code: bool, judge_report: Optional[Dict[str, Any]] = None,
+                         query: str = "") -> str:
         """根据需求准备上下文"""
         context = f"题目内容:\n{self.problem_content}\n\n"
+        snippets = retrieval_index.snippets(self.problem_content, query) if query else []
+        if snippets:
+            context += "本题相关的历史讲解片段（仅供参考）:\n" + "\n".join(f"- {s}" for s in snippets) + "\n\n"
         
-        if need_code and self.editor_code:
-            context += f"用户代码:\n{self.editor_code}\n\n"
+        editor_code = self.editor_code if need_code else ''
+        if editor_code:
+            # 与上一版代码相比只改动少量函数时，只放上一版代码的摘要和改动
+            code_text, _ = code_versions.prompt_code(editor_code, query)
+            context += f"{code_text}\n\n"
+        if judge_report:
+            context += f"{format_report(judge_report)}\n\n"
+        analysis = self._analyze_complexity(need_code)
+        if analysis:
+            COMPLEXITY_ANALYSES.inc(result="hint")
+            context += f"{format_complexity_hints(analysis)}\n\n"
             
         context += f"请根据以上内容提供帮助。"
             
@@ -159,20 +330,27 @@ class TaskExecutor:
     def execute_task(self, query: str, need_code: bool) -> Dict[str, Any]:
         """执行具体任务"""
         try:
-            # 准备任务上下文
-            context = self._prepare_context(need_code)
-            full_query = f"{context}\n\n用户问题: {query}"
-            
+            judge_report = self._judge_report(need_code)
             logger.info(f"执行任务 - 需要代码: {need_code}")
-            
-            # 获取AI响应
-            response = self.assistant.step(full_query)
-            self.assistant.reset()  # 重置会话状态
-            
-            if not response or not response.msgs:
-                raise ValueError("AI助手没有返回任何响应")
 
-            task_response = response.msgs[0].content
+            task_response = self._direct_answer(query, need_code, judge_report)
+            if task_response is None:
+                # 准备任务上下文
+                context = self._prepare_context(need_code, judge_report, query)
+                full_query = f"{context}\n\n用户问题: {query}"
+
+                # 获取AI响应
+                with StageTimer('executor', action='proceed') as timer:
+                    with fair_scheduler.slot(), self.agents.agent() as agent:
+                        response = agent.step(full_query)
+                    timer.mark_first_token()
+                    timer.record_tokens(*camel_usage(response))
+                    usage_ledger.record_response('executor', response)
+
+                    if not response or not response.msgs:
+                        raise ValueError("AI助手没有返回任何响应")
+
+                task_response = response.msgs[0].content
                 
             # 预测可能的后续问题
             if self.predictor is None:
@@ -185,21 +363,30 @@ class TaskExecutor:
                 'query': query
             }
             
-            logger.info("开始预测后续问题...")
-            next_questions = self.predictor.predict_next_questions(
-                current_context=current_context,
-                task_response=task_response
-            )
-            logger.info(f"预测到 {len(next_questions)} 个问题")
+            degraded = []
+            if load_controller.level() >= SKIP_PREDICTOR:
+                degraded.append(load_controller.degrade('predictor', 'static_follow_ups')['data'])
+                next_questions = list(DEFAULT_FOLLOW_UPS)
+            elif deadlines.can_run('predictor'):
+                logger.info("开始预测后续问题...")
+                next_questions = self.predictor.predict_next_questions(
+                    current_context=current_context,
+                    task_response=task_response
+                )
+                logger.info(f"预测到 {len(next_questions)} 个问题")
+            else:
+                degraded.append(deadlines.degrade('predictor', 'skipped')['data'])
+                next_questions = []
             
             result = {
                 "success": True,
                 "response": task_response,
                 "need_code": need_code,
-                "predicted_questions": next_questions
+                "predicted_questions": next_questions,
+                "degraded": degraded
             }
             
-            logger.info(f"完整结果: {result}")
+            log_payload(logger, "完整结果", result)
             return result
             
         except Exception as e:
@@ -211,25 +398,139 @@ class TaskExecutor:
                 "predicted_questions": []
             }
 
-    async def execute_task_stream(self, query: str, need_code: bool):
-        """流式执行任务"""
+    def _build_messages(self, query: str, need_code: bool, judge_report: Optional[Dict[str, Any]] = None) -> list:
+        """构建流式对话的消息"""
+        context = self._prepare_context(need_code, judge_report, query)
+        full_query = f"{context}\n\n用户问题: {query}"
+        return [
+            {"role": "assistant", "content": full_query}
+        ]
+
+    async def prefetch_answer(self, query: str) -> str:
+        """为预测的后续问题预先生成完整回答（只预取与代码无关的问题，上下文与实时回答相同），
+        以后台低优先级排队，用量按cache=prefetch记账"""
+        messages = self._build_messages(query, False)
+        with StageTimer('prefetch', action='proceed', cache='prefetch') as timer:
+            usage: Dict[str, int] = {}
+            parts = []
+            async with aclosing(self._stream_chat(messages, usage=usage, background=True)) as chunks:
+                async for chunk in chunks:
+                    timer.mark_first_token()
+                    parts.append(chunk)
+            timer.record_tokens(usage.get('prompt_tokens'), usage.get('completion_tokens', len(parts)))
+            usage_ledger.record('executor', usage.get('prompt_tokens'), usage.get('completion_tokens', len(parts)),
+                                cache='prefetch')
+        return "".join(parts)
+
+    def fallback_answer(self, query: str) -> str:
+        """时间不足以生成回答时，用本题相关的历史回答、题解或预计算的解题思路作简短回答"""
+        problem_content = self.problem_content
+        for document in retrieval_index.search(problem_content, query, k=1, kinds=("answer", "editorial")):
+            if document['coverage'] >= retrieval_index.min_coverage:
+                return document['text']
+        artifacts = problem_precomputer.get(problem_content)
+        if artifacts and artifacts.get('approach'):
+            return "时间有限，先给出本题的解题思路要点：\n" + problem_precomputer.editorial_text(artifacts)
+        return FALLBACK_ANSWER
+
+    async def _stream_answer(self, query: str, need_code: bool, judge_report: Optional[Dict[str, Any]] = None,
+                             budget: Optional[float] = None) -> AsyncGenerator[Dict[str, Any], None]:
+        """流式获取AI响应，budget为本阶段可用的秒数，预算较短时限制输出长度，超时后截断
+
+        上游出错时输出error事件（调用方据此把本轮标记为失败，不写入索引和回答缓存）。
+        """
+        messages = self._build_messages(query, need_code, judge_report)
+        max_tokens = deadlines.answer_max_tokens(budget)
+        if max_tokens:
+            yield deadlines.degrade('answer', 'short_answer')
+        load_max_tokens = load_controller.answer_max_tokens()
+        if load_max_tokens and (not max_tokens or load_max_tokens < max_tokens):
+            # 负载较高时缩短回答，减少每个请求占用上游的时间
+            max_tokens = load_max_tokens
+            yield load_controller.degrade('answer', 'short_answer')
+        with StageTimer('executor_stream', action='proceed') as timer:
+            usage: Dict[str, int] = {}
+            chunk_count = 0
+            try:
+                async with aclosing(self._stream_chat(messages, usage=usage, max_tokens=max_tokens)) as chunks:
+                    budgeted = BudgetedStream(chunks, budget)
+                    async for chunk in budgeted:
+                        timer.mark_first_token()
+                        chunk_count += 1
+                        # 只含空白的片段（代码缩进、换行）也要原样发送
+                        yield {
+                            "type": "content",
+                            "data": chunk
+                        }
+            except (asyncio.CancelledError, GeneratorExit):
+                # 客户端断开，已生成的token作废
+                CANCELLED_TOKENS.inc(chunk_count, role='executor')
+                usage_ledger.record('executor', None, chunk_count, cache='cancelled')
+                raise
+            except Exception as e:
+                timer.set_error(e)
+                timer.record_tokens(tokens_out=chunk_count)
+                usage_ledger.record('executor', None, chunk_count)
+                yield {
+                    "type": "error",
+                    "data": f"生成回答时出错: {str(e)}"
+                }
+                return
+            if usage:
+                timer.record_tokens(usage.get('prompt_tokens'), usage.get('completion_tokens'))
+                usage_ledger.record('executor', usage.get('prompt_tokens'), usage.get('completion_tokens'))
+            else:
+                # 上游未返回用量（或超时截断）时，以增量块数近似输出token数
+                timer.record_tokens(tokens_out=chunk_count)
+                usage_ledger.record('executor', None, chunk_count)
+
+        if budgeted.expired and chunk_count == 0:
+            yield deadlines.degrade('answer', 'cached_answer')
+            yield {
+                "type": "content",
+                "data": self.fallback_answer(query)
+            }
+        elif budgeted.expired:
+            yield deadlines.degrade('answer', 'truncated')
+            yield {
+                "type": "content",
+                "data": TRUNCATED_NOTE
+            }
+
+    async def execute_task_stream(self, query: str, need_code: bool, prefetched: Optional[str] = None):
+        """流式执行任务，prefetched不为空时直接输出预取的回答"""
         try:
-            # 准备任务上下文
-            context = self._prepare_context(need_code)
-            full_query = f"{context}\n\n用户问题: {query}"
-            
             logger.info(f"开始流式执行任务 - 需要代码: {need_code}")
-            
-            # 流式获取AI响应
-            messages = [
-                {"role": "assistant", "content": full_query}
-            ]
-            async for chunk in self._stream_chat(messages):
-                if chunk.strip():
-                    yield {
-                        "type": "content",
-                        "data": chunk
-                    }
+
+            # 评测在线程池中进行，复制上下文使会话在线程中可见
+            loop = asyncio.get_running_loop()
+            judge_report = await loop.run_in_executor(None, contextvars.copy_context().run,
+                                                      self._judge_report, need_code)
+
+            direct_answer = self._direct_answer(query, need_code, judge_report, 'executor_stream')
+            if direct_answer:
+                yield {
+                    "type": "content",
+                    "data": direct_answer
+                }
+            elif prefetched:
+                record_cache_hit('executor_stream', 'proceed')
+                logger.info("使用预取的回答")
+                yield {
+                    "type": "content",
+                    "data": prefetched
+                }
+            elif not deadlines.can_run('answer'):
+                yield deadlines.degrade('answer', 'cached_answer')
+                yield {
+                    "type": "content",
+                    "data": self.fallback_answer(query)
+                }
+            else:
+                async with aclosing(self._stream_answer(query, need_code, judge_report,
+                                                        deadlines.stage_budget('answer'))) as events:
+                    async for event in events:
+                        yield event
             
             # 预测可能的后续问题
             if self.predictor is None:
@@ -242,11 +543,39 @@ class TaskExecutor:
                 'query': query
             }
             
-            logger.info("开始预测后续问题...")
-            next_questions = self.predictor.predict_next_questions(
-                current_context=current_context,
-                task_response=""  # 流式输出时无法获取完整响应
-            )
+            next_questions = self._starter_questions(need_code)
+            if next_questions is None and load_controller.level() >= SKIP_PREDICTOR:
+                # 负载较高时不调用预测器，使用固定的后续问题
+                yield load_controller.degrade('predictor', 'static_follow_ups')
+                next_questions = list(DEFAULT_FOLLOW_UPS)
+            elif next_questions is None and not deadlines.can_run('predictor'):
+                # 剩余时间不够预测，先保证回答按时送达
+                yield deadlines.degrade('predictor', 'skipped')
+                next_questions = []
+            elif next_questions is None and PREDICTOR_STREAMING:
+                # 每解析出一个问题就发送，界面无需等待全部预测完成
+                logger.info("开始流式预测后续问题...")
+                next_questions = []
+                try:
+                    async with aclosing(self.predictor.stream_next_questions(
+                            current_context=current_context, task_response="")) as stream:
+                        predictions = BudgetedStream(stream, deadlines.stage_budget('predictor'))
+                        async for prediction in predictions:
+                            next_questions.append(prediction)
+                            yield {
+                                "type": "predicted_question",
+                                "data": prediction
+                            }
+                    if predictions.expired:
+                        yield deadlines.degrade('predictor', 'truncated')
+                except Exception as e:
+                    logger.error(f"流式预测后续问题时出错: {str(e)}")
+            elif next_questions is None:
+                logger.info("开始预测后续问题...")
+                # 同步预测在线程中等待上游名额，不能阻塞事件循环（流式输出时无法获取完整响应）
+                next_questions = await loop.run_in_executor(None, contextvars.copy_context().run,
+                                                            self.predictor.predict_next_questions,
+                                                            current_context, "")
             
             # 发送预测的问题
             yield {
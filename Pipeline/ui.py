@@ -1,16 +1,32 @@
+import os
 import streamlit as st
 import requests
 import json
+import uuid
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator, List
+from render_throttle import RenderThrottle
+from log_config import setup_logging
 
 # 配置日志
-logging.basicConfig(level=logging.INFO,
-                   format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # API配置
 API_URL = "http://localhost:5001"
+WS_URL = API_URL.replace("http", "ws", 1) + "/api/ws"
+# 请求的端到端时间预算（秒），服务端据此为各阶段分配时间
+REQUEST_BUDGET_SECONDS = 25
+# 与服务端的连接方式：ws为持久WebSocket会话（连接失败时退回SSE），sse为每个问题一个HTTP请求
+UI_TRANSPORT = os.getenv('OJ_UI_TRANSPORT', 'ws')
+# WebSocket会话中未确认消息的窗口
+WS_WINDOW = 32
+
+def get_session_id() -> str:
+    """获取当前浏览器会话的ID"""
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    return st.session_state.session_id
 
 def create_response_containers():
     """创建用于显示响应的容器"""
@@ -22,60 +38,189 @@ def create_response_containers():
         }
     return st.session_state.response_containers
 
-def process_stream_response(response: requests.Response, containers: Dict):
-    """处理流式响应"""
-    intent_shown = False
-    task_response = ""
-    
+def sse_events(response: requests.Response) -> Iterator[Dict[str, Any]]:
+    """逐个解析SSE响应中的事件"""
+    for line in response.iter_lines():
+        if line:
+            line = line.decode('utf-8')
+            if line.startswith("data: "):
+                try:
+                    yield json.loads(line[6:])
+                except json.JSONDecodeError as e:
+                    logger.error(f"JSON解析错误: {str(e)}")
+                    st.error("解析响应时出错")
+
+
+def code_patch(old: str, new: str) -> Optional[Dict[str, Any]]:
+    """把代码改动表示为一个按行替换的补丁（去掉首尾相同的行），没有改动时返回None"""
+    if old == new:
+        return None
+    old_lines, new_lines = old.split("\n"), new.split("\n")
+    prefix = 0
+    while prefix < min(len(old_lines), len(new_lines)) and old_lines[prefix] == new_lines[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < min(len(old_lines), len(new_lines)) - prefix and \
+            old_lines[-1 - suffix] == new_lines[-1 - suffix]:
+        suffix += 1
+    return {
+        "start": prefix + 1,
+        "end": len(old_lines) - suffix + 1,
+        "lines": new_lines[prefix:len(new_lines) - suffix]
+    }
+
+
+def get_ws_session():
+    """获取当前浏览器会话的WebSocket连接，首次调用时建立连接并发送hello"""
+    ws = st.session_state.get("ws")
+    if ws is None:
+        from websockets.sync.client import connect
+        ws = connect(WS_URL, open_timeout=5)
+        ws.send(json.dumps({"type": "hello", "session_id": get_session_id(), "window": WS_WINDOW}))
+        ready = json.loads(ws.recv(timeout=5))
+        st.session_state.ws = ws
+        st.session_state.ws_state = {"problem_content": "", "editor_code": "",
+                                     "code_version": ready["data"]["code_version"]}
+    return ws
+
+
+def ws_messages(ws) -> Iterator[Dict[str, Any]]:
+    """逐条接收WebSocket消息，确认带序号的消息"""
+    while True:
+        message = json.loads(ws.recv(timeout=30))
+        if "seq" in message:
+            ws.send(json.dumps({"type": "ack", "seq": message["seq"]}))
+        yield message
+
+
+def ws_send_context(ws, problem_content: str, editor_code: str):
+    """题目或代码有变化时才发送，代码只发送改动的行
+
+    补丁被拒绝（版本冲突等）时重新发送一次完整代码，仍被拒绝时抛出异常，调用方本次改用SSE。
+    """
+    state = st.session_state.ws_state
+    if problem_content != state["problem_content"]:
+        ws.send(json.dumps({"type": "problem", "problem_content": problem_content}, ensure_ascii=False))
+        state["problem_content"] = problem_content
+    patch = code_patch(state["editor_code"], editor_code)
+    if patch is None:
+        return
+    ws.send(json.dumps({"type": "code_patch", "base_version": state["code_version"], **patch}, ensure_ascii=False))
+    resent = False
+    for message in ws_messages(ws):
+        if message["type"] == "code_ack":
+            state["editor_code"], state["code_version"] = editor_code, message["data"]["version"]
+            return
+        if message["type"] == "error":
+            if resent:
+                raise RuntimeError(f"服务端拒绝了代码: {message.get('data')}")
+            ws.send(json.dumps({"type": "code", "editor_code": editor_code}, ensure_ascii=False))
+            resent = True
+
+
+def ws_events(ws, query: str) -> Iterator[Dict[str, Any]]:
+    """在WebSocket会话中提问，逐个产出本问题的事件；中途停止读取时取消该问题"""
+    question_id = uuid.uuid4().hex[:8]
+    ws.send(json.dumps({"type": "ask", "id": question_id, "query": query,
+                        "timeout": REQUEST_BUDGET_SECONDS}, ensure_ascii=False))
+    done = False
     try:
-        for line in response.iter_lines():
-            if line:
-                line = line.decode('utf-8')
-                if line.startswith("data: "):
-                    try:
-                        data = json.loads(line[6:])
-                        
-                        # 处理意图分析结果
-                        if data["type"] == "intent" and not intent_shown:
-                            intent_result = data["data"]
-                            containers["intent"].markdown(f"""
-                            ### 意图分析结果
-                            - 意图: {intent_result['intent']}
-                            - 安全性: {'安全' if intent_result['safe'] else '不安全'}
-                            - 操作: {intent_result['action']}
-                            - 需要代码: {'是' if intent_result['need_code'] else '否'}
-                            - 响应: {intent_result['response']}
-                            """)
-                            intent_shown = True
-                        
-                        # 处理任务执行结果
-                        elif data["type"] == "content":
-                            task_response += data["data"]
-                            containers["task"].markdown(f"""
+        for message in ws_messages(ws):
+            if message.get("id") != question_id:
+                continue
+            if message["type"] == "done":
+                done = True
+                return
+            yield message
+    finally:
+        if not done:
+            try:
+                ws.send(json.dumps({"type": "cancel", "id": question_id}))
+            except Exception:
+                st.session_state.pop("ws", None)
+
+
+def process_stream_response(events: Iterator[Dict[str, Any]], containers: Dict):
+    """处理流式响应的事件"""
+    intent_shown = False
+
+    def render_task(task_response: str):
+        containers["task"].markdown(f"""
                             ### 任务执行结果
                             {task_response}
                             """)
-                        
-                        # 处理预测的问题
-                        elif data["type"] == "predicted_questions":
-                            questions = data["data"]
-                            if questions:
-                                questions_md = "### 预测的后续问题\n"
-                                for q in questions:
-                                    questions_md += f"- {q['question']}\n"
-                                containers["questions"].markdown(questions_md)
-                        
-                        # 处理错误
-                        elif data["type"] == "error":
-                            st.error(f"发生错误: {data['data']}")
-                            
-                    except json.JSONDecodeError as e:
-                        logger.error(f"JSON解析错误: {str(e)}")
-                        st.error("解析响应时出错")
-                        
+
+    def render_questions(questions: List[Dict[str, str]]):
+        if questions:
+            questions_md = "### 预测的后续问题\n"
+            for q in questions:
+                questions_md += f"- {q['question']}\n"
+            containers["questions"].markdown(questions_md)
+
+    # 合并流式片段后再重绘，避免每个片段都重绘整段markdown
+    task_render = RenderThrottle(render_task)
+    streamed_questions = []
+    
+    try:
+        for data in events:
+            # 处理意图分析结果
+            if data["type"] == "intent" and not intent_shown:
+                intent_result = data["data"]
+                containers["intent"].markdown(f"""
+                ### 意图分析结果
+                - 意图: {intent_result['intent']}
+                - 安全性: {'安全' if intent_result['safe'] else '不安全'}
+                - 操作: {intent_result['action']}
+                - 需要代码: {'是' if intent_result['need_code'] else '否'}
+                - 响应: {intent_result['response']}
+                """)
+                intent_shown = True
+
+            # 处理任务执行结果
+            elif data["type"] == "content":
+                task_render.append(data["data"])
+
+            # 处理逐个到达的预测问题
+            elif data["type"] == "predicted_question":
+                task_render.flush()
+                streamed_questions.append(data["data"])
+                render_questions(streamed_questions)
+
+            # 处理预测的问题
+            elif data["type"] == "predicted_questions":
+                task_render.flush()
+                render_questions(data["data"])
+
+            # 处理降级提示
+            elif data["type"] == "degraded":
+                degraded = data["data"]
+                st.caption(f"为按时返回已简化处理（{degraded['stage']}: {degraded['decision']}）")
+
+            # 处理排队位置，意图分析结果显示后不再提示
+            elif data["type"] == "queued":
+                if not intent_shown:
+                    containers["intent"].info(f"当前提问较多，正在排队（第{data['data']['position']}位）")
+
+            # 处理负载降级等级
+            elif data["type"] == "load":
+                st.caption(f"当前提问较多，回答会适当简化（负载等级 {data['data']['level']}）")
+
+            # 处理超出配额或负载过高的拒绝
+            elif data["type"] == "rejected":
+                rejected = data["data"]
+                st.warning(f"{rejected['message']}（约{rejected['retry_after_seconds']}秒后可再问）")
+
+            # 处理错误
+            elif data["type"] == "error":
+                task_render.flush()
+                st.error(f"发生错误: {data['data']}")
+
     except Exception as e:
         logger.error(f"处理流式响应时出错: {str(e)}")
         st.error(f"处理响应时出错: {str(e)}")
+    finally:
+        task_render.flush()
+        logger.info(f"回答渲染统计: {task_render.stats()}")
 
 def main():
     # 标题
@@ -163,23 +308,38 @@ if __name__ == '__main__':
             try:
                 # 发送流式请求
                 with st.spinner("正在处理..."):
-                    response = requests.post(
-                        f"{API_URL}/api/analyze/stream",
-                        json={
-                            "query": query,
-                            "problem_content": problem_content,
-                            "editor_code": editor_code
-                        },
-                        stream=True,
-                        timeout=30
-                    )
-                    
-                    if response.status_code == 200:
-                        # 处理流式响应
-                        process_stream_response(response, containers)
+                    ws = None
+                    if UI_TRANSPORT == "ws":
+                        try:
+                            ws = get_ws_session()
+                            ws_send_context(ws, problem_content, editor_code)
+                        except Exception as e:
+                            # 服务端不支持WebSocket或连接已断开时本次改用SSE，下次提问重新连接
+                            logger.warning(f"WebSocket会话不可用，改用SSE: {str(e)}")
+                            st.session_state.pop("ws", None)
+                            ws = None
+                    if ws is not None:
+                        process_stream_response(ws_events(ws, query), containers)
                     else:
-                        st.error(f"请求失败: {response.status_code}")
-                        
+                        # 脚本重新运行或页面关闭时及时关闭连接，服务端据此取消请求
+                        with requests.post(
+                            f"{API_URL}/api/analyze/stream",
+                            json={
+                                "query": query,
+                                "problem_content": problem_content,
+                                "editor_code": editor_code,
+                                "session_id": get_session_id()
+                            },
+                            headers={"X-Request-Timeout": str(REQUEST_BUDGET_SECONDS)},
+                            stream=True,
+                            timeout=30
+                        ) as response:
+                            if response.status_code == 200:
+                                # 处理流式响应
+                                process_stream_response(sse_events(response), containers)
+                            else:
+                                st.error(f"请求失败: {response.status_code}")
+
             except requests.exceptions.Timeout:
                 st.error("请求超时，请重试")
             except requests.exceptions.RequestException as e:
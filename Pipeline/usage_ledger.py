@@ -0,0 +1,148 @@
+import os
+import csv
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterable, List, Optional
+import request_context
+from metrics import camel_usage
+from log_config import setup_logging
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# 支持的角色
+ROLES = ("intent", "executor", "mermaid", "visualize", "predictor", "precompute")
+
+RECORD_FIELDS = ["timestamp", "session_id", "user_id", "role", "cache",
+                 "prompt_tokens", "completion_tokens", "total_tokens"]
+
+
+class UsageLedger:
+    def __init__(self, max_records: int = 100000, max_groups: int = 50000):
+        """初始化用量账本
+
+        明细记录保留最近max_records条；按会话/用户/角色/缓存的汇总保留最近有用量的max_groups组，
+        长期不活跃的会话先被淘汰。
+        """
+        self._records: deque = deque(maxlen=max_records)
+        self._totals: "OrderedDict[tuple, Dict[str, int]]" = OrderedDict()
+        self.max_groups = max_groups
+        self._lock = threading.Lock()
+        self._sinks = []
+
+    def add_sink(self, sink):
+        """注册记录回调，每条用量记录写入后调用sink(record)"""
+        self._sinks.append(sink)
+
+    def record(self, role: str, prompt_tokens: Optional[int], completion_tokens: Optional[int],
+               cache: str = "miss", session_id: Optional[str] = None,
+               user_id: Optional[str] = None) -> Dict[str, Any]:
+        """记录一次上游调用的token用量"""
+        prompt_tokens = int(prompt_tokens or 0)
+        completion_tokens = int(completion_tokens or 0)
+        record = {
+            "timestamp": time.time(),
+            "session_id": session_id or request_context.get_session_id(),
+            "user_id": user_id or request_context.get_user_id(),
+            "role": role,
+            "cache": cache,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+        key = (record["session_id"], record["user_id"], role, cache)
+        with self._lock:
+            self._records.append(record)
+            totals = self._totals.get(key)
+            if totals is None:
+                totals = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+                self._totals[key] = totals
+                while len(self._totals) > self.max_groups:
+                    self._totals.popitem(last=False)
+            else:
+                self._totals.move_to_end(key)
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+            totals["total_tokens"] += record["total_tokens"]
+
+        for sink in self._sinks:
+            try:
+                sink(record)
+            except Exception as e:
+                logger.error(f"用量记录回调出错: {str(e)}")
+        return record
+
+    def record_response(self, role: str, response, cache: str = "miss") -> Dict[str, Any]:
+        """记录camel ChatAgent响应中的用量"""
+        prompt_tokens, completion_tokens = camel_usage(response)
+        return self.record(role, prompt_tokens, completion_tokens, cache=cache)
+
+    def query(self, session_id: Optional[str] = None, user_id: Optional[str] = None,
+              role: Optional[str] = None, since: Optional[float] = None) -> List[Dict[str, Any]]:
+        """按条件查询明细记录"""
+        with self._lock:
+            records = list(self._records)
+        return [
+            r for r in records
+            if (session_id is None or r["session_id"] == session_id)
+            and (user_id is None or r["user_id"] == user_id)
+            and (role is None or r["role"] == role)
+            and (since is None or r["timestamp"] >= since)
+        ]
+
+    def summary(self, group_by: Iterable[str] = ("session_id", "role"),
+                session_id: Optional[str] = None, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """按指定维度汇总用量（维度可选session_id/user_id/role/cache）"""
+        group_by = tuple(group_by)
+        index = {"session_id": 0, "user_id": 1, "role": 2, "cache": 3}
+        groups: Dict[tuple, Dict[str, Any]] = {}
+        with self._lock:
+            items = list(self._totals.items())
+        for key, totals in items:
+            if session_id is not None and key[0] != session_id:
+                continue
+            if user_id is not None and key[1] != user_id:
+                continue
+            group_key = tuple(key[index[name]] for name in group_by)
+            group = groups.get(group_key)
+            if group is None:
+                group = dict(zip(group_by, group_key))
+                group.update({"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0})
+                groups[group_key] = group
+            for field in ("calls", "prompt_tokens", "completion_tokens", "total_tokens"):
+                group[field] += totals[field]
+        return sorted(groups.values(), key=lambda g: g["total_tokens"], reverse=True)
+
+    def total_tokens(self, session_id: Optional[str] = None, user_id: Optional[str] = None) -> int:
+        """统计会话或用户累计消耗的token数（用于配额判断）"""
+        return sum(g["total_tokens"] for g in self.summary((), session_id=session_id, user_id=user_id))
+
+    def export_jsonl(self, path: str, **filters) -> int:
+        """导出明细为JSONL文件，返回导出条数"""
+        records = self.query(**filters)
+        with open(path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        logger.info(f"已导出 {len(records)} 条用量记录到 {path}")
+        return len(records)
+
+    def export_csv(self, path: str, **filters) -> int:
+        """导出明细为CSV文件，返回导出条数"""
+        records = self.query(**filters)
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=RECORD_FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+        logger.info(f"已导出 {len(records)} 条用量记录到 {path}")
+        return len(records)
+
+# 创建全局用量账本实例
+usage_ledger = UsageLedger(
+    max_records=int(os.getenv('OJ_USAGE_MAX_RECORDS', '100000')),
+    max_groups=int(os.getenv('OJ_USAGE_MAX_GROUPS', '50000'))
+)
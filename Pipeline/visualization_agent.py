@@ -7,10 +7,16 @@ from camel.models import ModelFactory
 from camel.types.enums import ModelType, ModelPlatformType
 from camel.agents import ChatAgent
 from next_question_predictor import init_predictor
+from metrics import StageTimer, camel_usage
+from usage_ledger import usage_ledger
+from output_guard import output_guard
+from fair_scheduler import fair_scheduler
+from agent_pool import AgentPool
+from load_controller import load_controller, SKIP_PREDICTOR
+from log_config import setup_logging, format_payload
 
 # 配置日志
-logging.basicConfig(level=logging.INFO,
-                   format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 logger = logging.getLogger(__name__)
 
 VISUALIZATION_PROMPT = """
@@ -38,10 +44,19 @@ VISUALIZATION_PROMPT = """
 
 这就像在图书馆整理书架，先按一个标准（如书的厚度）大致分类，然后再细分，最后就能得到整齐的书架。
 """
+# 示例允许模型照着输出，只保护指令部分
+output_guard.protect("visualize", VISUALIZATION_PROMPT.split("示例：")[0])
+
+# 预测器没有返回问题或负载较高跳过预测时的后续问题
+DEFAULT_FOLLOW_UPS = [
+    {"question": "能再举一个生活中的例子来解释这个概念吗？"},
+    {"question": "如果遇到更复杂的情况，这个解释还适用吗？"},
+    {"question": "这个类比和实际的代码实现有什么对应关系？"}
+]
 
 class VisualizationAgent:
     def __init__(self):
-        self.ai_assistant = self._create_ai_assistant()
+        self.agents = AgentPool('visualize', self._create_ai_assistant)
         self.predictor = None  # 问题预测器
         load_dotenv()
         self.api_key = os.getenv('QWEN_API_KEY')
@@ -52,12 +67,13 @@ class VisualizationAgent:
             logger.info("正在创建可视化AI助手...")
             load_dotenv()
             API_KEY = os.getenv('QWEN_API_KEY')
+            BASE_URL = os.getenv('QWEN_BASE_URL', 'https://api-inference.modelscope.cn/v1')
             
             qwen_model = ModelFactory.create(
                 model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
                 model_type="Qwen/Qwen2.5-72B-Instruct",
                 api_key=API_KEY,
-                url="https://api-inference.modelscope.cn/v1",
+                url=BASE_URL,
                 model_config_dict=QwenConfig(temperature=0.7).as_dict(),
             )
 
@@ -76,19 +92,33 @@ class VisualizationAgent:
     def visualize(self, query: str) -> Dict[str, Any]:
         """生成生动形象的解释"""
         try:
-            logger.info(f"正在生成可视化解释: {query}")
-            response = self.ai_assistant.step(query)
-            self.ai_assistant.reset()
-            
-            if not response or not response.msgs:
-                logger.warning("模型没有返回任何消息")
+            logger.info(f"正在生成可视化解释: {format_payload(query, 200)}")
+            with StageTimer('visualize', action='visualize') as timer:
+                with fair_scheduler.slot(), self.agents.agent() as agent:
+                    response = agent.step(query)
+                timer.mark_first_token()
+                timer.record_tokens(*camel_usage(response))
+                usage_ledger.record_response('visualize', response)
+
+                if not response or not response.msgs:
+                    logger.warning("模型没有返回任何消息")
+                    timer.set_error("empty_response")
+                    return {
+                        'success': False,
+                        'response': "生成解释失败，请重试",
+                        'predicted_questions': []
+                    }
+
+            explanation = response.msgs[0].content.strip()
+
+            if load_controller.level() >= SKIP_PREDICTOR:
+                # 负载较高时不再调用预测器
                 return {
-                    'success': False,
-                    'response': "生成解释失败，请重试",
-                    'predicted_questions': []
+                    'success': True,
+                    'response': explanation,
+                    'predicted_questions': list(DEFAULT_FOLLOW_UPS),
+                    'degraded': [load_controller.degrade('predictor', 'static_follow_ups')['data']]
                 }
-                
-            explanation = response.msgs[0].content.strip()
             
             # 预测可能的后续问题
             if self.predictor is None:
@@ -111,11 +141,7 @@ class VisualizationAgent:
             
             # 如果预测器没有返回问题，生成默认的后续问题
             if not next_questions:
-                next_questions = [
-                    {"question": "能再举一个生活中的例子来解释这个概念吗？"},
-                    {"question": "如果遇到更复杂的情况，这个解释还适用吗？"},
-                    {"question": "这个类比和实际的代码实现有什么对应关系？"}
-                ]
+                next_questions = list(DEFAULT_FOLLOW_UPS)
             
             return {
                 'success': True,
@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from contextlib import aclosing
+from typing import Any, Dict, List, Optional
+from fastapi import WebSocket, WebSocketDisconnect
+from recognition_server import recognition_server
+from answer_prefetcher import answer_prefetcher
+from fair_scheduler import fair_scheduler
+from output_guard import output_guard
+from request_profiler import request_profiler
+from stream_framer import StreamFramer
+from metrics import registry
+import request_context
+import deadlines
+from log_config import setup_logging, format_payload
+
+# 配置日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# 每个连接同时处理的问题数上限
+WS_MAX_INFLIGHT = int(os.getenv('OJ_WS_MAX_INFLIGHT', '2'))
+# 客户端声明的未确认消息窗口上限
+WS_MAX_WINDOW = int(os.getenv('OJ_WS_MAX_WINDOW', '256'))
+# 单条客户端消息的字节数上限
+WS_MAX_MESSAGE_BYTES = int(os.getenv('OJ_WS_MAX_MESSAGE_BYTES', str(256 * 1024)))
+
+WS_SESSIONS = registry.gauge(
+    "oj_agent_ws_sessions", "当前的WebSocket会话数")
+WS_MESSAGES = registry.counter(
+    "oj_agent_ws_messages_total", "WebSocket消息数", ["direction", "type"])
+WS_WINDOW_WAIT = registry.histogram(
+    "oj_agent_ws_window_wait_seconds", "等待客户端确认消息（背压）的时间")
+
+
+class ProtocolError(Exception):
+    """客户端消息不符合协议"""
+
+
+def apply_patch(code: str, start: int, end: int, lines: List[str]) -> str:
+    """用lines替换代码的第start行到第end-1行（行号从1开始），start == end时在第start行前插入"""
+    current = code.split("\n")
+    if not 1 <= start <= end <= len(current) + 1:
+        raise ProtocolError(f"补丁行号超出范围: {start}-{end}")
+    return "\n".join(current[:start - 1] + [str(line) for line in lines] + current[end - 1:])
+
+
+class WebSocketSession:
+    def __init__(self, websocket: WebSocket):
+        """一个WebSocket连接上的持久会话
+
+        连接建立后题目和代码保存在会话中，之后只需发送问题和代码补丁。每个问题的事件带上问题ID，
+        回答片段与SSE接口一样合并后发送；客户端可随时取消某个问题。客户端在hello中声明window时，
+        未确认的问题事件达到window条后暂停读取回答，上游流随之放慢（背压）。
+        """
+        self.websocket = websocket
+        self.session_id = request_context.new_request_id()
+        self.user_id = ""
+        self.problem_content = ""
+        self.editor_code = ""
+        self.code_version = 0
+        self.window = 0
+        self._seq = 0
+        self._acked = 0
+        self._window_changed = asyncio.Condition()
+        self._send_lock = asyncio.Lock()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._closed = False
+
+    async def run(self):
+        """处理客户端消息直到连接关闭，关闭时取消所有未完成的问题"""
+        WS_SESSIONS.inc()
+        try:
+            while True:
+                text = await self.websocket.receive_text()
+                try:
+                    if len(text.encode("utf-8")) > WS_MAX_MESSAGE_BYTES:
+                        raise ProtocolError("消息过大")
+                    try:
+                        message = json.loads(text)
+                    except json.JSONDecodeError:
+                        raise ProtocolError("消息不是JSON")
+                    if not isinstance(message, dict):
+                        raise ProtocolError("消息不是JSON对象")
+                    WS_MESSAGES.inc(direction="in", type=str(message.get("type")))
+                    await self._dispatch(message)
+                except (ProtocolError, TypeError, ValueError) as e:
+                    await self._send({"type": "error", "data": {"reason": "protocol", "message": str(e)}})
+        except WebSocketDisconnect:
+            logger.info(f"WebSocket会话断开 - 会话: {self.session_id}")
+        finally:
+            self._closed = True
+            answer_prefetcher.unsubscribe(self.session_id)
+            tasks = list(self._tasks.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            WS_SESSIONS.dec()
+
+    async def _dispatch(self, message: Dict[str, Any]):
+        kind = message.get("type")
+        if kind == "hello":
+            await self._hello(message)
+        elif kind == "problem":
+            self.problem_content = str(message.get("problem_content", ""))
+            await self._send({"type": "problem_ack"})
+        elif kind == "code":
+            self.editor_code = str(message.get("editor_code", ""))
+            self.code_version += 1
+            await self._send({"type": "code_ack", "data": {"version": self.code_version}})
+        elif kind == "code_patch":
+            await self._patch(message)
+        elif kind == "ask":
+            await self._ask(message)
+        elif kind == "cancel":
+            task = self._tasks.get(str(message.get("id")))
+            if task is not None:
+                task.cancel()
+        elif kind == "ack":
+            async with self._window_changed:
+                self._acked = max(self._acked, int(message.get("seq", 0)))
+                self._window_changed.notify_all()
+        elif kind == "ping":
+            await self._send({"type": "pong"})
+        else:
+            raise ProtocolError(f"未知的消息类型: {kind}")
+
+    async def _hello(self, message: Dict[str, Any]):
+        """开始会话：绑定会话和用户，可同时发送题目和代码，声明背压窗口以及是否接收预取回答的推送"""
+        window = min(max(int(message.get("window", 0)), 0), WS_MAX_WINDOW)
+        answer_prefetcher.unsubscribe(self.session_id)
+        self.session_id = str(message.get("session_id") or self.session_id)
+        self.user_id = str(message.get("user_id") or "")
+        self.problem_content = str(message.get("problem_content", self.problem_content))
+        if "editor_code" in message:
+            self.editor_code = str(message["editor_code"])
+            self.code_version += 1
+        self.window = window
+        if message.get("push_prefetched"):
+            answer_prefetcher.subscribe(self.session_id, self._on_prefetched)
+        logger.info(f"WebSocket会话开始 - 会话: {self.session_id}, 窗口: {self.window}")
+        await self._send({"type": "ready", "data": {"session_id": self.session_id,
+                                                    "code_version": self.code_version}})
+
+    async def _patch(self, message: Dict[str, Any]):
+        """按行替换代码；基于的版本与服务端不一致时返回当前版本，客户端需重新发送完整代码"""
+        if message.get("base_version") != self.code_version:
+            await self._send({"type": "error", "data": {"reason": "code_version", "version": self.code_version}})
+            return
+        try:
+            start, end, lines = int(message["start"]), int(message["end"]), list(message.get("lines", []))
+        except (KeyError, TypeError, ValueError):
+            raise ProtocolError("补丁缺少start或end")
+        self.editor_code = apply_patch(self.editor_code, start, end, lines)
+        self.code_version += 1
+        await self._send({"type": "code_ack", "data": {"version": self.code_version}})
+
+    async def _ask(self, message: Dict[str, Any]):
+        question_id = str(message.get("id") or request_context.new_request_id())
+        query = str(message.get("query", "")).strip()
+        if not query:
+            raise ProtocolError("问题为空")
+        if question_id in self._tasks:
+            raise ProtocolError(f"问题ID重复: {question_id}")
+        if len(self._tasks) >= WS_MAX_INFLIGHT:
+            await self._send({"id": question_id, "type": "rejected",
+                              "data": {"reason": "inflight", "retry_after_seconds": 0,
+                                       "message": "上一个问题还在回答中，请稍候"}})
+            return
+        try:
+            deadline = deadlines.new_deadline(float(message.get("timeout") or 0))
+        except (TypeError, ValueError):
+            raise ProtocolError("timeout不是数字")
+        self._tasks[question_id] = asyncio.create_task(
+            self._answer(question_id, query, deadline, message.get("profile_token")))
+
+    async def _answer(self, question_id: str, query: str, deadline: float, profile_token: Optional[str] = None):
+        """回答一个问题，事件带上问题ID发送，最后发送done事件"""
+        started = time.perf_counter()
+        framer = StreamFramer()
+        cancelled = False
+        request_id = request_context.new_request_id()
+        try:
+            with request_profiler.profile("ws", request_id, profile_token), \
+                    request_context.bind(session_id=self.session_id, user_id=self.user_id,
+                                         request_id=request_id, deadline=deadline):
+                async with aclosing(recognition_server.process_request_stream(
+                    query=query,
+                    problem_content=self.problem_content,
+                    editor_code=self.editor_code
+                )) as events:
+                    async with aclosing(fair_scheduler.with_queue_events(events)) as merged:
+                        async with aclosing(framer.coalesce(merged)) as coalesced:
+                            async for event in coalesced:
+                                await self._send_flow({"id": question_id, **event})
+        except asyncio.CancelledError:
+            cancelled = True
+            if self._closed:
+                raise
+        except Exception as e:
+            logger.error(f"WebSocket会话回答问题时出错: {str(e)}")
+            await self._send_flow({"id": question_id, "type": "error", "data": f"处理请求时出错: {str(e)}"})
+        finally:
+            self._tasks.pop(question_id, None)
+        await self._send({"id": question_id, "type": "done", "data": {
+            "cancelled": cancelled,
+            "deltas": framer.deltas,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+        }})
+
+    def _on_prefetched(self, question: str, answer: str):
+        """预取完成时推送回答（客户端在hello中声明push_prefetched时），学生点击对应的预测问题前即可显示"""
+        if self._closed or output_guard.check(answer):
+            return
+        logger.info(f"推送预取回答: {format_payload(question, 100)}")
+        task = asyncio.get_running_loop().create_task(
+            self._send_flow({"type": "prefetched", "data": {"question": question, "answer": answer}}))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def _send_flow(self, message: Dict[str, Any]):
+        """发送受背压窗口控制的消息：带序号，未确认的消息达到窗口时等待客户端确认"""
+        if self.window:
+            async with self._window_changed:
+                if self._seq - self._acked >= self.window:
+                    waited = time.perf_counter()
+                    await self._window_changed.wait_for(lambda: self._seq - self._acked < self.window)
+                    WS_WINDOW_WAIT.observe(time.perf_counter() - waited)
+                self._seq += 1
+                message["seq"] = self._seq
+        await self._send(message)
+
+    async def _send(self, message: Dict[str, Any]):
+        """发送一条消息，连接已关闭时丢弃"""
+        if self._closed:
+            return
+        async with self._send_lock:
+            WS_MESSAGES.inc(direction="out", type=str(message.get("type")))
+            try:
+                await self.websocket.send_text(json.dumps(message, ensure_ascii=False))
+            except Exception as e:
+                # 连接已断开，接收循环随后结束并取消未完成的问题
+                self._closed = True
+                logger.info(f"WebSocket发送失败，连接已断开: {str(e)}")
@@ -0,0 +1,92 @@
+import json
+import random
+from types import SimpleNamespace
+import pytest
+import ui
+from ui import code_patch, ws_send_context
+from ws_session import ProtocolError, apply_patch
+
+
+def _apply(old, new):
+    patch = code_patch(old, new)
+    return old if patch is None else apply_patch(old, patch["start"], patch["end"], patch["lines"])
+
+
+@pytest.mark.parametrize("old, new", [
+    ("a\nb\nc", "x\na\nb\nc"),
+    ("a\nb\nc", "a\nb\nc\nx"),
+    ("a\nb\nc", "a\nx\ny\nc"),
+    ("a\nb\nc", ""),
+    ("", "a\nb"),
+    ("a\nb\nb\nc", "a\nb\nc"),
+    ("a\n", "a\n\n"),
+])
+def test_patch_round_trip(old, new):
+    assert _apply(old, new) == new
+
+
+def test_patch_round_trip_random_edits():
+    rng = random.Random(1)
+    for _ in range(2000):
+        old = [rng.choice(["a", "b", "", "    c"]) for _ in range(rng.randint(0, 6))]
+        new = list(old)
+        for _ in range(rng.randint(0, 3)):
+            op = rng.random()
+            if op < 0.3 and new:
+                new.pop(rng.randrange(len(new)))
+            elif op < 0.6:
+                new.insert(rng.randint(0, len(new)), rng.choice(["x", "y", ""]))
+            elif new:
+                new[rng.randrange(len(new))] = "z"
+        assert _apply("\n".join(old), "\n".join(new)) == "\n".join(new)
+
+
+def test_code_patch_only_sends_changed_lines():
+    assert code_patch("a\nb", "a\nb") is None
+    assert code_patch("a\nb\nc\nd", "a\nx\nc\nd") == {"start": 2, "end": 3, "lines": ["x"]}
+    # 纯插入时start == end
+    assert code_patch("a\nb", "a\nx\nb") == {"start": 2, "end": 2, "lines": ["x"]}
+
+
+@pytest.mark.parametrize("start, end", [(0, 1), (2, 1), (1, 5), (5, 5)])
+def test_apply_patch_rejects_out_of_range(start, end):
+    with pytest.raises(ProtocolError):
+        apply_patch("a\nb\nc", start, end, [])
+
+
+class _FakeWebSocket:
+    """按顺序返回预置的服务端消息，记录客户端发送的消息"""
+
+    def __init__(self, replies):
+        self.replies = [json.dumps(reply) for reply in replies]
+        self.sent = []
+
+    def send(self, text):
+        self.sent.append(json.loads(text))
+
+    def recv(self, timeout=None):
+        return self.replies.pop(0)
+
+
+def _send_context(monkeypatch, replies):
+    state = {"problem_content": "p", "editor_code": "a\nb", "code_version": 1}
+    monkeypatch.setattr(ui, "st", SimpleNamespace(session_state=SimpleNamespace(ws_state=state)))
+    ws = _FakeWebSocket(replies)
+    return ws, state
+
+
+def test_send_context_resends_full_code_once(monkeypatch):
+    conflict = {"type": "error", "data": {"reason": "code_version", "version": 3}}
+    ws, state = _send_context(monkeypatch, [conflict, {"type": "code_ack", "data": {"version": 4}}])
+    ws_send_context(ws, "p", "a\nc")
+    assert [m["type"] for m in ws.sent] == ["code_patch", "code"]
+    assert state["editor_code"] == "a\nc" and state["code_version"] == 4
+
+
+def test_send_context_gives_up_after_one_resend(monkeypatch):
+    error = {"type": "error", "data": {"reason": "protocol", "message": "消息过大"}}
+    ws, state = _send_context(monkeypatch, [error, error, error])
+    with pytest.raises(RuntimeError):
+        ws_send_context(ws, "p", "a\nc")
+    assert [m["type"] for m in ws.sent] == ["code_patch", "code"]
+    assert state["editor_code"] == "a\nb"